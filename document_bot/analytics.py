@@ -3,9 +3,14 @@ import json
 import logging
 import os
 import time
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Callable
 
-from document_bot.metrics_prom import LLM_LAT_MS
+from document_bot.metrics_prom import LLM_LAT_MS, VALIDATOR_LAT_MS, CACHE_LOOKUPS, CACHE_LATENCY_SAVED_MS, CACHE_AUDITS, \
+    MODEL_ROUTES, MODEL_ROUTE_LAT_MS, MODEL_ROUTE_COST_USD, HEDGES, RETRIES, CIRCUIT_STATE, CIRCUIT_REJECTIONS, \
+    ADMISSION_IN_FLIGHT, ADMISSION_QUEUE_DEPTH, ADMISSION_WAIT_MS, ADMISSION_REJECTIONS, \
+    HTTP_POOL_CONNECTIONS, HTTP_POOLS, LLM_TOKENS, LLM_COST_USD, QUOTA_REJECTIONS
+
+CIRCUIT_STATES = {"closed": 0, "half_open": 1, "open": 2}
 
 ENABLED = os.getenv("ANALYTICS_ENABLED", "True") == "True"
 log = logging.getLogger("analytics")
@@ -58,6 +63,21 @@ def record_llm_call(model: str, ok: bool, duration_ms: float,
     })
 
 
+def record_token_usage(stage: str, model: str, tokens: Dict[str, int], cost_usd: Optional[float],
+                       user_id: Optional[str] = None):
+    for kind in ("prompt", "cached", "completion"):
+        LLM_TOKENS.labels(stage=stage, model=model, kind=kind).inc(tokens.get(kind, 0))
+    if cost_usd is not None:
+        LLM_COST_USD.labels(stage=stage, model=model).inc(cost_usd)
+    emit("token_usage", {
+        "stage": stage,
+        "model": model,
+        "tokens": tokens,
+        "user_id": _safe(user_id),
+        **({"cost_usd": round(cost_usd, 6)} if cost_usd is not None else {})
+    })
+
+
 def record_validation_event(validator_name: str, question: str, passed: bool,
                             duration_ms: float, reason: Optional[str] = None,
                             user_id: Optional[str] = None, meta: Optional[Dict[str, Any]] = None):
@@ -72,6 +92,24 @@ def record_validation_event(validator_name: str, question: str, passed: bool,
     })
 
 
+def record_validator_duration(validator_name: str, duration_ms: float):
+    VALIDATOR_LAT_MS.labels(validator=validator_name).observe(duration_ms)
+
+
+def record_document_validation_event(validator_name: str, passed: bool, duration_ms: float, num_chunks: int,
+                                     reason: Optional[str] = None, user_id: Optional[str] = None,
+                                     meta: Optional[Dict[str, Any]] = None):
+    emit("document_validation", {
+        "validator": validator_name,
+        "passed": passed,
+        "duration_ms": round(duration_ms, 2),
+        "num_chunks": num_chunks,
+        **({"reason": reason} if reason else {}),
+        **({"user_id": _safe(user_id)} if user_id else {}),
+        **(meta or {})
+    })
+
+
 def record_question_attempt(user_id: Optional[str], flagged: bool,
                            validator_failed: Optional[str] = None,
                            is_recovery: bool = False):
@@ -81,3 +119,93 @@ def record_question_attempt(user_id: Optional[str], flagged: bool,
         "is_recovery": is_recovery,
         **({"validator_failed": validator_failed} if validator_failed else {})
     })
+
+
+def record_cache_lookup(cache: str, hit: bool, meta: Optional[Dict[str, Any]] = None, count: int = 1,
+                        latency_saved_ms: Optional[float] = None):
+    CACHE_LOOKUPS.labels(cache=cache, result="hit" if hit else "miss").inc(count)
+    if latency_saved_ms is not None:
+        CACHE_LATENCY_SAVED_MS.labels(cache=cache).inc(latency_saved_ms)
+    emit("cache_lookup", {
+        "cache": cache,
+        "hit": hit,
+        **({"count": count} if count != 1 else {}),
+        **({"latency_saved_ms": round(latency_saved_ms, 2)} if latency_saved_ms is not None else {}),
+        **(meta or {})
+    })
+
+
+def record_cache_audit(cache: str, agreed: bool, meta: Optional[Dict[str, Any]] = None):
+    CACHE_AUDITS.labels(cache=cache, result="agreed" if agreed else "disagreed").inc()
+    emit("cache_audit", {
+        "cache": cache,
+        "agreed": agreed,
+        **(meta or {})
+    })
+
+
+def record_model_route(tier: str, model: str, outcome: str, duration_ms: float,
+                       tokens: Optional[Dict[str, int]] = None, cost_usd: Optional[float] = None,
+                       meta: Optional[Dict[str, Any]] = None):
+    MODEL_ROUTES.labels(tier=tier, model=model, outcome=outcome).inc()
+    MODEL_ROUTE_LAT_MS.labels(tier=tier).observe(duration_ms)
+    if cost_usd is not None:
+        MODEL_ROUTE_COST_USD.labels(tier=tier, model=model).inc(cost_usd)
+    emit("model_route", {
+        "tier": tier,
+        "model": model,
+        "outcome": outcome,
+        "duration_ms": round(duration_ms, 2),
+        **({"tokens": tokens} if tokens else {}),
+        **({"cost_usd": round(cost_usd, 6)} if cost_usd is not None else {}),
+        **(meta or {})
+    })
+
+
+def record_hedge(operation: str, result: str):
+    HEDGES.labels(operation=operation, result=result).inc()
+    debug("hedged_request", {"operation": operation, "result": result})
+
+
+def record_retry(operation: str, result: str, e: Exception):
+    RETRIES.labels(operation=operation, result=result).inc()
+    emit("request_retry", {"operation": operation, "result": result, "error": type(e).__name__})
+
+
+def record_circuit_state(dependency: str, state: str):
+    CIRCUIT_STATE.labels(dependency=dependency).set(CIRCUIT_STATES[state])
+    (emit if state == "closed" else error)("circuit_breaker", {"dependency": dependency, "state": state})
+
+
+def record_circuit_rejection(dependency: str):
+    CIRCUIT_REJECTIONS.labels(dependency=dependency).inc()
+
+
+def record_admission(resource: str, in_flight: int, queue_depth: int):
+    ADMISSION_IN_FLIGHT.labels(resource=resource).set(in_flight)
+    ADMISSION_QUEUE_DEPTH.labels(resource=resource).set(queue_depth)
+
+
+def record_admission_wait(resource: str, wait_ms: float):
+    ADMISSION_WAIT_MS.labels(resource=resource).observe(wait_ms)
+
+
+def record_admission_rejection(resource: str, reason: str, in_flight: int, queue_depth: int):
+    ADMISSION_REJECTIONS.labels(resource=resource, reason=reason).inc()
+    error("admission_rejected", {"resource": resource, "reason": reason, "in_flight": in_flight,
+                                 "queue_depth": queue_depth})
+
+
+def record_quota_rejection(scope: str, resource: str, stage: str, user_id: Optional[str] = None):
+    QUOTA_REJECTIONS.labels(scope=scope, resource=resource, stage=stage).inc()
+    error("quota_exceeded", {"scope": scope, "resource": resource, "stage": stage, "user_id": _safe(user_id)})
+
+
+def track_http_pool(client: str, stats: Callable[[], Dict[str, int]]):
+    """Report the client's connections in use and its pools on each scrape, read from stats()."""
+    HTTP_POOL_CONNECTIONS.labels(client=client, state="active").set_function(lambda: stats()["active"])
+    HTTP_POOLS.labels(client=client).set_function(lambda: stats()["pools"])
+
+
+def record_degraded_answer(reason: str, num_passages: int, meta: Optional[Dict[str, Any]] = None):
+    error("degraded_answer", {"reason": reason, "num_passages": num_passages, **(meta or {})})
@@ -1,4 +1,4 @@
-from prometheus_client import Histogram
+from prometheus_client import Counter, Gauge, Histogram
 
 LLM_LAT_MS = Histogram(
     "llm_latency_ms",
@@ -6,5 +6,128 @@ LLM_LAT_MS = Histogram(
     buckets=(50, 100, 200, 400, 800, 1600, 3200, 6400),
 )
 
+VALIDATOR_LAT_MS = Histogram(
+    "validator_latency_ms",
+    "Latency of each question validator (ms)",
+    ["validator"],
+    buckets=(1, 5, 25, 50, 100, 200, 400, 800, 1600),
+)
+
+CACHE_LOOKUPS = Counter(
+    "cache_lookups_total",
+    "Cache lookups by cache and result",
+    ["cache", "result"],
+)
+
+CACHE_LATENCY_SAVED_MS = Counter(
+    "cache_latency_saved_ms_total",
+    "Generation time saved by cache hits (ms)",
+    ["cache"],
+)
+
+CACHE_AUDITS = Counter(
+    "cache_audits_total",
+    "Sampled re-generations of cache hits by cache and result",
+    ["cache", "result"],
+)
+
+MODEL_ROUTES = Counter(
+    "model_routes_total",
+    "Generations by model tier and outcome",
+    ["tier", "model", "outcome"],
+)
+
+MODEL_ROUTE_LAT_MS = Histogram(
+    "model_route_latency_ms",
+    "Latency of generations by model tier, fallback included (ms)",
+    ["tier"],
+    buckets=(50, 100, 200, 400, 800, 1600, 3200, 6400, 12800),
+)
+
+MODEL_ROUTE_COST_USD = Counter(
+    "model_route_cost_usd_total",
+    "Estimated token cost of generations by model tier (USD)",
+    ["tier", "model"],
+)
+
+HEDGES = Counter(
+    "hedged_requests_total",
+    "Duplicate requests fired to a slow dependency, and how many of them answered first",
+    ["operation", "result"],
+)
+
+RETRIES = Counter(
+    "request_retries_total",
+    "Retries of transient errors by operation and result",
+    ["operation", "result"],
+)
+
+CIRCUIT_STATE = Gauge(
+    "circuit_breaker_state",
+    "State of each dependency's circuit breaker (0 closed, 1 half open, 2 open)",
+    ["dependency"],
+)
+
+CIRCUIT_REJECTIONS = Counter(
+    "circuit_breaker_rejections_total",
+    "Calls failed fast because the dependency's circuit was open",
+    ["dependency"],
+)
+
+ADMISSION_IN_FLIGHT = Gauge(
+    "admission_in_flight",
+    "Calls holding one of the resource's concurrency slots in this process",
+    ["resource"],
+)
+
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "admission_queue_depth",
+    "Calls waiting for one of the resource's concurrency slots in this process",
+    ["resource"],
+)
+
+ADMISSION_WAIT_MS = Histogram(
+    "admission_wait_ms",
+    "Time admitted calls waited for a concurrency slot (ms)",
+    ["resource"],
+    buckets=(1, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000),
+)
+
+ADMISSION_REJECTIONS = Counter(
+    "admission_rejections_total",
+    "Calls turned away because the resource's queue was full or the wait too long",
+    ["resource", "reason"],
+)
+
+HTTP_POOL_CONNECTIONS = Gauge(
+    "http_pool_connections",
+    "Connections of a shared HTTP client's pools by state (active: serving a request)",
+    ["client", "state"],
+)
+
+HTTP_POOLS = Gauge(
+    "http_pools",
+    "Connection pools of a shared HTTP client, one per event loop for an async client",
+    ["client"],
+)
+
+LLM_TOKENS = Counter(
+    "llm_tokens_total",
+    "Tokens of OpenAI calls by stage, model and kind (prompt, cached prompt, completion)",
+    ["stage", "model", "kind"],
+)
+
+LLM_COST_USD = Counter(
+    "llm_cost_usd_total",
+    "Estimated token cost of OpenAI calls by stage and model (USD)",
+    ["stage", "model"],
+)
+
+QUOTA_REJECTIONS = Counter(
+    "quota_rejections_total",
+    "Requests and model calls turned away because a session or the service was over its budget",
+    ["scope", "resource", "stage"],
+)
+
 def observe_llm(ms: float) -> None:
     LLM_LAT_MS.observe(ms)
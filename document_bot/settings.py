@@ -125,6 +125,24 @@ STATIC_ROOT = 'build/static'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# File uploads
+# https://docs.djangoproject.com/en/5.2/topics/http/file-uploads/
+
+LOCAL_STORAGE_PATH = os.getenv("LOCAL_STORAGE_PATH", "local_storage")
+UPLOAD_SAMPLE_BYTES = int(os.getenv("UPLOAD_SAMPLE_BYTES", str(64 * 1024)))
+METADATA_CACHE_PATH = os.getenv("METADATA_CACHE_PATH", os.path.join(LOCAL_STORAGE_PATH, ".metadata_cache"))
+
+FILE_UPLOAD_HANDLERS = [
+    'home.app.content_addressed_upload_handler.ContentAddressedUploadHandler',
+]
+
+# Time budget of a question, from the request to the answer, shared by every outbound call
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "30"))
+# Time budget of uploading a file, the question's own budget starts once the upload is done
+UPLOAD_DEADLINE_SECONDS = float(os.getenv("UPLOAD_DEADLINE_SECONDS", "120"))
+# Questions accepted in a single batch request
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "500"))
+
 if DEBUG == "False":
     sentry_sdk.init(
         dsn=os.environ["SENTRY_DSN"],
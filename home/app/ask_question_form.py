@@ -1,22 +1,30 @@
+import asyncio
 import os
+from typing import AsyncIterator
 
 from django import forms
+from django.conf import settings
 
 from home.domain.ai_assistant import AiAssistant
 from home.domain.composite_question_validator import CompositeQuestionValidator
+from home.domain.deadline import Deadline, deadline_scope
 from home.domain.file_uploader import FileUploader
 from home.domain.max_length_validator import MaxLengthValidator
+from home.infrastructure.file_metadata_cache import FileMetadataCache
+from home.infrastructure.heuristic_metadata_extractor import HeuristicMetadataExtractor
 from home.infrastructure.open_ai_metadata_extractor import OpenAIMetadataExtractor
+from home.infrastructure.openai_moderation_document_validator import OpenAIModerationDocumentValidator
 from home.infrastructure.openai_moderation_validator import OpenAIModerationValidator
 from home.infrastructure.pinecone_document_repository import PineconeDocumentRepository
-from home.messages_repository import add_message
+from home.messages_repository import add_message, aadd_message
 
-LOCAL_STORAGE_PATH = "local_storage"
+LOCAL_STORAGE_PATH = settings.LOCAL_STORAGE_PATH
 
+moderation_validator = OpenAIModerationValidator(api_key=os.environ.get("OPENAI_API_KEY"))
 question_validator = CompositeQuestionValidator([
     MaxLengthValidator(max_length=1000),
-    OpenAIModerationValidator(api_key=os.environ.get("OPENAI_API_KEY"))
-])
+    moderation_validator
+], concurrent=True)
 
 
 class AskQuestionForm(forms.Form):
@@ -27,8 +35,14 @@ class AskQuestionForm(forms.Form):
         question_validator=question_validator,
     )
     file_uploader = FileUploader(
-        OpenAIMetadataExtractor(api_key=os.environ.get("OPENAI_API_KEY")),
+        OpenAIMetadataExtractor(
+            api_key=os.environ.get("OPENAI_API_KEY"),
+            cache=FileMetadataCache(settings.METADATA_CACHE_PATH),
+            fast_path=HeuristicMetadataExtractor(),
+        ),
         document_repository,
+        document_validator=OpenAIModerationDocumentValidator(api_key=os.environ.get("OPENAI_API_KEY"),
+                                                             breaker=moderation_validator.breaker),
     )
     file = forms.FileField(required=False)
     question = forms.CharField(label="Question:", widget=forms.TextInput(attrs={'placeholder': 'Type a question.'}))
@@ -37,10 +51,60 @@ class AskQuestionForm(forms.Form):
         question = self.cleaned_data["question"]
         add_message('user', question)
 
-        new_document = None
-        if file:
-            new_document = self.file_uploader.upload_file(f"{LOCAL_STORAGE_PATH}/{file.name}")
+        new_document = self._upload_file(file, user_id)
 
-        answer = self.ai_assistant.answer(question, new_document, user_id=user_id)
+        with deadline_scope(question_deadline()):
+            answer = self.ai_assistant.answer(question, new_document, user_id=user_id)
 
         add_message('assistant', answer)
+
+    async def aupload_and_ask_question(self, file, user_id=None):
+        question = self.cleaned_data["question"]
+        await aadd_message('user', question)
+
+        new_document = await self._aupload_file(file, user_id)
+
+        with deadline_scope(question_deadline()):
+            answer = await self.ai_assistant.aanswer(question, new_document, user_id=user_id)
+
+        await aadd_message('assistant', answer)
+        return answer
+
+    async def aupload_and_stream_answer(self, file, user_id=None) -> AsyncIterator[dict]:
+        """
+        Upload the file, then return the answer events of AiAssistant.astream_answer.
+
+        The file is uploaded before returning, so an invalid document raises before any event is sent.
+        The events are meant to be consumed within a question_deadline() started after this returns.
+        """
+        question = self.cleaned_data["question"]
+        await aadd_message('user', question)
+
+        new_document = await self._aupload_file(file, user_id)
+
+        return self._astream_answer(question, new_document, user_id)
+
+    async def _astream_answer(self, question, new_document, user_id) -> AsyncIterator[dict]:
+        async for event in self.ai_assistant.astream_answer(question, new_document, user_id=user_id):
+            if event["type"] == "answer":
+                await aadd_message('assistant', event["answer"].to_string())
+            yield event
+
+    def _upload_file(self, file, user_id):
+        if not file:
+            return None
+
+        stored_file = getattr(file, "stored_file", None)
+        file_path = stored_file.file_path if stored_file else f"{LOCAL_STORAGE_PATH}/{file.name}"
+        # A large file takes longer than a question, it has its own budget so it doesn't eat the question's
+        with deadline_scope(Deadline.after(settings.UPLOAD_DEADLINE_SECONDS)):
+            return self.file_uploader.upload_file(file_path, stored_file=stored_file, user_id=user_id)
+
+    async def _aupload_file(self, file, user_id):
+        # The upload pipeline blocks on file IO and its own thread pools, keep it off the event loop
+        return await asyncio.to_thread(self._upload_file, file, user_id)
+
+
+def question_deadline() -> Deadline:
+    """The deadline of answering a question, started once its file is uploaded."""
+    return Deadline.after(settings.REQUEST_DEADLINE_SECONDS)
@@ -0,0 +1,96 @@
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+
+from document_bot.analytics import debug
+from home.domain.stored_file import StoredFile
+from home.infrastructure.content_hash import new_content_hasher
+
+
+class ContentAddressedUploadedFile(UploadedFile):
+    """A file already stored under its content hash, with its hash, size and samples."""
+
+    def __init__(self, stored_file: StoredFile, name, content_type, charset, content_type_extra=None):
+        super().__init__(open(stored_file.file_path, 'rb'), name, content_type, stored_file.file_size, charset,
+                         content_type_extra)
+        self.stored_file = stored_file
+
+    def temporary_file_path(self):
+        return self.stored_file.file_path
+
+
+class ContentAddressedUploadHandler(FileUploadHandler):
+    """
+    Stream uploads straight to LOCAL_STORAGE_PATH/<content hash>/<file name>.
+
+    The content hash, size and a head/tail sample are computed while the bytes
+    go to disk, so later stages don't need to read the file again for them.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.storage_path = settings.LOCAL_STORAGE_PATH
+        self.sample_bytes = settings.UPLOAD_SAMPLE_BYTES
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+
+        staging_path = os.path.join(self.storage_path, ".uploads")
+        os.makedirs(staging_path, exist_ok=True)
+
+        self.file = tempfile.NamedTemporaryFile(dir=staging_path, delete=False)
+        self.hasher = new_content_hasher()
+        self.head = bytearray()
+        self.tail = b""
+
+    def receive_data_chunk(self, raw_data, start):
+        self.file.write(raw_data)
+        self.hasher.update(raw_data)
+
+        if len(self.head) < self.sample_bytes:
+            self.head += raw_data[:self.sample_bytes - len(self.head)]
+        self.tail = (self.tail + raw_data)[-self.sample_bytes:]
+
+        # The data has been consumed, later handlers don't need to see it
+        return None
+
+    def file_complete(self, file_size):
+        self.file.close()
+
+        content_hash = self.hasher.hexdigest()
+        file_name = os.path.basename(self.file_name)
+        file_path = os.path.join(self.storage_path, content_hash, file_name)
+
+        if os.path.exists(file_path):
+            os.unlink(self.file.name)
+        else:
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            os.replace(self.file.name, file_path)
+
+        debug("file_stored", {"content_hash": content_hash, "file_size": file_size})
+
+        stored_file = StoredFile(
+            file_path=file_path,
+            content_hash=content_hash,
+            file_size=file_size,
+            head=bytes(self.head),
+            tail=self.tail,
+        )
+        return ContentAddressedUploadedFile(
+            stored_file,
+            file_name,
+            self.content_type,
+            self.charset,
+            self.content_type_extra,
+        )
+
+    def upload_interrupted(self):
+        if hasattr(self, "file"):
+            self.file.close()
+            try:
+                os.unlink(self.file.name)
+            except FileNotFoundError:
+                pass
@@ -25,5 +25,9 @@ def trigger_error(request):
 urlpatterns = [
     path('', views.HomePageView.as_view(), name='home'),
     path('clear_messages', views.clear_messages),
+    path('ask_question', views.ask_question),
+    path('stream_answer', views.stream_answer),
+    path('answer_batch', views.answer_batch),
+    path('quota', views.quota),
     path('sentry-debug/', trigger_error),
 ]
@@ -1,12 +1,27 @@
-from django.http import JsonResponse
+import json
+
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.http import require_http_methods
 from django.views.generic import FormView
 
 from document_bot.analytics import error
-from home.app.ask_question_form import AskQuestionForm
+from home.app.ask_question_form import AskQuestionForm, question_deadline
+from home.domain.deadline import Deadline, deadline_scope
+from home.domain.deadline_exceeded_error import DeadlineExceededError
+from home.domain.dependency_unavailable_error import DependencyUnavailableError
+from home.domain.invalid_document_error import InvalidDocumentError
 from home.domain.invalid_question_error import InvalidQuestionError
+from home.domain.overloaded_error import OverloadedError
+from home.domain.quota_exceeded_error import QuotaExceededError
+from home.domain.token_usage import usage_scope
 from home.messages_repository import get_messages, delete_messages
 
+UNAVAILABLE_MESSAGE = 'The assistant is temporarily unavailable. Please try again in a moment.'
+DEADLINE_MESSAGE = 'The assistant took too long to answer. Please try again.'
+OVERLOADED_MESSAGE = 'The assistant is busy answering other questions. Please try again in a moment.'
+QUOTA_MESSAGE = 'You have reached your usage limit for now. Please try again later.'
+
 
 class HomePageView(FormView):
     template_name = 'home/home.html'
@@ -19,13 +34,14 @@ class HomePageView(FormView):
         return context
 
     def form_valid(self, form):
-        user_id = self.request.session.session_key
-        if not user_id:
-            self.request.session.create()
-            user_id = self.request.session.session_key
+        user_id = _get_user_id(self.request)
 
         try:
-            form.upload_and_ask_question(self.request.FILES.get("file"), user_id=user_id)
+            # Uploads are accounted to the session too, their metadata extraction and embeddings cost tokens.
+            # The form gives the upload and the question their own deadlines.
+            with usage_scope(user_id):
+                _usage_budget().acquire_requests(user_id)
+                form.upload_and_ask_question(self.request.FILES.get("file"), user_id=user_id)
         except InvalidQuestionError as e:
             error("form_valid", {
                 "message": "Invalid question",
@@ -35,6 +51,34 @@ class HomePageView(FormView):
             })
             form.add_error('question', str(e) if str(e) else 'Your question is not appropriate or valid. Please try a different question.')
             return self.form_invalid(form)
+        except InvalidDocumentError as e:
+            error("form_valid", {
+                "message": "Invalid document",
+                "error": str(e),
+                "user_id": user_id
+            })
+            form.add_error('file', str(e) if str(e) else 'Your document is not appropriate or valid. Please try a different document.')
+            return self.form_invalid(form)
+        except DependencyUnavailableError as e:
+            error("form_valid", {"message": "Dependency unavailable", "error": str(e), "user_id": user_id})
+            form.add_error(None, UNAVAILABLE_MESSAGE)
+            return self.form_invalid(form)
+        except DeadlineExceededError as e:
+            error("form_valid", {"message": "Deadline exceeded", "error": str(e), "user_id": user_id})
+            form.add_error(None, DEADLINE_MESSAGE)
+            return self.form_invalid(form)
+        except OverloadedError as e:
+            error("form_valid", {"message": "Overloaded", "error": str(e), "user_id": user_id})
+            form.add_error(None, OVERLOADED_MESSAGE)
+            response = self.form_invalid(form)
+            response['Retry-After'] = str(e.retry_after_seconds)
+            return response
+        except QuotaExceededError as e:
+            error("form_valid", {"message": "Quota exceeded", "error": str(e), "user_id": user_id})
+            form.add_error(None, QUOTA_MESSAGE)
+            response = self.form_invalid(form)
+            response['Retry-After'] = str(e.retry_after_seconds)
+            return response
         except Exception as e:
             error("form_valid", {
                 "message": "Unexpected error",
@@ -48,10 +92,291 @@ class HomePageView(FormView):
         return super(HomePageView, self).form_valid(form)
 
 
+def _overloaded_response(e: OverloadedError) -> JsonResponse:
+    # A full queue means too many requests, a queue too slow to drain means the service can't keep up
+    status = 429 if e.reason == "queue_full" else 503
+    response = JsonResponse({'success': False, 'errors': {'__all__': [OVERLOADED_MESSAGE]}}, status=status)
+    response['Retry-After'] = str(e.retry_after_seconds)
+    return response
+
+
+def _quota_response(e: QuotaExceededError) -> JsonResponse:
+    response = JsonResponse({'success': False, 'errors': {'__all__': [QUOTA_MESSAGE]}}, status=429)
+    response['Retry-After'] = str(e.retry_after_seconds)
+    return response
+
+
+def _usage_budget():
+    return AskQuestionForm.ai_assistant.usage_budget
+
+
+def _get_user_id(request):
+    if not request.session.session_key:
+        request.session.create()
+    return request.session.session_key
+
+
+async def _aget_user_id(request):
+    if not request.session.session_key:
+        await request.session.acreate()
+    return request.session.session_key
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _stream_events(form, events, user_id, deadline: Deadline):
+    try:
+        # The events are produced while the response streams, after the view has returned
+        with deadline_scope(deadline), usage_scope(user_id):
+            async for event in events:
+                if event["type"] == "token":
+                    yield _sse("token", {"text": event["text"]})
+                elif event["type"] == "answer":
+                    answer = event["answer"]
+                    yield _sse("answer", {
+                        "answer": answer.answer,
+                        "citations": [{"source_id": citation.source_id, "quote": citation.quote}
+                                      for citation in answer.citations],
+                        "content": answer.to_string(),
+                    })
+    except InvalidQuestionError as e:
+        error("stream_answer", {
+            "message": "Invalid question",
+            "error": str(e),
+            "question": form.cleaned_data.get("question"),
+            "user_id": user_id
+        })
+        yield _sse("error", {
+            "field": "question",
+            "message": str(e) if str(e) else 'Your question is not appropriate or valid. Please try a different question.'
+        })
+    except DependencyUnavailableError as e:
+        error("stream_answer", {"message": "Dependency unavailable", "error": str(e), "user_id": user_id})
+        yield _sse("error", {"field": None, "message": UNAVAILABLE_MESSAGE})
+    except DeadlineExceededError as e:
+        error("stream_answer", {"message": "Deadline exceeded", "error": str(e), "user_id": user_id})
+        yield _sse("error", {"field": None, "message": DEADLINE_MESSAGE})
+    except OverloadedError as e:
+        error("stream_answer", {"message": "Overloaded", "error": str(e), "user_id": user_id})
+        yield _sse("error", {"field": None, "message": OVERLOADED_MESSAGE, "retry_after": e.retry_after_seconds})
+    except QuotaExceededError as e:
+        error("stream_answer", {"message": "Quota exceeded", "error": str(e), "user_id": user_id})
+        yield _sse("error", {"field": None, "message": QUOTA_MESSAGE, "retry_after": e.retry_after_seconds})
+    except Exception as e:
+        error("stream_answer", {
+            "message": "Unexpected error",
+            "error": str(e),
+            "question": form.cleaned_data.get("question"),
+            "user_id": user_id
+        })
+        yield _sse("error", {"field": None, "message": 'An unexpected error occurred. Please try again.'})
+
+
+@require_http_methods(["POST"])
+async def ask_question(request):
+    form = AskQuestionForm(request.POST, request.FILES)
+    if not form.is_valid():
+        return JsonResponse({'success': False, 'errors': form.errors}, status=400)
+
+    user_id = await _aget_user_id(request)
+
+    try:
+        with usage_scope(user_id):
+            _usage_budget().acquire_requests(user_id)
+            answer = await form.aupload_and_ask_question(request.FILES.get("file"), user_id=user_id)
+    except InvalidQuestionError as e:
+        error("ask_question", {
+            "message": "Invalid question",
+            "error": str(e),
+            "question": form.cleaned_data.get("question"),
+            "user_id": user_id
+        })
+        message = str(e) if str(e) else 'Your question is not appropriate or valid. Please try a different question.'
+        return JsonResponse({'success': False, 'errors': {'question': [message]}}, status=400)
+    except InvalidDocumentError as e:
+        error("ask_question", {
+            "message": "Invalid document",
+            "error": str(e),
+            "user_id": user_id
+        })
+        message = str(e) if str(e) else 'Your document is not appropriate or valid. Please try a different document.'
+        return JsonResponse({'success': False, 'errors': {'file': [message]}}, status=400)
+    except DependencyUnavailableError as e:
+        error("ask_question", {"message": "Dependency unavailable", "error": str(e), "user_id": user_id})
+        return JsonResponse({'success': False, 'errors': {'__all__': [UNAVAILABLE_MESSAGE]}}, status=503)
+    except DeadlineExceededError as e:
+        error("ask_question", {"message": "Deadline exceeded", "error": str(e), "user_id": user_id})
+        return JsonResponse({'success': False, 'errors': {'__all__': [DEADLINE_MESSAGE]}}, status=504)
+    except OverloadedError as e:
+        error("ask_question", {"message": "Overloaded", "error": str(e), "user_id": user_id})
+        return _overloaded_response(e)
+    except QuotaExceededError as e:
+        error("ask_question", {"message": "Quota exceeded", "error": str(e), "user_id": user_id})
+        return _quota_response(e)
+    except Exception as e:
+        error("ask_question", {
+            "message": "Unexpected error",
+            "error": str(e),
+            "question": form.cleaned_data.get("question"),
+            "user_id": user_id
+        })
+        return JsonResponse({'success': False, 'errors': {'__all__': ['An unexpected error occurred. Please try again.']}},
+                            status=500)
+
+    return JsonResponse({'success': True, 'answer': answer})
+
+
+@require_http_methods(["POST"])
+async def stream_answer(request):
+    form = AskQuestionForm(request.POST, request.FILES)
+    if not form.is_valid():
+        return JsonResponse({'success': False, 'errors': form.errors}, status=400)
+
+    user_id = await _aget_user_id(request)
+
+    try:
+        with usage_scope(user_id):
+            _usage_budget().acquire_requests(user_id)
+            events = await form.aupload_and_stream_answer(request.FILES.get("file"), user_id=user_id)
+    except InvalidDocumentError as e:
+        error("stream_answer", {
+            "message": "Invalid document",
+            "error": str(e),
+            "user_id": user_id
+        })
+        message = str(e) if str(e) else 'Your document is not appropriate or valid. Please try a different document.'
+        return JsonResponse({'success': False, 'errors': {'file': [message]}}, status=400)
+    except DependencyUnavailableError as e:
+        error("stream_answer", {"message": "Dependency unavailable", "error": str(e), "user_id": user_id})
+        return JsonResponse({'success': False, 'errors': {'__all__': [UNAVAILABLE_MESSAGE]}}, status=503)
+    except DeadlineExceededError as e:
+        error("stream_answer", {"message": "Deadline exceeded", "error": str(e), "user_id": user_id})
+        return JsonResponse({'success': False, 'errors': {'__all__': [DEADLINE_MESSAGE]}}, status=504)
+    except OverloadedError as e:
+        error("stream_answer", {"message": "Overloaded", "error": str(e), "user_id": user_id})
+        return _overloaded_response(e)
+    except QuotaExceededError as e:
+        error("stream_answer", {"message": "Quota exceeded", "error": str(e), "user_id": user_id})
+        return _quota_response(e)
+    except Exception as e:
+        error("stream_answer", {
+            "message": "Unexpected error",
+            "error": str(e),
+            "question": form.cleaned_data.get("question"),
+            "user_id": user_id
+        })
+        return JsonResponse({'success': False, 'errors': {'__all__': ['An unexpected error occurred. Please try again.']}},
+                            status=500)
+
+    # The question's deadline starts now that the file is uploaded
+    response = StreamingHttpResponse(_stream_events(form, events, user_id, question_deadline()),
+                                     content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop proxies like nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def _batch_line(questions: list[str], result: dict) -> str:
+    line = {"index": result["index"], "question": questions[result["index"]]}
+    if "answer" in result:
+        answer = result["answer"]
+        line.update({
+            "answer": answer.answer,
+            "citations": [{"source_id": citation.source_id, "quote": citation.quote}
+                          for citation in answer.citations],
+        })
+    else:
+        line["error"] = _error_message(result["error"])
+    return json.dumps(line) + "\n"
+
+
+def _error_message(e: Exception) -> str:
+    if isinstance(e, InvalidQuestionError):
+        return str(e) or 'Your question is not appropriate or valid. Please try a different question.'
+    if isinstance(e, DependencyUnavailableError):
+        return UNAVAILABLE_MESSAGE
+    if isinstance(e, DeadlineExceededError):
+        return DEADLINE_MESSAGE
+    if isinstance(e, OverloadedError):
+        return OVERLOADED_MESSAGE
+    if isinstance(e, QuotaExceededError):
+        return QUOTA_MESSAGE
+    return 'An unexpected error occurred. Please try again.'
+
+
+async def _batch_lines(questions: list[str], user_id):
+    try:
+        with usage_scope(user_id):
+            async for result in AskQuestionForm.ai_assistant.aanswer_batch(
+                    questions, user_id=user_id, deadline_seconds=settings.REQUEST_DEADLINE_SECONDS):
+                if "error" in result and not isinstance(result["error"], InvalidQuestionError):
+                    error("answer_batch", {"message": "Question failed", "error": str(result["error"]),
+                                           "index": result["index"], "user_id": user_id})
+                yield _batch_line(questions, result)
+    except Exception as e:
+        # Moderating or embedding the batch failed, no question can be answered
+        error("answer_batch", {"message": "Batch failed", "error": str(e), "user_id": user_id})
+        yield json.dumps({"error": _error_message(e)}) + "\n"
+
+
+# CSRF protected like the other views, it spends the session's request and token budgets
+@require_http_methods(["POST"])
+async def answer_batch(request):
+    """
+    Answer a JSON {"questions": [...]} body, streaming one NDJSON line per question as it is answered.
+
+    Each line has the question's index and either its answer and citations or an error.
+    """
+    if request.content_type != 'application/json':
+        return JsonResponse({'success': False, 'errors': {'__all__': ['Expected an application/json body.']}},
+                            status=415)
+    try:
+        questions = json.loads(request.body).get("questions")
+    except (ValueError, AttributeError):
+        questions = None
+    if not isinstance(questions, list) or not questions or \
+            not all(isinstance(question, str) and question.strip() for question in questions):
+        return JsonResponse({'success': False, 'errors': {'questions': ['Expected a list of questions.']}},
+                            status=400)
+    # A batch over the request budget would be turned away however long it waited, so it's refused without a
+    # Retry-After like any batch that is too large
+    max_questions = min(filter(None, [settings.BATCH_MAX_QUESTIONS, _usage_budget().max_requests()]))
+    if len(questions) > max_questions:
+        return JsonResponse({'success': False, 'errors': {
+            'questions': [f'At most {max_questions} questions can be sent at once.']
+        }}, status=413)
+
+    user_id = await _aget_user_id(request)
+    # Each question counts as a request, a batch is turned away whole rather than answered in part
+    try:
+        _usage_budget().acquire_requests(user_id, len(questions))
+    except QuotaExceededError as e:
+        error("answer_batch", {"message": "Quota exceeded", "error": str(e), "user_id": user_id})
+        return _quota_response(e)
+
+    response = StreamingHttpResponse(_batch_lines(questions, user_id), content_type='application/x-ndjson')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@require_http_methods(["GET"])
+async def quota(request):
+    """The session's and the service's token and request budgets, with what is used and left of them."""
+    user_id = await _aget_user_id(request)
+    return JsonResponse({'success': True, 'quota': _usage_budget().quota(user_id)})
+
+
 @require_http_methods(["DELETE"])
 def clear_messages(request):
     try:
         delete_messages()
+        # Follow-up questions after clearing the chat don't refer to the cleared conversation
+        if request.session.session_key:
+            AskQuestionForm.ai_assistant.conversation_memory.clear(request.session.session_key)
         return JsonResponse({'success': True, 'message': 'Messages cleared successfully'})
     except Exception as e:
         error("clear_messages", {"message": "Error deleting messages", error: e, "request": request})
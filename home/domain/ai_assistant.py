@@ -1,203 +1,990 @@
+import asyncio
+import contextvars
+import difflib
+import hashlib
+import os
+import threading
 import time
-from typing import Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Optional
 
 from langchain.chat_models import init_chat_model
+from langchain_core.callbacks import UsageMetadataCallbackHandler
 from langchain_core.documents import Document
+from langchain_core.messages import SystemMessage
 from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnableLambda
 from langfuse import get_client
 from langgraph.graph import StateGraph, START
 
-from document_bot.analytics import debug, record_llm_call, record_question_attempt
+from document_bot.analytics import debug, error, record_llm_call, record_question_attempt, record_cache_lookup, \
+    record_cache_audit, record_model_route, record_degraded_answer
+from home.domain.answer_prompt import answer_instructions
+from home.domain.citation_resolver import number_sentences, resolve_citations
+from home.domain.compact_answer import CompactAnswer
+from home.domain.deadline import Deadline, check_deadline, current_deadline, deadline_scope
+from home.domain.deadline_exceeded_error import DeadlineExceededError
 from home.domain.document_repository import DocumentRepository
 from home.domain.invalid_question_error import InvalidQuestionError
+from home.domain.model_router import ModelRoute, ModelRouter
+from home.domain.question_normalizer import normalize_question
 from home.domain.question_validator import QuestionValidator
 from home.domain.quoted_answer import QuotedAnswer
 from home.domain.state import State
+from home.domain.token_usage import TokenUsage, current_session, current_usage, estimate_cost_usd, record_usage, \
+    usage_from_metadata, usage_scope
+from home.infrastructure.admission_controller import AdmissionController, get_admission_controller
+from home.infrastructure.answer_cache import AnswerCache
+from home.infrastructure.circuit_breaker import CircuitBreaker
+from home.infrastructure.context_packer import ContextPacker, PackedContext
+from home.infrastructure.conversation_memory import ConversationMemory, ConversationTurn
 from home.infrastructure.flagged_question_tracker import get_tracker
+from home.infrastructure.hedged_caller import HedgedCaller, HedgingPolicy
+from home.infrastructure.openai_http_client import get_async_http_client, get_http_client, http_timeout
+from home.infrastructure.semantic_answer_cache import SemanticAnswerCache, SemanticCacheHit
+from home.infrastructure.single_flight import SingleFlight, AsyncSingleFlight
+from home.infrastructure.usage_budget import UsageBudget, get_usage_budget
 
 model = "gpt-4o-mini"
 model_provider = "openai"
+# Bump whenever the prompt changes so cached answers from the old prompt are not reused
+prompt_version = "v3"
+
+CITATION_MODES = ("verbatim", "compact")
+
+DEGRADED_ANSWER = (
+    "The assistant can't write an answer right now. "
+    "These passages from the documents look the most relevant to your question:"
+)
+DEGRADED_PASSAGES = 3
+DEGRADED_PASSAGE_CHARS = 500
+
+# The usage of the semantic cache audits is accounted to this session rather than the user's, which caps it too
+AUDIT_SESSION = "system:audit"
+
+SUMMARY_PROMPT = (
+    "Summarize this conversation between a user and an AI assistant answering questions about documents, "
+    "in at most 150 words. Keep the names, facts and open questions a follow-up question could refer to."
+)
+
+
+@dataclass(frozen=True)
+class _Tier:
+    llm: Any
+    streaming_llm: Any
+    caller: HedgedCaller
+    breaker: CircuitBreaker
 
 
 class AiAssistant:
-    def __init__(self, document_repository: DocumentRepository, question_validator: QuestionValidator):
+    def __init__(self, document_repository: DocumentRepository, question_validator: QuestionValidator,
+                 answer_cache: Optional[AnswerCache] = None,
+                 semantic_answer_cache: Optional[SemanticAnswerCache] = None,
+                 context_packer: Optional[ContextPacker] = None,
+                 citation_mode: Optional[str] = None,
+                 model_router: Optional[ModelRouter] = None,
+                 generation_admission: Optional[AdmissionController] = None,
+                 conversation_memory: Optional[ConversationMemory] = None,
+                 usage_budget: Optional[UsageBudget] = None):
         self.graph = self._build_graph()
         self.document_repository = document_repository
         self.question_validator = question_validator
-        self.llm = (init_chat_model(model, model_provider=model_provider)
-                    .with_structured_output(QuotedAnswer))
+        # In compact mode the model cites sentence numbers and the quotes are copied from the sources here,
+        # so the completion doesn't spend tokens repeating source text
+        self.citation_mode = citation_mode or os.getenv("CITATION_MODE", "verbatim")
+        if self.citation_mode not in CITATION_MODES:
+            raise ValueError(f"Unknown citation mode {self.citation_mode!r}, expected one of {CITATION_MODES}")
+        self.answer_schema = CompactAnswer if self.citation_mode == "compact" else QuotedAnswer
+        self.model_router = model_router or ModelRouter()
+        # The fast tier answers most questions, the other tiers' models are created when first routed to
+        chat_model = self._new_chat_model(self.model_router.fast_model)
+        self.llm = chat_model.with_structured_output(self.answer_schema)
+        self.summary_llm = chat_model
+        # A JSON schema instead of the model class streams partial objects, so the answer shows before the citations
+        self.streaming_llm = chat_model.with_structured_output(
+            self.answer_schema.model_json_schema(), method="json_schema"
+        )
+        # Retries are left to the hedged callers, which budget them, instead of the client
+        self.llm_caller = self._new_llm_caller(self.model_router.fast_model)
+        self.llm_breaker = CircuitBreaker(f"chat_model:{self.model_router.fast_model}")
+        self.tier_llms = {}
+        self.tier_llms_lock = threading.Lock()
+        # Shared by every assistant in the process, so generations wait in one queue instead of at the socket
+        self.generation_admission = generation_admission or get_admission_controller("generation")
+        self.usage_budget = usage_budget or get_usage_budget()
+        self.answer_cache = answer_cache or AnswerCache()
+        self.semantic_answer_cache = semantic_answer_cache or SemanticAnswerCache()
+        self.context_packer = context_packer or ContextPacker(model)
+        self.batch_max_concurrency = int(os.getenv("BATCH_MAX_CONCURRENCY", "4"))
+        self.conversation_memory = conversation_memory or ConversationMemory(
+            self._summarize_conversation, self.context_packer.count_tokens
+        )
+        self.audit_executor = ThreadPoolExecutor(max_workers=1)
+        self.audit_deadline_seconds = float(os.getenv("AUDIT_DEADLINE_SECONDS", "60"))
+        self.retrieval_executor = ThreadPoolExecutor(max_workers=int(os.getenv("RETRIEVAL_MAX_WORKERS", "16")))
+        self.single_flight = SingleFlight()
+        self.async_single_flight = AsyncSingleFlight()
         self.flagged_tracker = get_tracker()
         self.langfuse = get_client()
 
     def _build_graph(self):
-        graph_builder = StateGraph(State).add_sequence([self.retrieve, self.generate])
-        graph_builder.add_edge(START, "retrieve")
+        # Each node has an async version, so graph.ainvoke awaits the network calls instead of using threads
+        graph_builder = StateGraph(State).add_sequence([
+            ("retrieve", RunnableLambda(self.retrieve, afunc=self.aretrieve)),
+            ("generate", RunnableLambda(self.generate, afunc=self.agenerate)),
+        ])
+        # Questions retrieved speculatively during validation go straight to generation
+        graph_builder.add_conditional_edges(
+            START,
+            lambda state: "generate" if "existing_documents" in state else "retrieve",
+            ["retrieve", "generate"]
+        )
         return graph_builder.compile()
 
     def answer(self, question: str, new_document: list[Document], user_id: Optional[str] = None) -> str:
-        validation_status = "safe"
-        is_recovery = False
+        with self._question_trace(question, new_document, user_id) as trace_span:
+            is_recovery, retrieval = self._validate_while_retrieving(question, new_document, user_id, trace_span)
 
-        if user_id:
-            is_recovery = self.flagged_tracker.check_recovery(user_id)
+            with self._retrieval_span(question) as retrieval_span:
+                result, coalesced = self._run_pipeline(self._with_history(retrieval.result(), user_id))
+                self._record_retrieval(retrieval_span, result, coalesced)
+
+            self._record_answer(trace_span, question, result, is_recovery, coalesced)
+            self._remember_turn(user_id, question, result)
 
-        with self.langfuse.start_as_current_span(
+            return result["answer"].to_string()
+
+    async def aanswer(self, question: str, new_document: list[Document], user_id: Optional[str] = None) -> str:
+        """Async version of answer, every network call is awaited instead of blocking a thread."""
+        with self._question_trace(question, new_document, user_id) as trace_span:
+            is_recovery, retrieval = await self._avalidate_while_retrieving(question, new_document, user_id,
+                                                                            trace_span)
+
+            with self._retrieval_span(question) as retrieval_span:
+                result, coalesced = await self._arun_pipeline(self._with_history(await retrieval, user_id))
+                self._record_retrieval(retrieval_span, result, coalesced)
+
+            self._record_answer(trace_span, question, result, is_recovery, coalesced)
+            self._remember_turn(user_id, question, result)
+
+            return result["answer"].to_string()
+
+    async def astream_answer(self, question: str, new_document: list[Document],
+                             user_id: Optional[str] = None) -> AsyncIterator[dict]:
+        """
+        Answer like aanswer, yielding the answer text as it is generated.
+
+        Yields {"type": "token", "text": ...} events while the model writes the answer,
+        then a single {"type": "answer", "answer": QuotedAnswer} once the citations are complete.
+        """
+        with self._question_trace(question, new_document, user_id, streaming=True) as trace_span:
+            is_recovery, retrieval = await self._avalidate_while_retrieving(question, new_document, user_id,
+                                                                            trace_span)
+
+            with self._retrieval_span(question) as retrieval_span:
+                state = self._with_history(await retrieval, user_id)
+                self._record_retrieval(retrieval_span, state, coalesced=False)
+
+            prompt_value, context, route = self._prepare_generation(state)
+            result = self._lookup_cached_answer(state, route)
+            if result:
+                yield {"type": "token", "text": result["answer"].answer}
+            else:
+                async for event in self._astream_generate(state, prompt_value, context, route):
+                    if event["type"] == "token":
+                        yield event
+                    else:
+                        result = event["result"]
+
+            result = {**state, **result}
+            self._record_answer(trace_span, question, result, is_recovery, coalesced=False)
+            self._remember_turn(user_id, question, result)
+
+            yield {"type": "answer", "answer": result["answer"]}
+
+    def _with_history(self, state: State, user_id: Optional[str]) -> State:
+        state["history"] = self.conversation_memory.history(user_id)
+        return state
+
+    def _remember_turn(self, user_id: Optional[str], question: str, result: dict) -> None:
+        # A degraded answer is a list of passages, not something a follow-up question refers to
+        if not result.get("degraded"):
+            self.conversation_memory.add_turn(user_id, question, result["answer"].answer)
+
+    def _summarize_conversation(self, summary: str, turns: list[ConversationTurn]) -> str:
+        conversation = "\n\n".join(f"User: {turn.question}\nAssistant: {turn.answer}" for turn in turns)
+        if summary:
+            conversation = f"Summary of the earlier conversation: {summary}\n\n{conversation}"
+        # Run by the conversation memory within the session's usage scope, so it counts towards its budget
+        self.usage_budget.check_tokens(current_session(), "conversation_summary")
+        usage = UsageMetadataCallbackHandler()
+        with self.langfuse.start_as_current_generation(name="conversation_summary",
+                                                       model=self.model_router.fast_model) as generation:
+            try:
+                response = self.llm_breaker.call(lambda: self.summary_llm.invoke([
+                    ("system", SUMMARY_PROMPT),
+                    ("human", conversation),
+                ], config={"callbacks": [usage]}))
+            finally:
+                self._record_usage("conversation_summary", self.model_router.fast_model, usage, generation)
+        return response.content
+
+    async def aanswer_batch(self, questions: list[str], user_id: Optional[str] = None,
+                            deadline_seconds: Optional[float] = None) -> AsyncIterator[dict]:
+        """
+        Answer many questions, yielding each result as soon as it is ready.
+
+        Yields {"index": i, "answer": QuotedAnswer} or {"index": i, "error": Exception}, in completion order.
+        The questions are moderated and embedded in batched requests within deadline_seconds, then retrieval
+        and generation run for at most batch_max_concurrency questions at a time, each within deadline_seconds
+        once started.
+        Questions are answered independently, without the session's conversation.
+        """
+        # The batched moderation and embedding requests share one request's deadline
+        with deadline_scope(Deadline.after(deadline_seconds) if deadline_seconds else current_deadline()):
+            failures = await self.question_validator.avalidate_batch(questions, user_id=user_id)
+            valid = [i for i, failure in enumerate(failures) if failure is None]
+            embeddings = await self.document_repository.aembed_queries([questions[i] for i in valid]) if valid else []
+
+        for i, failure in enumerate(failures):
+            if failure is None:
+                continue
+            try:
+                with self._question_trace(questions[i], [], user_id, batch=True) as trace_span:
+                    self._record_batch_validation(questions[i], user_id, trace_span, failure)
+            except InvalidQuestionError as e:
+                yield {"index": i, "error": e}
+
+        if not valid:
+            return
+
+        semaphore = asyncio.Semaphore(self.batch_max_concurrency)
+
+        async def answer(i: int, embedding: list[float]) -> dict:
+            async with semaphore:
+                # Each question gets its own deadline once it starts, a whole batch takes longer than one request
+                deadline = Deadline.after(deadline_seconds) if deadline_seconds else current_deadline()
+                try:
+                    with deadline_scope(deadline):
+                        return {"index": i, "answer": await self._aanswer_embedded(questions[i], embedding, user_id)}
+                except Exception as e:
+                    return {"index": i, "error": e}
+
+        tasks = [asyncio.create_task(answer(i, embedding)) for i, embedding in zip(valid, embeddings)]
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                yield await next_result
+        finally:
+            # The client went away, the questions not answered yet are dropped
+            for task in tasks:
+                task.cancel()
+
+    async def _aanswer_embedded(self, question: str, embedding: list[float], user_id: Optional[str]) -> QuotedAnswer:
+        with self._question_trace(question, [], user_id, batch=True) as trace_span:
+            is_recovery = self._record_batch_validation(question, user_id, trace_span, None)
+
+            with self._retrieval_span(question) as retrieval_span:
+                state: State = {
+                    "question": question,
+                    "new_document": [],
+                    "question_embedding": embedding,
+                    "existing_documents": await self.document_repository.asimilarity_search_by_vector(embedding),
+                }
+                result, coalesced = await self._arun_pipeline(state)
+                self._record_retrieval(retrieval_span, result, coalesced)
+
+            self._record_answer(trace_span, question, result, is_recovery, coalesced=coalesced)
+            return result["answer"]
+
+    @contextmanager
+    def _question_trace(self, question: str, new_document: list[Document], user_id: Optional[str], **metadata):
+        # The question's own ledger, so its trace shows what it cost apart from the rest of the request
+        with usage_scope(user_id), self.langfuse.start_as_current_span(
             name="question_answer",
             input={"question": question, "question_length": len(question)},
             metadata={
                 "has_new_document": new_document is not None and len(new_document) > 0,
-                "user_id": user_id or "anonymous"
+                "user_id": user_id or "anonymous",
+                **metadata
             }
         ) as trace_span:
             try:
-                with self.langfuse.start_as_current_span(
-                    name="validation",
-                    input={"question": question}
-                ) as validation_span:
-                    try:
-                        self.question_validator.validate(question, user_id=user_id)
-
-                        validation_span.update(output={"passed": True})
-
-                        if user_id:
-                            was_recovery = self.flagged_tracker.record_success(user_id)
-                            if was_recovery:
-                                is_recovery = True
-
-                        record_question_attempt(
-                            user_id=user_id,
-                            flagged=False,
-                            is_recovery=is_recovery
-                        )
-
-                    except InvalidQuestionError as e:
-                        validation_status = "flagged"
-                        failed_validator = str(e)
-
-                        validation_span.update(output={"passed": False, "reason": str(e)})
-
-                        if user_id:
-                            self.flagged_tracker.record_flagged(user_id)
-
-                        record_question_attempt(
-                            user_id=user_id,
-                            flagged=True,
-                            validator_failed=failed_validator
-                        )
-
-                        trace_span.update_trace(tags=["flagged", "blocked"])
-                        trace_span.update(
-                            output={"error": str(e)},
-                            metadata={
-                                "validation_status": validation_status,
-                                "failed_validator": failed_validator
-                            }
-                        )
-
-                        raise
-
-                with self.langfuse.start_as_current_span(
-                    name="retrieval",
-                    input={"question": question}
-                ) as retrieval_span:
-                    result = self.graph.invoke({"question": question, "new_document": new_document})
-
-                    retrieval_span.update(output={
-                        "num_documents": len(result["existing_documents"]),
-                        "sources": [doc.metadata.get("source", "unknown") for doc in result["existing_documents"]]
-                    })
-
-                debug("answer",
-                      {
-                          "question": question,
-                          "source": [doc.metadata["source"] for doc in result["existing_documents"]],
-                          "answer": result['answer'].model_dump()
-                      })
-
-                trace_span.update_trace(tags=["safe"] + (["recovery"] if is_recovery else []))
-                trace_span.update(
-                    output={"answer": result['answer'].model_dump()},
-                    metadata={
-                        "validation_status": validation_status,
-                        "num_sources": len(result["existing_documents"]),
-                        "is_recovery": is_recovery
-                    }
-                )
-
-                return result["answer"].to_string()
-
+                yield trace_span
             except Exception as e:
                 trace_span.update_trace(tags=["error"])
                 trace_span.update(
                     output={"error": str(e)},
-                    metadata={"validation_status": validation_status}
+                    metadata={"validation_status": "flagged" if isinstance(e, InvalidQuestionError) else "safe"}
                 )
                 raise
 
+    def _retrieval_span(self, question: str):
+        return self.langfuse.start_as_current_span(
+            name="retrieval",
+            input={"question": question}
+        )
+
+    def _validate_while_retrieving(self, question: str, new_document: list[Document], user_id: Optional[str],
+                                   trace_span) -> tuple[bool, Future]:
+        """
+        Validate the question while its documents are retrieved speculatively, returning whether
+        the user is recovering from a flagged question.
+
+        The local checks run first, so a question they reject is never embedded. Retrieval has
+        no side effects, so it doesn't wait for the remote checks, and its result is dropped
+        when the question is rejected.
+        """
+        with self._validation_span(question) as validation_span:
+            try:
+                self.question_validator.validate_locally(question, user_id=user_id)
+                retrieval = self.retrieval_executor.submit(
+                    contextvars.copy_context().run, self.retrieve,
+                    {"question": question, "new_document": new_document}
+                )
+                try:
+                    self.question_validator.validate_remotely(question, user_id=user_id)
+                except Exception:
+                    retrieval.cancel()
+                    debug("speculative_retrieval", {"discarded": True})
+                    raise
+            except InvalidQuestionError as e:
+                self._record_validation_failure(validation_span, trace_span, user_id, e)
+                raise
+
+            return self._record_validation_success(validation_span, user_id), retrieval
+
+    async def _avalidate_while_retrieving(self, question: str, new_document: list[Document],
+                                          user_id: Optional[str], trace_span) -> tuple[bool, asyncio.Task]:
+        with self._validation_span(question) as validation_span:
+            try:
+                self.question_validator.validate_locally(question, user_id=user_id)
+                retrieval = asyncio.create_task(self.aretrieve({"question": question, "new_document": new_document}))
+                try:
+                    await self.question_validator.avalidate_remotely(question, user_id=user_id)
+                except BaseException:
+                    retrieval.cancel()
+                    # Retrieve a failure of the discarded retrieval so asyncio doesn't log it as never retrieved
+                    retrieval.add_done_callback(lambda task: task.cancelled() or task.exception())
+                    debug("speculative_retrieval", {"discarded": True})
+                    raise
+            except InvalidQuestionError as e:
+                self._record_validation_failure(validation_span, trace_span, user_id, e)
+                raise
+
+            return self._record_validation_success(validation_span, user_id), retrieval
+
+    def _record_batch_validation(self, question: str, user_id: Optional[str], trace_span,
+                                 failure: Optional[InvalidQuestionError]) -> bool:
+        """Record a question moderated in a batch like one validated alone, raising its failure."""
+        with self._validation_span(question) as validation_span:
+            if failure is not None:
+                self._record_validation_failure(validation_span, trace_span, user_id, failure)
+                raise failure
+            return self._record_validation_success(validation_span, user_id)
+
+    def _validation_span(self, question: str):
+        return self.langfuse.start_as_current_span(
+            name="validation",
+            input={"question": question}
+        )
+
+    def _record_validation_success(self, validation_span, user_id: Optional[str]) -> bool:
+        validation_span.update(output={"passed": True})
+
+        is_recovery = False
+        if user_id:
+            is_recovery = self.flagged_tracker.record_success(user_id)
+
+        record_question_attempt(
+            user_id=user_id,
+            flagged=False,
+            is_recovery=is_recovery
+        )
+        return is_recovery
+
+    def _record_validation_failure(self, validation_span, trace_span, user_id: Optional[str],
+                                   e: InvalidQuestionError) -> None:
+        failed_validator = str(e)
+
+        validation_span.update(output={"passed": False, "reason": str(e)})
+
+        if user_id:
+            self.flagged_tracker.record_flagged(user_id)
+
+        record_question_attempt(
+            user_id=user_id,
+            flagged=True,
+            validator_failed=failed_validator
+        )
+
+        trace_span.update_trace(tags=["flagged", "blocked"])
+        trace_span.update(
+            output={"error": str(e)},
+            metadata={
+                "validation_status": "flagged",
+                "failed_validator": failed_validator
+            }
+        )
+
+    def _record_retrieval(self, retrieval_span, result: dict, coalesced: bool) -> None:
+        retrieval_span.update(output={
+            "num_documents": len(result["existing_documents"]),
+            "sources": [doc.metadata.get("source", "unknown") for doc in result["existing_documents"]],
+            "coalesced": coalesced
+        })
+
+    def _record_answer(self, trace_span, question: str, result: dict, is_recovery: bool, coalesced: bool) -> None:
+        debug("answer",
+              {
+                  "question": question,
+                  "source": [doc.metadata["source"] for doc in result["existing_documents"]],
+                  "answer": result['answer'].model_dump()
+              })
+
+        cache_hit = result.get("cache_hit")
+        degraded = result.get("degraded", False)
+        trace_span.update_trace(
+            tags=["safe"] + (["recovery"] if is_recovery else []) + (["cache_hit"] if cache_hit else [])
+                 + (["coalesced"] if coalesced else []) + (["degraded"] if degraded else [])
+        )
+        trace_span.update(
+            output={"answer": result['answer'].model_dump()},
+            metadata={
+                "validation_status": "safe",
+                "num_sources": len(result["existing_documents"]),
+                "is_recovery": is_recovery,
+                "cache_hit": cache_hit,
+                "coalesced": coalesced,
+                "degraded": degraded,
+                **({"usage": current_usage().as_dict()} if current_usage() else {})
+            }
+        )
+
+    def _conversation_key(self, state: State) -> str:
+        """A digest of the conversation a follow-up question is answered with, empty without one."""
+        history = state.get("history")
+        return hashlib.sha256(history.encode()).hexdigest() if history else ""
+
+    def _flight_key(self, state: State) -> Optional[str]:
+        question, new_document = state["question"], state["new_document"]
+        document_ids = [doc.id for doc in new_document or []]
+        if not all(isinstance(document_id, str) for document_id in document_ids):
+            return None
+        # A follow-up question is only shared with callers asking it after the same conversation
+        conversation_key = self._conversation_key(state)
+        return "\x1f".join([normalize_question(question)] + ([conversation_key] if conversation_key else [])
+                            + document_ids)
+
+    def _run_pipeline(self, state: State) -> tuple[dict, bool]:
+        """
+        Run generation on the retrieved state, sharing one run between concurrent callers asking the same question.
+
+        Validation, the cache lookup and the budget check are not part of the shared run, every
+        caller does its own before this, so one session's rejection doesn't fail the others.
+        """
+        flight_key = self._flight_key(state)
+        if not flight_key:
+            return self.graph.invoke(state), False
+
+        _, _, route = self._prepare_generation(state)
+        cached = self._cached_answer_or_check_budget(state, route)
+        if cached:
+            return {**state, **cached}, False
+        state["cache_checked"] = True
+
+        result, coalesced = self.single_flight.do(flight_key, lambda: self.graph.invoke(state))
+        record_cache_lookup("in_flight_answer", hit=coalesced)
+        return result, coalesced
+
+    async def _arun_pipeline(self, state: State) -> tuple[dict, bool]:
+        flight_key = self._flight_key(state)
+        if not flight_key:
+            return await self.graph.ainvoke(state), False
+
+        _, _, route = self._prepare_generation(state)
+        cached = self._cached_answer_or_check_budget(state, route)
+        if cached:
+            return {**state, **cached}, False
+        state["cache_checked"] = True
+
+        result, coalesced = await self.async_single_flight.do(flight_key, lambda: self.graph.ainvoke(state))
+        record_cache_lookup("in_flight_answer", hit=coalesced)
+        return result, coalesced
+
     def retrieve(self, state: State) -> State:
-        state["existing_documents"] = self.document_repository.similarity_search(state["question"])
+        check_deadline("retrieve")
+        # The question embedding is kept in the state so the semantic answer cache doesn't embed it again
+        state["question_embedding"] = self.document_repository.embed_query(state["question"])
+        state["existing_documents"] = self.document_repository.similarity_search_by_vector(
+            state["question_embedding"]
+        )
+        return state
+
+    async def aretrieve(self, state: State) -> State:
+        check_deadline("retrieve")
+        state["question_embedding"] = await self.document_repository.aembed_query(state["question"])
+        state["existing_documents"] = await self.document_repository.asimilarity_search_by_vector(
+            state["question_embedding"]
+        )
         return state
 
+    def _sources_key(self, state: State, llm_model: str) -> Optional[str]:
+        """The key of the sources, conversation, prompt and model an answer came from, None for unsaved documents."""
+        documents = state["existing_documents"] + (state.get("new_document") or [])
+        document_ids = [doc.id for doc in documents]
+        if not all(isinstance(document_id, str) for document_id in document_ids):
+            return None
+
+        key = "\x1f".join([
+            ",".join(document_ids),
+            str(len(state["existing_documents"])),
+            llm_model,
+            prompt_version,
+            self.citation_mode,
+            str(self.context_packer.max_tokens),
+            str(self.document_repository.get_corpus_version()),
+            # The conversation is part of the prompt, a follow-up question's answer depends on it
+            self._conversation_key(state),
+        ])
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def _answer_cache_key(self, sources_key: str, question: str) -> str:
+        return hashlib.sha256(f"{sources_key}\x1f{normalize_question(question)}".encode()).hexdigest()
+
+    def _audit_semantic_hit(self, state: State, route: ModelRoute, hit: SemanticCacheHit) -> None:
+        """Regenerate a sample of semantic hits in the background to measure how often they are wrong."""
+        prompt_value, context, _ = self._prepare_generation(state)
+        question = state["question"]
+
+        def audit():
+            try:
+                # The cached answer was generated by the routed model, so it is compared with that model's answer.
+                # The audit is a generation like any other, admitted, metered and behind the model's breaker,
+                # but with its own deadline and budget: it runs after the request has been answered.
+                with deadline_scope(Deadline.after(self.audit_deadline_seconds)), usage_scope(AUDIT_SESSION):
+                    self.usage_budget.check_tokens(AUDIT_SESSION, "audit")
+                    with self.generation_admission.admit():
+                        fresh_answer, _ = self._invoke_model(route, prompt_value, context, stage="audit")
+            except Exception as e:
+                error("cache_audit_failed", {"cache": "semantic_answer", "error": str(e)})
+                return
+
+            cited_sources = sorted({citation.source_id for citation in hit.answer.citations})
+            fresh_cited_sources = sorted({citation.source_id for citation in fresh_answer.citations})
+            record_cache_audit("semantic_answer", agreed=cited_sources == fresh_cited_sources, meta={
+                "similarity": round(hit.similarity, 4),
+                "answer_similarity": round(
+                    difflib.SequenceMatcher(None, hit.answer.answer, fresh_answer.answer).ratio(), 4
+                ),
+                "question": question,
+                "cached_question": hit.question,
+                "model": route.model,
+            })
+
+        # A new context, not the request's: the audit is neither the user's usage nor bound by their deadline
+        self.audit_executor.submit(contextvars.Context().run, audit)
+
+    def _lookup_cached_answer(self, state: State, route: ModelRoute) -> Optional[dict]:
+        """The answer the routed model gave to the question on the same sources, or to a similar question."""
+        sources_key = self._sources_key(state, route.model)
+        if not sources_key:
+            return None
+
+        cached_answer = self.answer_cache.get(self._answer_cache_key(sources_key, state["question"]))
+        record_cache_lookup("answer", hit=cached_answer is not None, meta={"model": route.model})
+        if cached_answer is not None:
+            return {"answer": cached_answer, "cache_hit": "exact"}
+
+        embedding = state.get("question_embedding")
+        if embedding is None:
+            return None
+
+        hit = self.semantic_answer_cache.get(sources_key, embedding)
+        record_cache_lookup(
+            "semantic_answer",
+            hit=hit is not None,
+            meta={"model": route.model, **({"similarity": round(hit.similarity, 4)} if hit else {})},
+            latency_saved_ms=hit.generation_ms if hit else None,
+        )
+        if hit is None:
+            return None
+
+        if self.semantic_answer_cache.should_audit():
+            self._audit_semantic_hit(state, route, hit)
+        return {"answer": hit.answer, "cache_hit": "semantic"}
+
+    def _cached_answer_or_check_budget(self, state: State, route: ModelRoute) -> Optional[dict]:
+        """The cached answer, or None once the session is known to have tokens left to generate one."""
+        if state.get("cache_checked"):
+            return None
+        cached = self._lookup_cached_answer(state, route)
+        if cached:
+            return cached
+
+        # Cached answers cost no tokens, they are served to a session over its budget
+        self.usage_budget.check_tokens(current_session(), "generate")
+        return None
+
+    def _store_answer(self, state: State, route: ModelRoute, answer: QuotedAnswer, generation_ms: float) -> None:
+        """Cache the answer under the model that gave it, which is the fallback's when the routed model failed."""
+        sources_key = self._sources_key(state, route.model)
+        if not sources_key:
+            return
+
+        self.answer_cache.set(self._answer_cache_key(sources_key, state["question"]), answer)
+        embedding = state.get("question_embedding")
+        if embedding is not None:
+            self.semantic_answer_cache.set(sources_key, embedding, state["question"], answer, generation_ms)
+
     def generate(self, state: State) -> dict:
+        prompt_value, context, route = self._prepare_generation(state)
+        cached = self._cached_answer_or_check_budget(state, route)
+        if cached:
+            return cached
+
+        # Cached answers are served above without waiting for a generation slot
+        with self.generation_admission.admit():
+            t0 = time.perf_counter()
+            fell_back = False
+
+            try:
+                response, tokens = self._invoke_model(route, prompt_value, context)
+            except Exception as e:
+                fallback = self._fallback_route(route, e)
+                if fallback is None:
+                    return self._degraded_answer(state, route, t0, context, e, fell_back=False)
+                route, fell_back = fallback, True
+                try:
+                    response, tokens = self._invoke_model(route, prompt_value, context)
+                except Exception as e:
+                    return self._degraded_answer(state, route, t0, context, e, fell_back=True)
+
+            self._record_route(state, route, t0, fell_back=fell_back, answer=response, tokens=tokens)
+            self._store_answer(state, route, response, (time.perf_counter() - t0) * 1000.0)
+            return {"answer": response}
+
+    async def agenerate(self, state: State) -> dict:
+        prompt_value, context, route = self._prepare_generation(state)
+        cached = self._cached_answer_or_check_budget(state, route)
+        if cached:
+            return cached
+
+        # Cached answers are served above without waiting for a generation slot
+        async with self.generation_admission.aadmit():
+            t0 = time.perf_counter()
+            fell_back = False
+
+            try:
+                response, tokens = await self._ainvoke_model(route, prompt_value, context)
+            except Exception as e:
+                fallback = self._fallback_route(route, e)
+                if fallback is None:
+                    return self._degraded_answer(state, route, t0, context, e, fell_back=False)
+                route, fell_back = fallback, True
+                try:
+                    response, tokens = await self._ainvoke_model(route, prompt_value, context)
+                except Exception as e:
+                    return self._degraded_answer(state, route, t0, context, e, fell_back=True)
+
+            self._record_route(state, route, t0, fell_back=fell_back, answer=response, tokens=tokens)
+            self._store_answer(state, route, response, (time.perf_counter() - t0) * 1000.0)
+            return {"answer": response}
+
+    def _new_chat_model(self, llm_model: str):
+        # Every tier shares the process's pooled OpenAI connections
+        return init_chat_model(llm_model, model_provider=model_provider, max_retries=0,
+                               http_client=get_http_client(), http_async_client=get_async_http_client(),
+                               timeout=http_timeout(), stream_usage=True)
+
+    def _new_llm_caller(self, llm_model: str) -> HedgedCaller:
+        # Each model keeps its own latency percentiles, a strong model is expected to be slower
+        return HedgedCaller(f"llm:{llm_model}", HedgingPolicy(initial_delay_ms=5000.0, max_delay_ms=20000.0))
+
+    def _tier(self, route: ModelRoute) -> _Tier:
+        """The models, caller and circuit breaker of a route, created on first use for the other tiers."""
+        if route.model == self.model_router.fast_model:
+            return _Tier(self.llm, self.streaming_llm, self.llm_caller, self.llm_breaker)
+
+        with self.tier_llms_lock:
+            if route.model not in self.tier_llms:
+                chat_model = self._new_chat_model(route.model)
+                self.tier_llms[route.model] = _Tier(
+                    chat_model.with_structured_output(self.answer_schema),
+                    chat_model.with_structured_output(self.answer_schema.model_json_schema(), method="json_schema"),
+                    self._new_llm_caller(route.model),
+                    CircuitBreaker(f"chat_model:{route.model}"),
+                )
+            return self.tier_llms[route.model]
+
+    def _prepare_generation(self, state: State):
+        """The prompt, its packed context and the model route, which the cached answers are looked up for."""
+        # Prepared once per question, the cache lookups before a shared run and generation itself reuse it
+        if state.get("prepared_generation") is None:
+            prompt_value, context = self._build_prompt(state)
+            state["prepared_generation"] = (prompt_value, context, self._route(state, context))
+        return state["prepared_generation"]
+
+    def _route(self, state: State, context: PackedContext) -> ModelRoute:
+        scores = [
+            doc.metadata.get("score") for doc in state["existing_documents"] if isinstance(doc.metadata, dict)
+        ]
+        return self.model_router.route(
+            state["question"],
+            [score for score in scores if isinstance(score, float)],
+            len(context.sources),
+        )
+
+    def _fallback_route(self, route: ModelRoute, e: Exception) -> Optional[ModelRoute]:
+        if isinstance(e, DeadlineExceededError):
+            # No time left for another model, the retrieved passages are answered right away
+            return None
+        fallback = self.model_router.fallback(route)
+        if fallback is not None:
+            error("model_fallback", {"tier": route.tier, "model": route.model, "fallback_model": fallback.model,
+                                     "error": str(e)})
+        return fallback
+
+    def _degraded_answer(self, state: State, route: ModelRoute, t0: float, context: PackedContext,
+                         e: Exception, fell_back: bool) -> dict:
+        """Answer with the top passages when no model could, rather than failing the question."""
+        self._record_route(state, route, t0, fell_back=fell_back)
+
+        passages = context.sources[:DEGRADED_PASSAGES]
+        reason = "deadline_exceeded" if isinstance(e, DeadlineExceededError) else "generation_failed"
+        record_degraded_answer(reason, len(passages), meta={"model": route.model, "error": str(e)})
+        if not passages:
+            raise e
+
+        citations = []
+        for i, source in enumerate(passages):
+            quote = source.text.strip()
+            if len(quote) > DEGRADED_PASSAGE_CHARS:
+                quote = quote[:DEGRADED_PASSAGE_CHARS].rstrip() + "..."
+            citations.append({"source_id": i + 1, "quote": quote})
+
+        return {
+            "answer": QuotedAnswer.model_validate({"answer": DEGRADED_ANSWER, "citations": citations}),
+            "degraded": True,
+        }
+
+    def _record_route(self, state: State, route: ModelRoute, t0: float, fell_back: bool,
+                      answer: Optional[QuotedAnswer] = None, tokens: Optional[dict] = None) -> None:
+        if answer is None:
+            outcome = "failed"
+        else:
+            outcome = "fallback" if fell_back else "ok"
+            self.model_router.record_outcome(state["question"], route, fell_back, len(answer.citations))
+
+        record_model_route(
+            route.tier, route.model, outcome, (time.perf_counter() - t0) * 1000.0,
+            tokens=tokens,
+            cost_usd=estimate_cost_usd(route.model, tokens),
+            meta={"reasons": list(route.reasons)},
+        )
+
+    def _invoke_model(self, route: ModelRoute, prompt_value, context: PackedContext,
+                      stage: str = "generate") -> tuple[QuotedAnswer, Optional[dict]]:
+        check_deadline(stage)
+        tier = self._tier(route)
+        t0 = time.perf_counter()
+        ok = True
+        # Sees every request of the call, hedged and retried ones are billed too
+        usage = UsageMetadataCallbackHandler()
+        config = {"callbacks": [usage]}
+
+        with self.langfuse.start_as_current_generation(name=stage, model=route.model) as generation:
+            try:
+                response = tier.breaker.call(
+                    lambda: tier.caller.call(lambda: tier.llm.invoke(prompt_value, config=config))
+                )
+                answer = self._to_quoted_answer(response, context)
+            except Exception:
+                ok = False
+                raise
+            finally:
+                tokens = self._record_usage(stage, route.model, usage, generation)
+                dt_ms = (time.perf_counter() - t0) * 1000.0
+                record_llm_call(model=route.model, ok=ok, duration_ms=dt_ms, tokens=tokens)
+        return answer, tokens
+
+    async def _ainvoke_model(self, route: ModelRoute, prompt_value,
+                             context: PackedContext) -> tuple[QuotedAnswer, Optional[dict]]:
+        check_deadline("generate")
+        tier = self._tier(route)
+        t0 = time.perf_counter()
+        ok = True
+        # Sees every request of the call, hedged and retried ones are billed too
+        usage = UsageMetadataCallbackHandler()
+        config = {"callbacks": [usage]}
+
+        with self.langfuse.start_as_current_generation(name="generate", model=route.model) as generation:
+            try:
+                response = await tier.breaker.acall(
+                    lambda: tier.caller.acall(lambda: tier.llm.ainvoke(prompt_value, config=config))
+                )
+                answer = self._to_quoted_answer(response, context)
+            except Exception:
+                ok = False
+                raise
+            finally:
+                tokens = self._record_usage("generate", route.model, usage, generation)
+                dt_ms = (time.perf_counter() - t0) * 1000.0
+                record_llm_call(model=route.model, ok=ok, duration_ms=dt_ms, tokens=tokens)
+        return answer, tokens
+
+    def _record_usage(self, stage: str, llm_model: str, usage: UsageMetadataCallbackHandler,
+                      generation) -> Optional[dict]:
+        """Account the tokens the model calls reported to the stage and the Langfuse generation."""
+        if not usage.usage_metadata:
+            return None
+
+        total = sum((usage_from_metadata(metadata) for metadata in usage.usage_metadata.values()), TokenUsage())
+        cost_usd = record_usage(stage, llm_model, total)
+        generation.update(usage_details=total.usage_details(),
+                          cost_details={"total": cost_usd} if cost_usd is not None else None)
+        return total.as_dict()
+
+    async def _astream_generate(self, state: State, prompt_value, context: PackedContext,
+                                route: ModelRoute) -> AsyncIterator[dict]:
+        """Stream the answer's text as token events, ending with a {"type": "result", "result": ...} event."""
+        self.usage_budget.check_tokens(current_session(), "generate")
+        async with self.generation_admission.aadmit():
+            t0 = time.perf_counter()
+            fell_back = False
+            progress = {"streamed": False}
+            response, tokens = None, None
+
+            try:
+                async for event in self._astream_model(route, prompt_value, context, progress):
+                    if event["type"] == "result":
+                        response, tokens = event["answer"], event["tokens"]
+                    else:
+                        yield event
+            except Exception as e:
+                if progress["streamed"]:
+                    self._record_route(state, route, t0, fell_back=False)
+                    raise
+                fallback = self._fallback_route(route, e)
+                if fallback is None:
+                    result = self._degraded_answer(state, route, t0, context, e, fell_back=False)
+                    yield {"type": "token", "text": result["answer"].answer}
+                    yield {"type": "result", "result": result}
+                    return
+                route, fell_back = fallback, True
+                try:
+                    async for event in self._astream_model(route, prompt_value, context, progress):
+                        if event["type"] == "result":
+                            response, tokens = event["answer"], event["tokens"]
+                        else:
+                            yield event
+                except Exception as e:
+                    if progress["streamed"]:
+                        self._record_route(state, route, t0, fell_back=True)
+                        raise
+                    result = self._degraded_answer(state, route, t0, context, e, fell_back=True)
+                    yield {"type": "token", "text": result["answer"].answer}
+                    yield {"type": "result", "result": result}
+                    return
+
+            self._record_route(state, route, t0, fell_back=fell_back, answer=response, tokens=tokens)
+            self._store_answer(state, route, response, (time.perf_counter() - t0) * 1000.0)
+            yield {"type": "result", "result": {"answer": response}}
+
+    async def _astream_model(self, route: ModelRoute, prompt_value, context: PackedContext,
+                             progress: dict) -> AsyncIterator[dict]:
+        """Stream one model's answer as token events, ending with a {"type": "result", "answer", "tokens"} event."""
+        check_deadline("generate")
+        tier = self._tier(route)
+        budget_left = tier.breaker.before_call()
+        t0 = time.perf_counter()
+        ok = True
+        first_token_ms = None
+        streamed_text = ""
+        partial_answer: dict = {}
+        # The usage comes in the stream's last chunk, the chat models are created with stream_usage
+        usage = UsageMetadataCallbackHandler()
+
+        with self.langfuse.start_as_current_generation(name="generate", model=route.model) as generation:
+            try:
+                try:
+                    async for partial_answer in tier.streaming_llm.astream(prompt_value,
+                                                                           config={"callbacks": [usage]}):
+                        text = partial_answer.get("answer") or ""
+                        if len(text) > len(streamed_text):
+                            if first_token_ms is None:
+                                first_token_ms = (time.perf_counter() - t0) * 1000.0
+                            progress["streamed"] = True
+                            yield {"type": "token", "text": text[len(streamed_text):]}
+                            streamed_text = text
+                except Exception as e:
+                    if tier.breaker.is_failure(e, budget_left):
+                        tier.breaker.record_failure()
+                    raise
+                tier.breaker.record_success()
+
+                # The model answered, an answer whose citations can't be resolved is no failure of the model
+                response = self._to_quoted_answer(self.answer_schema.model_validate(partial_answer), context)
+            except Exception:
+                ok = False
+                raise
+            finally:
+                tokens = self._record_usage("generate", route.model, usage, generation)
+                dt_ms = (time.perf_counter() - t0) * 1000.0
+                record_llm_call(model=route.model, ok=ok, duration_ms=dt_ms, tokens=tokens, meta={
+                    "streaming": True,
+                    **({"first_token_ms": round(first_token_ms, 2)} if first_token_ms is not None else {})
+                })
+        yield {"type": "result", "answer": response, "tokens": tokens}
+
+    def _to_quoted_answer(self, response, context: PackedContext) -> QuotedAnswer:
+        if isinstance(response, CompactAnswer):
+            return resolve_citations(response, [source.text for source in context.sources])
+        return response
+
+    def _build_prompt(self, state: State):
+        context = self.context_packer.pack(state["existing_documents"], state.get("new_document"), state["question"])
+        return self._prompt_for(state["question"], context, state.get("history")), context
+
+    def _source_text(self, text: str) -> str:
+        return number_sentences(text) if self.citation_mode == "compact" else text
+
+    def _prompt_for(self, question: str, context: PackedContext, history: Optional[str] = None):
         existing_documents = "\n\n".join([
-            f"[Source {i + 1}]\n{doc.page_content}"
-            for i, doc in enumerate(state["existing_documents"])
+            f"[Source {i + 1}]\n{self._source_text(source.text)}"
+            for i, source in enumerate(context.existing_sources)
         ])
-        num_existing = len(state["existing_documents"])
-        new_document = "\n\nNew document:\n: None\n"
-        if state.get("new_document") and len(state["new_document"]) > 0:
-            new_document = (
-                    "\n\n".join([
-                        f"[Source {num_existing + i + 1}]\n{doc.page_content}"
-                        for i, doc in enumerate(state["new_document"])
-                    ]) +
-                    "\n\"\"\""
-            )
-
-        total_documents = num_existing + (0 if state["new_document"] is None else 1)
-
-        system_prompt = (
-            "You're a helpful AI assistant. Given documents and a user's question, "
-            "answer the user's question based only on the provided sources. "
-            f"You have {total_documents} sources available."
-            "\n\nExisting documents:\n\"\"\"\n{existing_documents}\n\"\"\""
+        num_existing = len(context.existing_sources)
+        new_document = "None"
+        if context.new_sources:
+            new_document = "\n\n".join([
+                f"[Source {num_existing + i + 1}]\n{self._source_text(source.text)}"
+                for i, source in enumerate(context.new_sources)
+            ])
+
+        # The sources change with every question, so they come after the static instructions
+        sources_prompt = (
+            "Existing documents:\n\"\"\"\n{existing_documents}\n\"\"\""
             "\n\nNew document:\n\"\"\"\n{new_document}\n\"\"\""
+            "\n\nYou have {total_documents} sources available."
         )
 
-        prompt = ChatPromptTemplate.from_messages(
-            [
-                ("system", system_prompt),
-                ("human", "{question}"),
-            ]
-        )
-        prompt_value = prompt.invoke({
-            "question": state["question"],
+        messages = [
+            # A message rather than a template, the examples' JSON braces are not template variables
+            SystemMessage(content=answer_instructions(self.citation_mode)),
+            ("system", sources_prompt),
+        ]
+        if history:
+            # Capped in tokens by the conversation memory, so the prompt doesn't grow with every turn
+            messages.append(("system", "Conversation so far, for questions referring to it:\n{history}"))
+        messages.append(("human", "{question}"))
+
+        prompt = ChatPromptTemplate.from_messages(messages)
+        return prompt.invoke({
+            "question": question,
             "existing_documents": existing_documents,
             "new_document": new_document,
+            "total_documents": len(context.sources),
+            **({"history": history} if history else {}),
         })
-
-        t0 = time.perf_counter()
-        ok = True
-        prompt_tokens = completion_tokens = total_tokens = None
-
-        try:
-            response = self.llm.invoke(prompt_value)
-            usage = getattr(response, "usage", None)
-            if usage:
-                prompt_tokens = getattr(usage, "prompt_tokens", None)
-                completion_tokens = getattr(usage, "completion_tokens", None)
-                total_tokens = getattr(usage, "total_tokens", None)
-            return {"answer": response}
-        except Exception:
-            ok = False
-            raise
-        finally:
-            dt_ms = (time.perf_counter() - t0) * 1000.0
-            tokens = None
-            if total_tokens is not None:
-                tokens = {
-                    "prompt": prompt_tokens or 0,
-                    "completion": completion_tokens or 0,
-                    "total": total_tokens or 0
-                }
-            record_llm_call(model=model, ok=ok, duration_ms=dt_ms, tokens=tokens)
\ No newline at end of file
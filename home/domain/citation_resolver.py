@@ -0,0 +1,78 @@
+import re
+
+from document_bot.analytics import debug
+from home.domain.compact_answer import CompactAnswer
+from home.domain.quoted_answer import QuotedAnswer
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+|\n\s*\n")
+WHITESPACE = re.compile(r"\s+")
+GAP = " ... "
+
+
+def sentence_spans(text: str) -> list[tuple[int, int]]:
+    """The (start, end) character offsets of each sentence of the text, without surrounding whitespace."""
+    spans = []
+    start = 0
+    for end in [match.start() for match in SENTENCE_END.finditer(text)] + [len(text)]:
+        sentence = text[start:end]
+        if sentence.strip():
+            leading = len(sentence) - len(sentence.lstrip())
+            spans.append((start + leading, start + len(sentence.rstrip())))
+        match = SENTENCE_END.match(text, end)
+        start = match.end() if match else end
+    return spans
+
+
+def split_sentences(text: str) -> list[str]:
+    """The sentences of the text, each exactly as it appears in the text."""
+    return [text[start:end] for start, end in sentence_spans(text)]
+
+
+def number_sentences(text: str) -> str:
+    """Prefix each sentence with <n>, numbered from 1, so the model can cite it by number."""
+    return " ".join(
+        f"<{i + 1}> {WHITESPACE.sub(' ', sentence)}" for i, sentence in enumerate(split_sentences(text))
+    )
+
+
+def resolve_citations(answer: CompactAnswer, sources: list[str]) -> QuotedAnswer:
+    """
+    Turn sentence number citations into quotes copied from the sources shown to the model.
+
+    Citations of an unknown source or sentence are dropped, so every quote returned
+    is verbatim from a source whatever the model answered.
+    """
+    sentences_by_source = {}
+    citations = []
+    num_unresolved = 0
+
+    for compact_citation in answer.citations:
+        source_index = compact_citation.source_id - 1
+        if not 0 <= source_index < len(sources):
+            num_unresolved += 1
+            continue
+
+        source = sources[source_index]
+        if source_index not in sentences_by_source:
+            sentences_by_source[source_index] = sentence_spans(source)
+        spans = sentences_by_source[source_index]
+
+        sentence_ids = sorted({i for i in compact_citation.sentence_ids if 1 <= i <= len(spans)})
+        if not sentence_ids:
+            num_unresolved += 1
+            continue
+
+        # Consecutive sentences are quoted as one slice of the source, so the quote keeps the source's own
+        # whitespace and line breaks; only sentences that are apart are joined with a gap.
+        runs = [[sentence_ids[0], sentence_ids[0]]]
+        for sentence_id in sentence_ids[1:]:
+            if sentence_id == runs[-1][1] + 1:
+                runs[-1][1] = sentence_id
+            else:
+                runs.append([sentence_id, sentence_id])
+        quote = GAP.join(source[spans[first - 1][0]:spans[last - 1][1]] for first, last in runs)
+        citations.append({"source_id": compact_citation.source_id, "quote": quote})
+
+    debug("citations_resolved", {"num_citations": len(citations), "num_unresolved": num_unresolved})
+
+    return QuotedAnswer.model_validate({"answer": answer.answer, "citations": citations})
@@ -0,0 +1,26 @@
+from typing import List
+
+from pydantic import BaseModel, Field
+
+
+class CompactCitation(BaseModel):
+    source_id: int = Field(
+        ...,
+        description="The integer ID of a SPECIFIC source which justifies the answer.",
+    )
+    sentence_ids: List[int] = Field(
+        ...,
+        description="The numbers of the sentences of that source which justify the answer, like 3 for <3>.",
+    )
+
+
+class CompactAnswer(BaseModel):
+    """Answer the user question based only on the given sources, and cite the source sentences used."""
+
+    answer: str = Field(
+        ...,
+        description="The answer to the user question, which is based only on the given sources.",
+    )
+    citations: List[CompactCitation] = Field(
+        ..., description="Citations of source sentences that justify the answer."
+    )
@@ -1,46 +1,226 @@
+import asyncio
+import contextvars
+import os
 import time
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
 from typing import Optional
 
-from document_bot.analytics import debug
+from document_bot.analytics import debug, record_validator_duration
 from home.domain.invalid_question_error import InvalidQuestionError
 from home.domain.question_validator import QuestionValidator
 
 
 class CompositeQuestionValidator(QuestionValidator):
-    def __init__(self, validators: list[QuestionValidator]):
-        self.validators = validators
+    """
+    Run several validators, failing on the first InvalidQuestionError.
+
+    Local validators always run first, in order, so a cheap check can reject a question
+    before any remote call. With concurrent=True the remaining validators then run
+    together, and the question is rejected as soon as one of them fails. The two
+    phases can also be run apart, with validate_locally and validate_remotely.
+
+    The sync validators share a pool of max_workers threads across all requests, each
+    request taking one thread per remote validator. A single remote validator runs on
+    the calling thread.
+    """
+
+    def __init__(self, validators: list[QuestionValidator], concurrent: bool = False, max_workers: int = None):
+        # sorted is stable, so validators keep their order within local and remote ones
+        self.validators = sorted(validators, key=lambda validator: not validator.local)
+        self.local_validators = [validator for validator in self.validators if validator.local]
+        self.remote_validators = [validator for validator in self.validators if not validator.local]
+        self.concurrent = concurrent
+        self.executor = None
+        if concurrent and len(self.remote_validators) > 1:
+            self.executor = ThreadPoolExecutor(
+                max_workers=max_workers or int(os.getenv("VALIDATION_MAX_WORKERS", "16"))
+            )
 
     def validate(self, question: str, user_id: Optional[str] = None) -> None:
+        self._validate(question, user_id, self.local_validators, remote=True)
+
+    def validate_locally(self, question: str, user_id: Optional[str] = None) -> None:
+        self._validate(question, user_id, self.local_validators, remote=False)
+
+    def validate_remotely(self, question: str, user_id: Optional[str] = None) -> None:
+        self._validate(question, user_id, [], remote=True)
+
+    async def avalidate(self, question: str, user_id: Optional[str] = None) -> None:
+        await self._avalidate(question, user_id, self.local_validators)
+
+    async def avalidate_remotely(self, question: str, user_id: Optional[str] = None) -> None:
+        await self._avalidate(question, user_id, [])
+
+    def _validate(self, question: str, user_id: Optional[str], local_validators: list[QuestionValidator],
+                  remote: bool) -> None:
+        t0 = self._start(question, user_id)
+        timings = {}
+
+        validator = None
+        try:
+            for validator in local_validators:
+                self._timed(validator, timings, question, user_id)
+
+            if remote and self.executor:
+                failure = self._validate_concurrently(question, user_id, timings)
+                if failure:
+                    validator, exception = failure
+                    raise exception
+            elif remote:
+                for validator in self.remote_validators:
+                    self._timed(validator, timings, question, user_id)
+        except InvalidQuestionError as e:
+            self._failed(t0, validator, e, user_id, timings)
+            raise
+
+        self._complete(t0, user_id, timings)
+
+    async def _avalidate(self, question: str, user_id: Optional[str],
+                         local_validators: list[QuestionValidator]) -> None:
+        t0 = self._start(question, user_id)
+        timings = {}
+
+        validator = None
+        try:
+            for validator in local_validators:
+                await self._atimed(validator, timings, question, user_id)
+
+            if self.concurrent:
+                failure = await self._avalidate_concurrently(question, user_id, timings)
+                if failure:
+                    validator, exception = failure
+                    raise exception
+            else:
+                for validator in self.remote_validators:
+                    await self._atimed(validator, timings, question, user_id)
+        except InvalidQuestionError as e:
+            self._failed(t0, validator, e, user_id, timings)
+            raise
+
+        self._complete(t0, user_id, timings)
+
+    async def avalidate_batch(self, questions: list[str],
+                              user_id: Optional[str] = None) -> list[Optional[InvalidQuestionError]]:
+        """
+        Validate many questions with each validator's batch validation.
+
+        Validators run in the same order as for a single question, and a question
+        rejected by one validator is not sent to the next ones.
+        """
+        t0 = time.perf_counter()
+        failures: list[Optional[InvalidQuestionError]] = [None] * len(questions)
+        stages = [[validator] for validator in self.local_validators] + (
+            [self.remote_validators] if self.concurrent else [[validator] for validator in self.remote_validators]
+        )
+
+        pending = list(range(len(questions)))
+        for stage in stages:
+            if not pending:
+                break
+            results = await asyncio.gather(*(
+                validator.avalidate_batch([questions[i] for i in pending], user_id=user_id) for validator in stage
+            ))
+            for validator_failures in results:
+                for i, failure in zip(pending, validator_failures):
+                    if failure is not None and failures[i] is None:
+                        failures[i] = failure
+            pending = [i for i in pending if failures[i] is None]
+
+        debug("batch_validation_complete", {
+            "num_questions": len(questions),
+            "num_failed": len(questions) - len(pending),
+            "duration_ms": round((time.perf_counter() - t0) * 1000.0, 2),
+            "user_id": user_id
+        })
+        return failures
+
+    def _validate_concurrently(self, question: str, user_id: Optional[str],
+                               timings: dict) -> Optional[tuple[QuestionValidator, BaseException]]:
+        """Run the remote validators together, returning the first one to fail and its exception."""
+        futures = {
+            self.executor.submit(contextvars.copy_context().run, self._timed, validator, timings, question, user_id):
+                validator
+            for validator in self.remote_validators
+        }
+        done, pending = wait(futures, return_when=FIRST_EXCEPTION)
+
+        failed = [future for future in done if future.exception() is not None]
+        if not failed:
+            return None
+
+        # Validators already running can't be interrupted, their result is ignored
+        for future in pending:
+            future.cancel()
+        return futures[failed[0]], failed[0].exception()
+
+    async def _avalidate_concurrently(self, question: str, user_id: Optional[str],
+                                      timings: dict) -> Optional[tuple[QuestionValidator, BaseException]]:
+        tasks = {
+            asyncio.create_task(self._atimed(validator, timings, question, user_id)): validator
+            for validator in self.remote_validators
+        }
+        if not tasks:
+            return None
+
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+
+        failed = [task for task in done if task.exception() is not None]
+        if not failed:
+            return None
+
+        for task in pending:
+            task.cancel()
+        return tasks[failed[0]], failed[0].exception()
+
+    def _timed(self, validator: QuestionValidator, timings: dict, question: str, user_id: Optional[str]) -> None:
         t0 = time.perf_counter()
+        try:
+            validator.validate(question, user_id=user_id)
+        finally:
+            self._record_timing(validator, timings, t0)
 
+    async def _atimed(self, validator: QuestionValidator, timings: dict, question: str,
+                      user_id: Optional[str]) -> None:
+        t0 = time.perf_counter()
+        try:
+            await validator.avalidate(question, user_id=user_id)
+        finally:
+            self._record_timing(validator, timings, t0)
+
+    def _record_timing(self, validator: QuestionValidator, timings: dict, t0: float) -> None:
+        duration_ms = (time.perf_counter() - t0) * 1000.0
+        timings[type(validator).__name__] = round(duration_ms, 2)
+        record_validator_duration(type(validator).__name__, duration_ms)
+
+    def _start(self, question: str, user_id: Optional[str]) -> float:
         debug("validation_start", {
             "question_length": len(question),
             "num_validators": len(self.validators),
+            "concurrent": self.concurrent,
             "user_id": user_id
         })
+        return time.perf_counter()
 
-        try:
-            for validator in self.validators:
-                validator.validate(question, user_id=user_id)
+    def _complete(self, t0: float, user_id: Optional[str], timings: dict) -> None:
+        duration_ms = (time.perf_counter() - t0) * 1000.0
+        debug("validation_complete", {
+            "passed": True,
+            "duration_ms": round(duration_ms, 2),
+            "num_validators": len(self.validators),
+            "validator_timings_ms": timings,
+            "user_id": user_id
+        })
 
-            duration_ms = (time.perf_counter() - t0) * 1000.0
-            debug("validation_complete", {
-                "passed": True,
-                "duration_ms": round(duration_ms, 2),
-                "num_validators": len(self.validators),
-                "user_id": user_id
-            })
+    def _failed(self, t0: float, validator: Optional[QuestionValidator], e: InvalidQuestionError,
+                user_id: Optional[str], timings: dict) -> None:
+        duration_ms = (time.perf_counter() - t0) * 1000.0
+        failed_validator = type(validator).__name__ if validator else "unknown"
 
-        except InvalidQuestionError as e:
-            duration_ms = (time.perf_counter() - t0) * 1000.0
-            # Extract validator name from the most recent validation event
-            failed_validator = type(validator).__name__ if validator else "unknown"
-
-            debug("validation_complete", {
-                "passed": False,
-                "duration_ms": round(duration_ms, 2),
-                "failed_validator": failed_validator,
-                "reason": str(e),
-                "user_id": user_id
-            })
-            raise
\ No newline at end of file
+        debug("validation_complete", {
+            "passed": False,
+            "duration_ms": round(duration_ms, 2),
+            "failed_validator": failed_validator,
+            "reason": str(e),
+            "validator_timings_ms": timings,
+            "user_id": user_id
+        })
@@ -0,0 +1,63 @@
+import contextvars
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+from home.domain.deadline_exceeded_error import DeadlineExceededError
+
+
+@dataclass(frozen=True)
+class Deadline:
+    """The time, on the monotonic clock, by which a request must be answered."""
+    expires_at: float
+
+    @classmethod
+    def after(cls, seconds: float) -> "Deadline":
+        return cls(time.monotonic() + seconds)
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+
+_current_deadline: contextvars.ContextVar[Optional[Deadline]] = contextvars.ContextVar("deadline", default=None)
+
+
+@contextmanager
+def deadline_scope(deadline: Optional[Deadline]) -> Iterator[Optional[Deadline]]:
+    """
+    Make the deadline the current one for the code in the block.
+
+    It is a context variable, so it follows the request into tasks, asyncio.to_thread
+    and executors given contextvars.copy_context().run.
+    """
+    token = _current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        try:
+            _current_deadline.reset(token)
+        except ValueError:
+            # A generator closed from another context than the one it started in
+            pass
+
+
+def current_deadline() -> Optional[Deadline]:
+    return _current_deadline.get()
+
+
+def remaining_timeout(stage: str) -> Optional[float]:
+    """Seconds left for an outbound call, None without a deadline. Raises when no time is left."""
+    deadline = _current_deadline.get()
+    if deadline is None:
+        return None
+
+    remaining = deadline.remaining()
+    if remaining <= 0:
+        raise DeadlineExceededError(stage)
+    return remaining
+
+
+def check_deadline(stage: str) -> None:
+    """Raise DeadlineExceededError when the current request has no time left for the stage."""
+    remaining_timeout(stage)
@@ -0,0 +1,6 @@
+class DeadlineExceededError(Exception):
+    """Exception raised when a request ran out of time before a stage could complete."""
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        super().__init__(f"Request deadline exceeded before {stage} completed")
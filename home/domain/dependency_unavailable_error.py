@@ -0,0 +1,6 @@
+class DependencyUnavailableError(Exception):
+    """Exception raised instead of calling a dependency known to be failing."""
+
+    def __init__(self, dependency: str):
+        self.dependency = dependency
+        super().__init__(f"{dependency} is temporarily unavailable")
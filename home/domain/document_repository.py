@@ -1,3 +1,4 @@
+import asyncio
 from abc import ABC, abstractmethod
 
 from langchain_core.documents import Document
@@ -7,9 +8,52 @@ from home.domain.file_metadata import FileMetadata
 
 class DocumentRepository(ABC):
     @abstractmethod
+    def split_document(self, file_path: str, file_metadata: FileMetadata) -> list[Document]:
+        pass
+
+    @abstractmethod
+    def add_documents(self, documents: list[Document]) -> list[Document]:
+        pass
+
     def upload_document(self, file_path: str, file_metadata: FileMetadata) -> list[Document]:
+        return self.add_documents(self.split_document(file_path, file_metadata))
+
+    @abstractmethod
+    def embed_documents(self, documents: list[Document]) -> list[list[float]]:
+        pass
+
+    @abstractmethod
+    def add_embedded_documents(self, documents: list[Document], embeddings: list[list[float]]) -> list[Document]:
+        """Add documents embedded beforehand, all or none of them."""
+        pass
+
+    def get_corpus_version(self) -> int:
+        """Counter bumped every time documents are added, for caches derived from the corpus."""
+        return 0
+
+    @abstractmethod
+    def update_document_metadata(self, documents: list[Document], file_metadata: FileMetadata) -> list[Document]:
+        """Set the file's metadata on documents that are yet to be added."""
         pass
 
     @abstractmethod
     def similarity_search(self, query: str, k: int = 4) -> list[Document]:
         pass
+
+    @abstractmethod
+    def embed_query(self, query: str) -> list[float]:
+        pass
+
+    @abstractmethod
+    def similarity_search_by_vector(self, embedding: list[float], k: int = 4) -> list[Document]:
+        pass
+
+    async def aembed_query(self, query: str) -> list[float]:
+        return await asyncio.to_thread(self.embed_query, query)
+
+    async def asimilarity_search_by_vector(self, embedding: list[float], k: int = 4) -> list[Document]:
+        return await asyncio.to_thread(self.similarity_search_by_vector, embedding, k)
+
+    async def aembed_queries(self, queries: list[str]) -> list[list[float]]:
+        """Embed many queries, in as few requests as the implementation allows."""
+        return list(await asyncio.gather(*(self.aembed_query(query) for query in queries)))
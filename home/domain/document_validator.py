@@ -0,0 +1,10 @@
+from abc import ABC, abstractmethod
+from typing import Optional
+
+from langchain_core.documents import Document
+
+
+class DocumentValidator(ABC):
+    @abstractmethod
+    def validate_documents(self, documents: list[Document], user_id: Optional[str] = None) -> None:
+        pass
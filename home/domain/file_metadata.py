@@ -12,6 +12,7 @@ class FileMetadata:
     created_time: datetime
     modified_time: datetime
     upload_time: datetime
+    content_hash: str | None = None
 
     # file content metadata
     title: str | None = None
@@ -1,17 +1,20 @@
 from abc import abstractmethod, ABC
+from typing import Optional
 
 from home.domain.file_metadata import FileMetadata
+from home.domain.stored_file import StoredFile
 
 
 class FileMetadataExtractor(ABC):
     @abstractmethod
-    def extract_metadata(self, file_path: str, max_chars=8000) -> FileMetadata:
+    def extract_metadata(self, file_path: str, max_chars=8000, stored_file: Optional[StoredFile] = None) -> FileMetadata:
         """
         Extract metadata from text.
 
         Args:
             file_path: Absolute path to the file.
             max_chars: Maximum characters to send to LLM
+            stored_file: Hash, size and content sample captured when the file was stored, if any
 
         Returns:
             Dictionary of extracted metadata
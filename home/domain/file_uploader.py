@@ -1,17 +1,63 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
 from langchain_core.documents import Document
 
+from document_bot.analytics import debug, time_block
 from home.domain.document_repository import DocumentRepository
+from home.domain.document_validator import DocumentValidator
 from home.domain.file_metadata_extractor import FileMetadataExtractor
+from home.domain.stored_file import StoredFile
+from home.infrastructure.base_file_metadata_extractor import BaseFileMetadataExtractor
 
 
 class FileUploader:
     file_metadata_extractor: FileMetadataExtractor
+    base_file_metadata_extractor: FileMetadataExtractor
     document_repository: DocumentRepository
+    document_validator: Optional[DocumentValidator]
 
-    def __init__(self, file_metadata_extractor: FileMetadataExtractor, document_repository: DocumentRepository):
+    def __init__(self, file_metadata_extractor: FileMetadataExtractor, document_repository: DocumentRepository,
+                 base_file_metadata_extractor: Optional[FileMetadataExtractor] = None,
+                 document_validator: Optional[DocumentValidator] = None):
         self.file_metadata_extractor = file_metadata_extractor
         self.document_repository = document_repository
+        self.base_file_metadata_extractor = base_file_metadata_extractor or BaseFileMetadataExtractor()
+        self.document_validator = document_validator
+
+    def upload_file(self, file_path: str, stored_file: Optional[StoredFile] = None,
+                    user_id: Optional[str] = None) -> list[Document]:
+        _, finish = time_block()
+
+        # The content metadata comes from a slow LLM call, so chunking and embedding run while it
+        # is extracted and the chunks are added in one go, with all their metadata, once both are done.
+        executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            file_metadata_future = executor.submit(
+                contextvars.copy_context().run,
+                self.file_metadata_extractor.extract_metadata,
+                file_path,
+                stored_file=stored_file,
+            )
+
+            base_file_metadata = self.base_file_metadata_extractor.extract_metadata(file_path, stored_file=stored_file)
+            documents = self.document_repository.split_document(file_path, base_file_metadata)
+            if self.document_validator:
+                self.document_validator.validate_documents(documents, user_id=user_id)
+            embeddings = self.document_repository.embed_documents(documents)
+            embedding_done = finish()
+
+            file_metadata = file_metadata_future.result()
+        finally:
+            # Don't hold a rejected upload until the metadata call returns
+            executor.shutdown(wait=False)
+
+        documents = self.document_repository.update_document_metadata(documents, file_metadata)
+        documents = self.document_repository.add_embedded_documents(documents, embeddings)
 
-    def upload_file(self, file_path: str) -> list[Document]:
-        file_metadata = self.file_metadata_extractor.extract_metadata(file_path)
-        return self.document_repository.upload_document(file_path, file_metadata)
\ No newline at end of file
+        debug("file_upload", finish({
+            "embedding_duration_ms": embedding_done["duration_ms"],
+            "num_chunks": len(documents),
+        }))
+        return documents
@@ -0,0 +1,6 @@
+class InvalidDocumentError(Exception):
+    """Exception raised when an uploaded document fails validation."""
+
+    def __init__(self, message: str = "Invalid document"):
+        self.message = message
+        super().__init__(self.message)
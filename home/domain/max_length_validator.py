@@ -7,6 +7,8 @@ from home.domain.question_validator import QuestionValidator
 
 
 class MaxLengthValidator(QuestionValidator):
+    local = True
+
     def __init__(self, max_length: int = 1000):
         self.max_length = max_length
 
@@ -37,4 +39,8 @@ class MaxLengthValidator(QuestionValidator):
                 user_id=user_id,
                 meta={"actual_length": actual_length, "max_length": self.max_length}
             )
-            raise InvalidQuestionError(reason)
\ No newline at end of file
+            raise InvalidQuestionError(reason)
+
+    async def avalidate(self, question: str, user_id: Optional[str] = None) -> None:
+        # Only a length check, not worth a thread
+        self.validate(question, user_id=user_id)
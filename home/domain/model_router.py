@@ -0,0 +1,81 @@
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from home.domain.question_normalizer import normalize_question
+
+FAST = "fast"
+STRONG = "strong"
+
+
+@dataclass(frozen=True)
+class ModelRoute:
+    tier: str
+    model: str
+    reasons: tuple[str, ...] = ()
+
+
+class ModelRouter:
+    """
+    Send each question to the fast or the strong model tier.
+
+    Every difficulty signal of a question adds to its score, and questions scoring at
+    least strong_score go to the strong tier. A question that needed the fallback or got
+    an answer without citations is remembered as difficult the next time it is asked.
+    """
+
+    def __init__(self, fast_model: str = None, strong_model: str = None, long_question_chars: int = None,
+                 many_sources: int = None, flat_score_spread: float = None, strong_score: int = 2,
+                 max_tracked_questions: int = 10000):
+        self.fast_model = fast_model or os.getenv("ROUTER_FAST_MODEL", "gpt-4o-mini")
+        self.strong_model = strong_model or os.getenv("ROUTER_STRONG_MODEL", "gpt-4o")
+        self.long_question_chars = long_question_chars or int(os.getenv("ROUTER_LONG_QUESTION_CHARS", "300"))
+        self.many_sources = many_sources or int(os.getenv("ROUTER_MANY_SOURCES", "8"))
+        self.flat_score_spread = flat_score_spread or float(os.getenv("ROUTER_FLAT_SCORE_SPREAD", "0.02"))
+        self.strong_score = strong_score
+        self.max_tracked_questions = max_tracked_questions
+        self.difficult_questions: OrderedDict[str, int] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def route(self, question: str, scores: list[float], num_sources: int) -> ModelRoute:
+        reasons = []
+        if len(question) > self.long_question_chars:
+            reasons.append("long_question")
+        if num_sources > self.many_sources:
+            reasons.append("many_sources")
+        # Retrieval scores close together mean no source stands out as the answer
+        if len(scores) > 1 and max(scores) - min(scores) < self.flat_score_spread:
+            reasons.append("flat_scores")
+
+        score = len(reasons)
+        if self.past_difficulty(question):
+            reasons.append("past_difficulty")
+            score += self.strong_score
+
+        if score >= self.strong_score and self.strong_model != self.fast_model:
+            return ModelRoute(STRONG, self.strong_model, tuple(reasons))
+        return ModelRoute(FAST, self.fast_model, tuple(reasons))
+
+    def fallback(self, route: ModelRoute) -> Optional[ModelRoute]:
+        """The other tier, to retry a failed call on, None when both tiers use the same model."""
+        if self.strong_model == self.fast_model:
+            return None
+        if route.tier == FAST:
+            return ModelRoute(STRONG, self.strong_model, route.reasons + ("fallback",))
+        return ModelRoute(FAST, self.fast_model, route.reasons + ("fallback",))
+
+    def past_difficulty(self, question: str) -> int:
+        with self.lock:
+            return self.difficult_questions.get(normalize_question(question), 0)
+
+    def record_outcome(self, question: str, route: ModelRoute, fell_back: bool, num_citations: int) -> None:
+        if not fell_back and (route.tier == STRONG or num_citations > 0):
+            return
+
+        key = normalize_question(question)
+        with self.lock:
+            self.difficult_questions[key] = self.difficult_questions.pop(key, 0) + 1
+            while len(self.difficult_questions) > self.max_tracked_questions:
+                self.difficult_questions.popitem(last=False)
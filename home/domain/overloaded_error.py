@@ -0,0 +1,8 @@
+class OverloadedError(Exception):
+    """Exception raised when a request is turned away because the process has no capacity left for it."""
+
+    def __init__(self, resource: str, reason: str, retry_after_seconds: int):
+        self.resource = resource
+        self.reason = reason
+        self.retry_after_seconds = retry_after_seconds
+        super().__init__(f"{resource} is overloaded ({reason}), retry after {retry_after_seconds}s")
@@ -0,0 +1,10 @@
+import re
+
+WHITESPACE = re.compile(r"\s+")
+TRAILING_PUNCTUATION = re.compile(r"[\s?!.]+$")
+
+
+def normalize_question(question: str) -> str:
+    """Fold case, whitespace and trailing punctuation so trivially different questions compare equal."""
+    normalized = WHITESPACE.sub(" ", question.strip().lower())
+    return TRAILING_PUNCTUATION.sub("", normalized)
@@ -1,8 +1,48 @@
+import asyncio
 from abc import ABC, abstractmethod
 from typing import Optional
 
+from home.domain.invalid_question_error import InvalidQuestionError
+
 
 class QuestionValidator(ABC):
+    # Local validators make no network call, so they run before the remote ones
+    local: bool = False
+
     @abstractmethod
     def validate(self, question: str, user_id: Optional[str] = None) -> None:
-        pass
\ No newline at end of file
+        pass
+
+    async def avalidate(self, question: str, user_id: Optional[str] = None) -> None:
+        """Validate without blocking the event loop, in a thread unless a validator has a native async version."""
+        await asyncio.to_thread(self.validate, question, user_id=user_id)
+
+    def validate_locally(self, question: str, user_id: Optional[str] = None) -> None:
+        """Run the checks of validate that make no network call, validate_remotely runs the others."""
+        if self.local:
+            self.validate(question, user_id=user_id)
+
+    def validate_remotely(self, question: str, user_id: Optional[str] = None) -> None:
+        if not self.local:
+            self.validate(question, user_id=user_id)
+
+    async def avalidate_remotely(self, question: str, user_id: Optional[str] = None) -> None:
+        if not self.local:
+            await self.avalidate(question, user_id=user_id)
+
+    async def avalidate_batch(self, questions: list[str],
+                              user_id: Optional[str] = None) -> list[Optional[InvalidQuestionError]]:
+        """
+        Validate many questions, returning each one's InvalidQuestionError, or None when it passed.
+
+        Validators that can check several questions in one call override this, by default
+        the questions are validated concurrently one by one.
+        """
+        async def validate(question: str) -> Optional[InvalidQuestionError]:
+            try:
+                await self.avalidate(question, user_id=user_id)
+            except InvalidQuestionError as e:
+                return e
+            return None
+
+        return list(await asyncio.gather(*(validate(question) for question in questions)))
@@ -0,0 +1,8 @@
+class QuotaExceededError(Exception):
+    """Exception raised when a session, or the whole service, has used up its token or request budget for now."""
+
+    def __init__(self, scope: str, resource: str, retry_after_seconds: int):
+        self.scope = scope
+        self.resource = resource
+        self.retry_after_seconds = retry_after_seconds
+        super().__init__(f"{scope} {resource} budget exceeded, retry after {retry_after_seconds}s")
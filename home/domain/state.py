@@ -10,3 +10,11 @@ class State(TypedDict):
     question: str
     new_document: list[Document]
     answer: QuotedAnswer
+    question_embedding: list[float]
+    cache_hit: str
+    degraded: bool
+    history: str
+    # The caches were looked up and the session's budget checked by the caller, before a shared pipeline run
+    cache_checked: bool
+    # The prompt, packed context and model route of the question, built once and reused by generation
+    prepared_generation: tuple
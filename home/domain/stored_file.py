@@ -0,0 +1,12 @@
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class StoredFile:
+    file_path: str
+    content_hash: str
+    file_size: int
+
+    # first and last bytes of the content, captured while the file was stored
+    head: bytes = b""
+    tail: bytes = b""
@@ -0,0 +1,151 @@
+import contextvars
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+from document_bot.analytics import record_token_usage
+from home.infrastructure.usage_budget import get_usage_budget
+
+# USD per million (input, cached input, output) tokens
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4.1": (2.00, 0.50, 8.00),
+    "text-embedding-3-small": (0.02, 0.02, 0.0),
+    "text-embedding-3-large": (0.13, 0.13, 0.0),
+}
+
+
+@dataclass(frozen=True)
+class TokenUsage:
+    """Tokens of one or more model calls. Cached tokens are the part of the prompt served from the prompt cache."""
+    prompt: int = 0
+    completion: int = 0
+    cached: int = 0
+
+    @property
+    def total(self) -> int:
+        return self.prompt + self.completion
+
+    def __add__(self, other: "TokenUsage") -> "TokenUsage":
+        return TokenUsage(self.prompt + other.prompt, self.completion + other.completion, self.cached + other.cached)
+
+    def as_dict(self) -> dict:
+        return {"prompt": self.prompt, "completion": self.completion, "cached": self.cached, "total": self.total}
+
+    def usage_details(self) -> dict:
+        """The usage in Langfuse's terms."""
+        return {"input": self.prompt, "output": self.completion, "input_cache_read": self.cached,
+                "total": self.total}
+
+
+def usage_from_metadata(usage_metadata: dict) -> TokenUsage:
+    """The usage of a LangChain message's usage_metadata."""
+    return TokenUsage(
+        prompt=usage_metadata.get("input_tokens") or 0,
+        completion=usage_metadata.get("output_tokens") or 0,
+        cached=(usage_metadata.get("input_token_details") or {}).get("cache_read") or 0,
+    )
+
+
+def usage_from_openai(usage) -> Optional[TokenUsage]:
+    """The usage of an OpenAI API response, None when the response has none."""
+    if usage is None:
+        return None
+    details = getattr(usage, "prompt_tokens_details", None)
+    return TokenUsage(
+        prompt=getattr(usage, "prompt_tokens", None) or 0,
+        completion=getattr(usage, "completion_tokens", None) or 0,
+        cached=getattr(details, "cached_tokens", None) or 0,
+    )
+
+
+def estimate_cost_usd(model: str, tokens: Optional[dict]) -> Optional[float]:
+    prices = MODEL_PRICES.get(model)
+    if not prices or not tokens:
+        return None
+    cached = tokens.get("cached", 0)
+    return ((tokens.get("prompt", 0) - cached) * prices[0] + cached * prices[1]
+            + tokens.get("completion", 0) * prices[2]) / 1_000_000
+
+
+class UsageLedger:
+    """
+    The tokens and estimated cost of a request or question, by stage.
+
+    A ledger opened inside another one also adds to the outer ledger, so a question's
+    usage counts towards the request it is part of.
+    """
+
+    def __init__(self, session_id: Optional[str], parent: Optional["UsageLedger"] = None):
+        self.session_id = session_id
+        self.parent = parent
+        self.by_stage: dict[str, TokenUsage] = {}
+        self.cost_usd = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, usage: TokenUsage, cost_usd: Optional[float]) -> None:
+        with self._lock:
+            self.by_stage[stage] = self.by_stage.get(stage, TokenUsage()) + usage
+            self.cost_usd += cost_usd or 0.0
+        if self.parent is not None:
+            self.parent.add(stage, usage, cost_usd)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "tokens": {stage: usage.as_dict() for stage, usage in self.by_stage.items()},
+                "cost_usd": round(self.cost_usd, 6),
+            }
+
+
+_current_ledger: contextvars.ContextVar[Optional[UsageLedger]] = contextvars.ContextVar("usage_ledger",
+                                                                                        default=None)
+
+
+@contextmanager
+def usage_scope(session_id: Optional[str] = None) -> Iterator[UsageLedger]:
+    """
+    Record the usage of the model calls in the block in a new ledger, also added to the current one.
+
+    The session defaults to the current ledger's. Like the deadline, the ledger is a context
+    variable and follows the request into tasks and executors.
+    """
+    parent = _current_ledger.get()
+    if session_id is None and parent is not None:
+        session_id = parent.session_id
+    ledger = UsageLedger(session_id, parent)
+    token = _current_ledger.set(ledger)
+    try:
+        yield ledger
+    finally:
+        try:
+            _current_ledger.reset(token)
+        except ValueError:
+            # A generator closed from another context than the one it started in
+            pass
+
+
+def current_usage() -> Optional[UsageLedger]:
+    return _current_ledger.get()
+
+
+def current_session() -> Optional[str]:
+    """The session the current model calls are accounted to, None outside a request."""
+    ledger = _current_ledger.get()
+    return ledger.session_id if ledger else None
+
+
+def record_usage(stage: str, model: str, usage: TokenUsage) -> Optional[float]:
+    """Account the usage of a model call to the stage, model and session and its budget, returning its cost."""
+    tokens = usage.as_dict()
+    cost_usd = estimate_cost_usd(model, tokens)
+    ledger = _current_ledger.get()
+    if ledger is not None:
+        ledger.add(stage, usage, cost_usd)
+    session_id = ledger.session_id if ledger else None
+    get_usage_budget().charge_tokens(session_id, usage.total)
+    record_token_usage(stage, model, tokens, cost_usd, user_id=session_id)
+    return cost_usd
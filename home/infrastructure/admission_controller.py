@@ -0,0 +1,159 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Callable, Iterator, Optional
+
+from document_bot.analytics import record_admission, record_admission_rejection, record_admission_wait
+from home.domain.deadline import current_deadline
+from home.domain.overloaded_error import OverloadedError
+
+QUEUE_FULL = "queue_full"
+WAIT_TIMEOUT = "wait_timeout"
+
+
+class _Waiter:
+    def __init__(self, grant: Callable[[], None]):
+        self.grant = grant
+        self.granted = False
+
+
+class AdmissionController:
+    """
+    Cap the calls to an expensive resource running at once in this process.
+
+    Calls over max_concurrent wait in a FIFO queue of at most max_queue calls, for at most
+    max_wait_seconds or until the request deadline. A call that can't be queued or waited
+    too long fails with OverloadedError, carrying a Retry-After estimate, so the request
+    is turned away at once instead of piling up behind the workers.
+
+    Sync and async callers share the same slots: a released slot is handed straight to
+    the oldest waiter, whether a thread or a task on an event loop.
+    """
+
+    def __init__(self, resource: str, max_concurrent: int = None, max_queue: int = None,
+                 max_wait_seconds: float = None):
+        self.resource = resource
+        self.max_concurrent = max_concurrent or int(os.getenv("ADMISSION_MAX_CONCURRENT", "8"))
+        self.max_queue = max_queue if max_queue is not None else int(os.getenv("ADMISSION_MAX_QUEUE", "32"))
+        self.max_wait_seconds = max_wait_seconds or float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "10"))
+        self.in_flight = 0
+        self.waiters: deque[_Waiter] = deque()
+        # Smoothed time a call holds its slot, for the Retry-After estimate
+        self.avg_hold_seconds = 1.0
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def admit(self) -> Iterator[None]:
+        t0 = time.perf_counter()
+        admitted = threading.Event()
+        waiter = self._enter(admitted.set)
+        if waiter:
+            admitted.wait(self._wait_seconds())
+            self._check_admitted(waiter)
+        t1 = self._record_wait(t0)
+        try:
+            yield
+        finally:
+            self._release(t1)
+
+    @asynccontextmanager
+    async def aadmit(self) -> AsyncIterator[None]:
+        t0 = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        admitted = loop.create_future()
+        # The slot may be released from another thread
+        waiter = self._enter(lambda: loop.call_soon_threadsafe(_set_result, admitted))
+        if waiter:
+            try:
+                await asyncio.wait_for(asyncio.shield(admitted), self._wait_seconds())
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                self._abandon(waiter)
+                raise
+            self._check_admitted(waiter)
+        t1 = self._record_wait(t0)
+        try:
+            yield
+        finally:
+            self._release(t1)
+
+    def _enter(self, grant: Callable[[], None]) -> Optional[_Waiter]:
+        """Take a free slot and return None, or queue a waiter for the next one."""
+        with self.lock:
+            if self.in_flight < self.max_concurrent and not self.waiters:
+                self.in_flight += 1
+                record_admission(self.resource, self.in_flight, len(self.waiters))
+                return None
+            if len(self.waiters) >= self.max_queue:
+                self._reject(QUEUE_FULL)
+            waiter = _Waiter(grant)
+            self.waiters.append(waiter)
+            record_admission(self.resource, self.in_flight, len(self.waiters))
+            return waiter
+
+    def _wait_seconds(self) -> float:
+        deadline = current_deadline()
+        return self.max_wait_seconds if deadline is None else min(self.max_wait_seconds, deadline.remaining())
+
+    def _check_admitted(self, waiter: _Waiter) -> None:
+        with self.lock:
+            if waiter.granted:
+                return
+            self.waiters.remove(waiter)
+            record_admission(self.resource, self.in_flight, len(self.waiters))
+            self._reject(WAIT_TIMEOUT)
+
+    def _abandon(self, waiter: _Waiter) -> None:
+        with self.lock:
+            if not waiter.granted:
+                self.waiters.remove(waiter)
+                record_admission(self.resource, self.in_flight, len(self.waiters))
+                return
+        self._release()
+
+    def _record_wait(self, t0: float) -> float:
+        t1 = time.perf_counter()
+        record_admission_wait(self.resource, (t1 - t0) * 1000.0)
+        return t1
+
+    def _release(self, t1: Optional[float] = None) -> None:
+        with self.lock:
+            if t1 is not None:
+                self.avg_hold_seconds = 0.8 * self.avg_hold_seconds + 0.2 * (time.perf_counter() - t1)
+            if self.waiters:
+                # The slot goes to the oldest waiter, in_flight stays the same
+                waiter = self.waiters.popleft()
+                waiter.granted = True
+                waiter.grant()
+            else:
+                self.in_flight -= 1
+            record_admission(self.resource, self.in_flight, len(self.waiters))
+
+    def _reject(self, reason: str) -> None:
+        """Raise OverloadedError, called with the lock held."""
+        queued = len(self.waiters)
+        retry_after_seconds = max(1, math.ceil(self.avg_hold_seconds * (queued + 1) / self.max_concurrent))
+        record_admission_rejection(self.resource, reason, self.in_flight, queued)
+        raise OverloadedError(self.resource, reason, retry_after_seconds)
+
+
+def _set_result(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+_controllers: dict[str, AdmissionController] = {}
+_controllers_lock = threading.Lock()
+
+
+def get_admission_controller(resource: str) -> AdmissionController:
+    """The controller of a resource, shared by everything in the process that uses it."""
+    with _controllers_lock:
+        if resource not in _controllers:
+            _controllers[resource] = AdmissionController(resource)
+        return _controllers[resource]
@@ -0,0 +1,38 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from home.domain.quoted_answer import QuotedAnswer
+
+
+class AnswerCache:
+    """In-memory LRU of answers with a time to live, keyed by the caller."""
+
+    def __init__(self, max_size: int = None, ttl_seconds: int = None):
+        self.max_size = max_size or int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+        self.ttl_seconds = ttl_seconds or int(os.getenv("ANSWER_CACHE_TTL_SECONDS", "86400"))
+        self._entries: OrderedDict[str, Tuple[float, QuotedAnswer]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[QuotedAnswer]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            stored_at, answer = entry
+            if time.time() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return answer
+
+    def set(self, key: str, answer: QuotedAnswer) -> None:
+        with self._lock:
+            self._entries[key] = (time.time(), answer)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
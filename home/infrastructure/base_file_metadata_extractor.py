@@ -1,21 +1,24 @@
 from datetime import datetime
 from pathlib import Path
+from typing import Optional
 
 from home.domain.file_metadata import FileMetadata
 from home.domain.file_metadata_extractor import FileMetadataExtractor
+from home.domain.stored_file import StoredFile
 
 
 class BaseFileMetadataExtractor(FileMetadataExtractor):
-    def extract_metadata(self, file_path: str, max_chars=8000) -> FileMetadata:
+    def extract_metadata(self, file_path: str, max_chars=8000, stored_file: Optional[StoredFile] = None) -> FileMetadata:
         file_path = Path(file_path)
         stat = file_path.stat()
 
         return FileMetadata(
             file_name=file_path.name,
             file_path=str(file_path.absolute()),
-            file_size=stat.st_size,
+            file_size=stored_file.file_size if stored_file else stat.st_size,
             file_extension=file_path.suffix.lower().split(".")[-1],
             created_time=datetime.fromtimestamp(stat.st_ctime),
             modified_time=datetime.fromtimestamp(stat.st_mtime),
             upload_time=datetime.now(),
+            content_hash=stored_file.content_hash if stored_file else None,
         )
\ No newline at end of file
@@ -0,0 +1,113 @@
+import os
+import threading
+import time
+from typing import Any, Awaitable, Callable
+
+from document_bot.analytics import record_circuit_rejection, record_circuit_state
+from home.domain.deadline import current_deadline
+from home.domain.dependency_unavailable_error import DependencyUnavailableError
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Stop calling a dependency after consecutive failures.
+
+    After failure_threshold failures in a row the circuit opens and calls fail at once
+    with DependencyUnavailableError. Once recovery_seconds have passed a single probe
+    call is let through: it closes the circuit when it succeeds and reopens it when it fails.
+
+    Errors of the caller rather than the dependency are not counted as failures: the caller_errors,
+    and any error of a call started once the request's deadline had already passed. A call that
+    times out because the dependency used up the time it was given is a failure of the dependency.
+    """
+
+    def __init__(self, dependency: str, failure_threshold: int = None, recovery_seconds: float = None,
+                 clock: Callable[[], float] = time.monotonic,
+                 caller_errors: tuple[type[Exception], ...] = ()):
+        self.dependency = dependency
+        self.caller_errors = caller_errors
+        self.failure_threshold = failure_threshold or int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+        self.recovery_seconds = recovery_seconds or float(os.getenv("CIRCUIT_RECOVERY_SECONDS", "30"))
+        self.clock = clock
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.lock = threading.Lock()
+
+    def call(self, fn: Callable[[], Any]) -> Any:
+        budget_left = self.before_call()
+        try:
+            result = fn()
+        except Exception as e:
+            if self.is_failure(e, budget_left):
+                self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+    async def acall(self, fn: Callable[[], Awaitable[Any]]) -> Any:
+        budget_left = self.before_call()
+        try:
+            result = await fn()
+        except Exception as e:
+            if self.is_failure(e, budget_left):
+                self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+    def before_call(self) -> bool:
+        """
+        Raise DependencyUnavailableError unless a call may go through, for calls not made by call or acall.
+
+        Returns whether the request's deadline had time left for the call, to pass on to is_failure.
+        """
+        deadline = current_deadline()
+        budget_left = deadline is None or deadline.remaining() > 0
+        with self.lock:
+            if self.state == CLOSED:
+                return budget_left
+            if self.clock() - self.opened_at >= self.recovery_seconds:
+                # Also lets a new probe through when the last one was abandoned without an outcome
+                self.opened_at = self.clock()
+                if self.state == OPEN:
+                    self._set_state(HALF_OPEN)
+                return budget_left
+
+        # Open, or half open with the probe call still running
+        record_circuit_rejection(self.dependency)
+        raise DependencyUnavailableError(self.dependency)
+
+    def is_failure(self, e: Exception, budget_left: bool = True) -> bool:
+        """
+        Whether the error counts against the dependency, for calls not made by call or acall.
+
+        budget_left is what before_call returned: a call started without time left failed because of
+        the caller, while a timeout of a call that had time is the dependency hanging.
+        """
+        if isinstance(e, self.caller_errors):
+            return False
+        return budget_left
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.failures = 0
+            if self.state != CLOSED:
+                self._set_state(CLOSED)
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+                if self.state != OPEN:
+                    self._set_state(OPEN)
+
+    def _set_state(self, state: str) -> None:
+        self.state = state
+        record_circuit_state(self.dependency, state)
+
@@ -0,0 +1,13 @@
+import xxhash
+
+
+def new_content_hasher():
+    return xxhash.xxh3_128()
+
+
+def hash_file(file_path: str, chunk_size: int = 64 * 1024) -> str:
+    hasher = new_content_hasher()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
@@ -0,0 +1,141 @@
+import os
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Callable, Optional
+
+import tiktoken
+from langchain_core.documents import Document
+
+from document_bot.analytics import debug, error
+
+# "[Source 12]" plus the blank lines around a source
+SOURCE_OVERHEAD_TOKENS = 8
+# Overlaps shorter than this are more likely a coincidence than the splitter's chunk overlap
+MIN_OVERLAP_CHARS = 20
+MAX_OVERLAP_CHARS = 1000
+WORD = re.compile(r"\w{3,}")
+
+
+@dataclass(frozen=True)
+class PackedSource:
+    document: Document
+    text: str
+
+
+@dataclass(frozen=True)
+class PackedContext:
+    existing_sources: list[PackedSource]
+    new_sources: list[PackedSource]
+    num_tokens: int
+    num_dropped: int
+
+    @property
+    def sources(self) -> list[PackedSource]:
+        """Every packed source, numbered from 1 in this order in the prompt."""
+        return self.existing_sources + self.new_sources
+
+
+@lru_cache(maxsize=None)
+def token_counter(model: str) -> Callable[[str], int]:
+    try:
+        encoding = tiktoken.encoding_for_model(model)
+    except Exception as e:
+        # The encoding is downloaded on first use, fall back to an estimate rather than failing every question
+        error("tiktoken_unavailable", {"model": model, "error": str(e)})
+        return lambda text: len(text) // 4 + 1
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+
+class ContextPacker:
+    """
+    Choose the sources to send to the model within a token budget.
+
+    Retrieved documents keep their retrieval order. Chunks of the uploaded document are
+    ranked by how many of the question's words they contain, skipped when they were also
+    retrieved, and shown in document order. Text a chunk shares with the previous chunk
+    of the same document, from the splitter's chunk overlap, is only sent once.
+    """
+
+    def __init__(self, model: str, max_tokens: int = None, count_tokens: Optional[Callable[[str], int]] = None):
+        self.model = model
+        self.max_tokens = max_tokens or int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+        self._count_tokens = count_tokens
+
+    def count_tokens(self, text: str) -> int:
+        if self._count_tokens is None:
+            self._count_tokens = token_counter(self.model)
+        return self._count_tokens(text)
+
+    def pack(self, existing_documents: list[Document], new_document: Optional[list[Document]],
+             question: str) -> PackedContext:
+        existing_ids = {doc.id for doc in existing_documents if isinstance(doc.id, str)}
+        new_candidates = [doc for doc in new_document or [] if not (isinstance(doc.id, str) and doc.id in existing_ids)]
+        candidates = list(existing_documents) + self._rank_by_question(new_candidates, question)
+
+        selected = {}
+        selected_keys = {}
+        num_tokens = 0
+        for doc in candidates:
+            key = self._chunk_key(doc)
+            previous = selected_keys.get((key[0], key[1] - 1)) if key else None
+            text = self._trim_overlap(previous.page_content, doc.page_content) if previous else doc.page_content
+
+            tokens = self.count_tokens(text) + SOURCE_OVERHEAD_TOKENS
+            if num_tokens + tokens > self.max_tokens:
+                continue
+
+            selected[id(doc)] = text
+            if key:
+                selected_keys[key] = doc
+            num_tokens += tokens
+
+        existing_sources = [PackedSource(doc, selected[id(doc)]) for doc in existing_documents if id(doc) in selected]
+        new_sources = self._in_document_order(
+            [doc for doc in new_candidates if id(doc) in selected], selected_keys, selected
+        )
+
+        num_dropped = len(candidates) - len(selected)
+        debug("context_packed", {
+            "num_candidates": len(candidates),
+            "num_sources": len(selected),
+            "num_dropped": num_dropped,
+            "num_duplicates": len(new_document or []) - len(new_candidates),
+            "num_tokens": num_tokens,
+            "max_tokens": self.max_tokens,
+        })
+
+        return PackedContext(existing_sources, new_sources, num_tokens, num_dropped)
+
+    def _in_document_order(self, documents: list[Document], selected_keys: dict, selected: dict) -> list[PackedSource]:
+        # Now that the neighbours are known, trim each chunk against the one shown just before it
+        sources = []
+        for doc in documents:
+            key = self._chunk_key(doc)
+            previous = selected_keys.get((key[0], key[1] - 1)) if key else None
+            text = self._trim_overlap(previous.page_content, doc.page_content) if previous else selected[id(doc)]
+            sources.append(PackedSource(doc, text))
+        return sources
+
+    def _rank_by_question(self, documents: list[Document], question: str) -> list[Document]:
+        words = set(WORD.findall(question.lower()))
+        if not words:
+            return documents
+
+        # sorted is stable, chunks matching as many words keep their document order
+        return sorted(documents, key=lambda doc: -len(words & set(WORD.findall(doc.page_content.lower()))))
+
+    def _chunk_key(self, doc: Document) -> Optional[tuple[str, int]]:
+        metadata = doc.metadata if isinstance(doc.metadata, dict) else {}
+        chunk_index = metadata.get("chunk_index")
+        document_key = metadata.get("content_hash") or metadata.get("file_path")
+        if not isinstance(chunk_index, int) or not isinstance(document_key, str):
+            return None
+        return document_key, chunk_index
+
+    def _trim_overlap(self, previous_text: str, text: str) -> str:
+        longest = min(len(previous_text), len(text), MAX_OVERLAP_CHARS)
+        for size in range(longest, MIN_OVERLAP_CHARS - 1, -1):
+            if previous_text.endswith(text[:size]):
+                return text[size:].lstrip()
+        return text
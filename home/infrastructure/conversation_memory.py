@@ -0,0 +1,159 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from document_bot.analytics import debug, error
+from home.domain.deadline import Deadline, deadline_scope
+from home.domain.token_usage import usage_scope
+
+# "User: " and "Assistant: " plus the line breaks of a turn
+TURN_OVERHEAD_TOKENS = 6
+# Turns kept unsummarized while summaries keep failing, beyond the ones shown verbatim
+MAX_PENDING_TURNS = 16
+
+
+@dataclass(frozen=True)
+class ConversationTurn:
+    question: str
+    answer: str
+
+
+@dataclass
+class _Conversation:
+    session_id: str
+    summary: str = ""
+    # Turns not yet folded into the summary, oldest first
+    turns: list[ConversationTurn] = field(default_factory=list)
+    summarizing: bool = False
+
+
+class ConversationMemory:
+    """
+    Per-session conversation history for follow-up questions, bounded in tokens.
+
+    The last max_turns turns are kept verbatim. Older turns are folded into a rolling
+    summary by summarize(summary, turns) in the background, so answering never waits for it.
+    The rendered history never exceeds max_tokens: the summary gets at most a third of
+    them and the newest turns the rest, the oldest turns are left out first.
+    Summaries are accounted to the session, each within summary_deadline_seconds.
+    Sessions are kept in memory, the least recently used beyond max_sessions are forgotten.
+    """
+
+    def __init__(self, summarize: Callable[[str, list[ConversationTurn]], str],
+                 count_tokens: Callable[[str], int], max_turns: int = None, max_tokens: int = None,
+                 max_sessions: int = None, summary_deadline_seconds: float = None):
+        self.summarize = summarize
+        self.count_tokens = count_tokens
+        self.max_turns = max_turns or int(os.getenv("CONVERSATION_MAX_TURNS", "4"))
+        self.max_tokens = max_tokens or int(os.getenv("CONVERSATION_MAX_TOKENS", "1000"))
+        self.max_sessions = max_sessions or int(os.getenv("CONVERSATION_MAX_SESSIONS", "10000"))
+        self.summary_deadline_seconds = summary_deadline_seconds or float(
+            os.getenv("CONVERSATION_SUMMARY_DEADLINE_SECONDS", "30"))
+        self._conversations: OrderedDict[str, _Conversation] = OrderedDict()
+        self._lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def history(self, session_id: Optional[str]) -> str:
+        """The conversation so far as prompt text, empty for a new or anonymous session."""
+        if not session_id:
+            return ""
+
+        with self._lock:
+            conversation = self._conversations.get(session_id)
+            if conversation is None:
+                return ""
+            self._conversations.move_to_end(session_id)
+            summary, turns = conversation.summary, list(conversation.turns)
+
+        parts = []
+        budget = self.max_tokens
+        if summary:
+            summary = "Summary of the earlier conversation: " + self._truncate(summary, self.max_tokens // 3)
+            budget -= self.count_tokens(summary)
+
+        recent_turns = []
+        for turn in reversed(turns[-self.max_turns:]):
+            text = f"User: {turn.question}\nAssistant: {turn.answer}"
+            num_tokens = self.count_tokens(text) + TURN_OVERHEAD_TOKENS
+            if num_tokens > budget:
+                # The last turn matters most for a follow-up, it is cut rather than left out
+                if not recent_turns and budget > TURN_OVERHEAD_TOKENS:
+                    recent_turns.append(self._truncate(text, budget - TURN_OVERHEAD_TOKENS))
+                break
+            recent_turns.append(text)
+            budget -= num_tokens
+
+        if summary:
+            parts.append(summary)
+        parts.extend(reversed(recent_turns))
+
+        debug("conversation_history", {
+            "num_turns": len(recent_turns),
+            "has_summary": bool(summary),
+            "num_tokens": self.max_tokens - budget,
+        })
+        return "\n\n".join(parts)
+
+    def add_turn(self, session_id: Optional[str], question: str, answer: str) -> None:
+        if not session_id:
+            return
+
+        with self._lock:
+            conversation = self._conversations.get(session_id)
+            if conversation is None:
+                conversation = self._conversations[session_id] = _Conversation(session_id)
+            self._conversations.move_to_end(session_id)
+            while len(self._conversations) > self.max_sessions:
+                self._conversations.popitem(last=False)
+
+            conversation.turns.append(ConversationTurn(question, answer))
+            del conversation.turns[:-(self.max_turns + MAX_PENDING_TURNS)]
+            self._schedule_summary(conversation)
+
+    def clear(self, session_id: str) -> None:
+        with self._lock:
+            self._conversations.pop(session_id, None)
+
+    def _schedule_summary(self, conversation: _Conversation) -> None:
+        """Summarize the turns beyond max_turns, called with the lock held."""
+        if conversation.summarizing or len(conversation.turns) <= self.max_turns:
+            return
+        conversation.summarizing = True
+        # Not given the request's context, the summary outlives the request and its deadline.
+        # _summarize opens its own usage scope and deadline instead.
+        self.executor.submit(self._summarize, conversation, conversation.summary,
+                             conversation.turns[:-self.max_turns])
+
+    def _summarize(self, conversation: _Conversation, summary: str, turns: list[ConversationTurn]) -> None:
+        num_turns = len(turns)
+        try:
+            with deadline_scope(Deadline.after(self.summary_deadline_seconds)), usage_scope(conversation.session_id):
+                new_summary = self.summarize(summary, turns)
+        except Exception as e:
+            error("conversation_summary_failed", {"num_turns": num_turns, "error": str(e)})
+            with self._lock:
+                conversation.summarizing = False
+            return
+
+        with self._lock:
+            conversation.summary = new_summary
+            # Turns dropped by the MAX_PENDING_TURNS cap meanwhile were the oldest, already gone from the front
+            while turns and (not conversation.turns or turns[0] is not conversation.turns[0]):
+                turns = turns[1:]
+            del conversation.turns[:len(turns)]
+            conversation.summarizing = False
+            self._schedule_summary(conversation)
+
+        debug("conversation_summarized", {"num_turns": num_turns, "num_tokens": self.count_tokens(new_summary)})
+
+    def _truncate(self, text: str, max_tokens: int) -> str:
+        num_tokens = self.count_tokens(text)
+        while num_tokens > max_tokens and text:
+            text = text[:max(0, int(len(text) * max_tokens / num_tokens) - 1)].rstrip()
+            num_tokens = self.count_tokens(text + "...")
+            if num_tokens <= max_tokens:
+                return text + "..."
+        return text
@@ -0,0 +1,31 @@
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+
+class FileMetadataCache:
+    """Extracted content metadata stored as JSON files, keyed by content hash, prompt version and model."""
+
+    def __init__(self, cache_path: str):
+        self.cache_path = Path(cache_path)
+
+    def _entry_path(self, content_hash: str, prompt_version: str, model: str) -> Path:
+        return self.cache_path / model / prompt_version / f"{content_hash}.json"
+
+    def get(self, content_hash: str, prompt_version: str, model: str) -> Optional[dict]:
+        try:
+            with open(self._entry_path(content_hash, prompt_version, model), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def set(self, content_hash: str, prompt_version: str, model: str, metadata_json: dict) -> None:
+        entry_path = self._entry_path(content_hash, prompt_version, model)
+        entry_path.parent.mkdir(parents=True, exist_ok=True)
+
+        # Write then rename so concurrent readers never see a partial entry
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=entry_path.parent, delete=False) as f:
+            json.dump(metadata_json, f)
+        os.replace(f.name, entry_path)
@@ -0,0 +1,242 @@
+import asyncio
+import contextvars
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Optional
+
+import httpx
+import openai
+
+from document_bot.analytics import record_hedge, record_retry
+from home.domain.deadline import check_deadline, current_deadline
+from home.domain.deadline_exceeded_error import DeadlineExceededError
+
+# Errors worth trying again, the request may well succeed a moment later
+TRANSIENT_ERRORS = (
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+    httpx.TimeoutException,
+    httpx.TransportError,
+    TimeoutError,
+    ConnectionError,
+)
+
+
+@dataclass(frozen=True)
+class HedgingPolicy:
+    """Fire a second identical call when the first is slower than this percentile of recent calls."""
+    percentile: float = field(default_factory=lambda: float(os.getenv("HEDGE_PERCENTILE", "95")))
+    initial_delay_ms: float = 1000.0
+    min_delay_ms: float = 50.0
+    max_delay_ms: float = 10000.0
+    min_samples: int = 20
+    window: int = 500
+    budget_ratio: float = field(default_factory=lambda: float(os.getenv("HEDGE_BUDGET_RATIO", "0.05")))
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """Retry transient errors with full-jitter exponential backoff, within a share of the calls made."""
+    max_retries: int = field(default_factory=lambda: int(os.getenv("RETRY_MAX_RETRIES", "2")))
+    base_delay_ms: float = 100.0
+    max_delay_ms: float = 2000.0
+    budget_ratio: float = field(default_factory=lambda: float(os.getenv("RETRY_BUDGET_RATIO", "0.1")))
+
+
+class _Budget:
+    """Each call earns `ratio` of a token, a hedge or retry spends one, so they stay a share of the traffic."""
+
+    def __init__(self, ratio: float, initial: float = 10.0):
+        self.ratio = ratio
+        self.maximum = max(initial, 1.0)
+        self.tokens = initial
+        self.lock = threading.Lock()
+
+    def deposit(self) -> None:
+        with self.lock:
+            self.tokens = min(self.maximum, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self.lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class HedgedCaller:
+    """
+    Call a slow remote dependency with hedging and retries.
+
+    A call still running after the hedging delay gets a duplicate, the first to succeed
+    wins and the other one is cancelled. Calls failing with a transient error are retried
+    after a jittered backoff. Hedges and retries each have a budget so an outage of the
+    dependency doesn't multiply the traffic sent to it.
+    """
+
+    def __init__(self, operation: str, hedging: Optional[HedgingPolicy] = None,
+                 retry: Optional[RetryPolicy] = None, max_workers: int = None):
+        self.operation = operation
+        self.hedging = hedging
+        self.retry = retry or RetryPolicy()
+        self.latencies_ms = deque(maxlen=hedging.window if hedging else 1)
+        self.latencies_lock = threading.Lock()
+        self.hedge_budget = _Budget(hedging.budget_ratio if hedging else 0.0)
+        self.retry_budget = _Budget(self.retry.budget_ratio)
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers or int(os.getenv("HEDGE_MAX_WORKERS", "16"))
+        ) if hedging else None
+
+    def hedge_delay_ms(self) -> float:
+        with self.latencies_lock:
+            if len(self.latencies_ms) < self.hedging.min_samples:
+                return self.hedging.initial_delay_ms
+            latencies = sorted(self.latencies_ms)
+
+        index = min(len(latencies) - 1, int(len(latencies) * self.hedging.percentile / 100))
+        return min(max(latencies[index], self.hedging.min_delay_ms), self.hedging.max_delay_ms)
+
+    def call(self, fn: Callable[[], Any]) -> Any:
+        self.retry_budget.deposit()
+        attempt = 0
+        while True:
+            check_deadline(self.operation)
+            try:
+                return self._hedged_call(fn) if self.hedging else self._timed_call(fn)
+            except TRANSIENT_ERRORS as e:
+                attempt += 1
+                backoff_seconds = self._backoff_seconds(attempt)
+                if not self._should_retry(attempt, e, backoff_seconds):
+                    raise
+                time.sleep(backoff_seconds)
+
+    async def acall(self, fn: Callable[[], Awaitable[Any]]) -> Any:
+        self.retry_budget.deposit()
+        attempt = 0
+        while True:
+            check_deadline(self.operation)
+            try:
+                return await (self._ahedged_call(fn) if self.hedging else self._atimed_call(fn))
+            except TRANSIENT_ERRORS as e:
+                attempt += 1
+                backoff_seconds = self._backoff_seconds(attempt)
+                if not self._should_retry(attempt, e, backoff_seconds):
+                    raise
+                await asyncio.sleep(backoff_seconds)
+
+    def _should_retry(self, attempt: int, e: Exception, backoff_seconds: float) -> bool:
+        if attempt > self.retry.max_retries:
+            record_retry(self.operation, "exhausted", e)
+            return False
+        remaining = self._remaining()
+        if remaining is not None and remaining <= backoff_seconds:
+            record_retry(self.operation, "deadline", e)
+            return False
+        if not self.retry_budget.withdraw():
+            record_retry(self.operation, "over_budget", e)
+            return False
+        record_retry(self.operation, "retried", e)
+        return True
+
+    def _backoff_seconds(self, attempt: int) -> float:
+        cap_ms = min(self.retry.max_delay_ms, self.retry.base_delay_ms * 2 ** (attempt - 1))
+        return random.uniform(0, cap_ms) / 1000.0
+
+    def _remaining(self) -> Optional[float]:
+        deadline = current_deadline()
+        return deadline.remaining() if deadline else None
+
+    def _record_latency(self, t0: float) -> None:
+        if self.hedging:
+            with self.latencies_lock:
+                self.latencies_ms.append((time.perf_counter() - t0) * 1000.0)
+
+    def _timed_call(self, fn: Callable[[], Any]) -> Any:
+        t0 = time.perf_counter()
+        result = fn()
+        self._record_latency(t0)
+        return result
+
+    async def _atimed_call(self, fn: Callable[[], Awaitable[Any]]) -> Any:
+        t0 = time.perf_counter()
+        remaining = self._remaining()
+        try:
+            # Cancels the request once the request deadline has passed
+            result = await asyncio.wait_for(fn(), remaining)
+        except TimeoutError:
+            if remaining is not None and self._remaining() <= 0:
+                raise DeadlineExceededError(self.operation)
+            raise
+        self._record_latency(t0)
+        return result
+
+    def _hedged_call(self, fn: Callable[[], Any]) -> Any:
+        # A running thread can't be interrupted, past the deadline its result is just ignored. A fn sending
+        # what is left of the deadline as its request timeout ends its thread then too.
+        self.hedge_budget.deposit()
+        primary = self.executor.submit(contextvars.copy_context().run, self._timed_call, fn)
+        remaining = self._remaining()
+        delay = self.hedge_delay_ms() / 1000.0
+        done, _ = wait([primary], timeout=delay if remaining is None else min(delay, remaining))
+        if done:
+            return primary.result()
+        if not self.hedge_budget.withdraw() or (remaining is not None and remaining <= delay):
+            done, _ = wait([primary], timeout=self._remaining())
+            if not done:
+                raise DeadlineExceededError(self.operation)
+            return primary.result()
+
+        record_hedge(self.operation, "fired")
+        hedge = self.executor.submit(contextvars.copy_context().run, self._timed_call, fn)
+        pending = {primary, hedge}
+        while True:
+            done, pending = wait(pending, timeout=self._remaining(), return_when=FIRST_COMPLETED)
+            if not done:
+                raise DeadlineExceededError(self.operation)
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    if future is hedge:
+                        record_hedge(self.operation, "won")
+                    return future.result()
+            if not pending:
+                # Both failed, report the error of the last one
+                return next(iter(done)).result()
+
+    async def _ahedged_call(self, fn: Callable[[], Awaitable[Any]]) -> Any:
+        self.hedge_budget.deposit()
+        primary = asyncio.ensure_future(self._atimed_call(fn))
+        try:
+            remaining = self._remaining()
+            delay = self.hedge_delay_ms() / 1000.0
+            done, _ = await asyncio.wait([primary], timeout=delay)
+            # A hedge started past the deadline could not finish in time anyway
+            if done or not self.hedge_budget.withdraw() or (remaining is not None and remaining <= delay):
+                return await primary
+
+            record_hedge(self.operation, "fired")
+            hedge = asyncio.ensure_future(self._atimed_call(fn))
+            pending = {primary, hedge}
+            try:
+                while True:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        if task.exception() is None:
+                            if task is hedge:
+                                record_hedge(self.operation, "won")
+                            return task.result()
+                    if not pending:
+                        return next(iter(done)).result()
+            finally:
+                for task in pending:
+                    task.cancel()
+        finally:
+            if not primary.done():
+                primary.cancel()
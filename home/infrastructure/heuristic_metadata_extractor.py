@@ -0,0 +1,184 @@
+import re
+from dataclasses import replace
+from datetime import datetime
+from typing import Optional
+
+import yaml
+from dateutil import parser as date_parser
+
+from document_bot.analytics import emit
+from home.domain.file_metadata import FileMetadata
+from home.domain.stored_file import StoredFile
+from home.infrastructure.base_file_metadata_extractor import BaseFileMetadataExtractor
+from home.infrastructure.text_sample import read_text_head, decode_head
+
+HEADER_CHARS = 4000
+
+# Fields that must be found for the header's values to be trusted over the LLM's
+CORE_FIELDS = ("title", "authors", "language", "published_date")
+# Not every Gutenberg header has a release date, it fills published_date when it is there
+GUTENBERG_CORE_FIELDS = ("title", "authors", "language")
+
+LABEL_FIELDS = {
+    "title": "title",
+    "author": "authors",
+    "authors": "authors",
+    "by": "authors",
+    "editor": "editor",
+    "edited by": "editor",
+    "publisher": "publisher",
+    "published": "published_date",
+    "publication date": "published_date",
+    "date": "published_date",
+    "publication year": "publication_year",
+    "release date": "published_date",
+    "year": "publication_year",
+    "language": "language",
+    "keywords": "keywords",
+    "tags": "keywords",
+    "document type": "document_type",
+    "subject area": "subject_area",
+}
+
+LABELLED_LINE = re.compile(r"^\s*(?:\*\*)?([A-Za-z][A-Za-z ]{0,30}?)\s*:(?:\*\*)?\s*(.+?)\s*$")
+FRONT_MATTER = re.compile(r"\A---\s*\n(.*?)\n---\s*(?:\n|\Z)", re.DOTALL)
+MARKDOWN_HEADING = re.compile(r"^#\s+(.+?)\s*#*\s*$", re.MULTILINE)
+HONORIFICS = re.compile(r"^(?:Dr|Prof|Professor|Mr|Mrs|Ms|Sir)\.?\s+", re.IGNORECASE)
+NAME_SEPARATORS = re.compile(r"\s*(?:,|;|\band\b|&)\s*")
+
+
+class HeuristicMetadataExtractor(BaseFileMetadataExtractor):
+    """
+    Rule-based content metadata for documents with a machine-readable header.
+
+    Project Gutenberg headers, YAML front matter and "Label: value" header lines
+    are parsed deterministically. Only the fields found in the header are set,
+    the descriptive ones like the abstract and keywords are left to the LLM.
+    """
+
+    def extract_metadata(self, file_path: str, max_chars=8000, stored_file: Optional[StoredFile] = None) -> FileMetadata:
+        base_metadata = super().extract_metadata(file_path, stored_file=stored_file)
+        return self.try_extract_metadata(file_path, stored_file, base_metadata) or base_metadata
+
+    def try_extract_metadata(self, file_path: str, stored_file: Optional[StoredFile] = None,
+                             base_metadata: Optional[FileMetadata] = None) -> Optional[FileMetadata]:
+        """Return the metadata found in the header when every core field was, None when the header can't be trusted."""
+        if base_metadata is None:
+            base_metadata = super().extract_metadata(file_path, stored_file=stored_file)
+        if base_metadata.file_size == 0:
+            return None
+
+        if stored_file:
+            header = decode_head(stored_file.head)[:HEADER_CHARS]
+        else:
+            header = read_text_head(file_path, HEADER_CHARS)
+        header = header.lstrip("\ufeff")
+
+        source, fields = self._parse_header(header)
+        required = GUTENBERG_CORE_FIELDS if source == "gutenberg" else CORE_FIELDS
+        missing = [field for field in required if not fields.get(field)]
+
+        emit("metadata_header", {
+            "trusted": not missing,
+            "source": source,
+            "fields": sorted(fields),
+            **({"missing": missing} if missing else {}),
+        })
+
+        if missing:
+            return None
+        return replace(base_metadata, **fields)
+
+    def _parse_header(self, header: str) -> tuple[str, dict]:
+        if "project gutenberg" in header[:500].lower():
+            fields = self._parse_labelled_lines(header)
+            fields["publisher"] = "Project Gutenberg"
+            return "gutenberg", fields
+
+        front_matter = FRONT_MATTER.match(header)
+        if front_matter:
+            try:
+                values = yaml.safe_load(front_matter.group(1))
+            except yaml.YAMLError:
+                values = None
+            if isinstance(values, dict):
+                fields = {}
+                for label, value in values.items():
+                    self._set_field(fields, str(label).replace("_", " "), value)
+                return "front_matter", fields
+
+        fields = self._parse_labelled_lines(header)
+        if "title" not in fields:
+            title = self._find_title(header)
+            if title:
+                fields["title"] = title
+        return "labelled_header", fields
+
+    def _parse_labelled_lines(self, header: str) -> dict:
+        fields = {}
+        for line in header.splitlines():
+            match = LABELLED_LINE.match(line)
+            if match:
+                self._set_field(fields, match.group(1), match.group(2))
+        return fields
+
+    def _find_title(self, header: str) -> Optional[str]:
+        heading = MARKDOWN_HEADING.search(header)
+        if heading:
+            return heading.group(1)
+
+        # A plain first line directly followed by labelled lines is the title of the header block
+        lines = [line.strip() for line in header.splitlines() if line.strip()]
+        if len(lines) >= 2 and not LABELLED_LINE.match(lines[0]) and LABELLED_LINE.match(lines[1]):
+            return lines[0]
+        return None
+
+    def _set_field(self, fields: dict, label: str, value) -> None:
+        field = LABEL_FIELDS.get(label.strip().lower())
+        if not field or field in fields or value is None or value == "":
+            return
+
+        if field == "authors":
+            fields[field] = self._parse_names(value)
+        elif field == "editor":
+            names = self._parse_names(value)
+            if names:
+                fields[field] = names[0]
+        elif field == "keywords":
+            fields[field] = self._parse_list(value)
+        elif field == "published_date":
+            published_date = self._parse_date(value)
+            if published_date:
+                fields[field] = published_date
+                fields.setdefault("publication_year", published_date.year)
+        elif field == "language":
+            # Lowercase like the rest of the pipeline
+            fields[field] = str(value).strip().lower()
+        elif field == "publication_year":
+            match = re.search(r"\b(\d{4})\b", str(value))
+            if match:
+                fields[field] = int(match.group(1))
+        else:
+            fields[field] = str(value).strip()
+
+    def _parse_names(self, value) -> list[str]:
+        names = value if isinstance(value, list) else NAME_SEPARATORS.split(str(value))
+        return [HONORIFICS.sub("", str(name).strip()) for name in names if str(name).strip()]
+
+    def _parse_list(self, value) -> list[str]:
+        items = value if isinstance(value, list) else str(value).split(",")
+        return [str(item).strip() for item in items if str(item).strip()]
+
+    def _parse_date(self, value) -> Optional[datetime]:
+        if isinstance(value, datetime):
+            return value
+        if hasattr(value, "year") and hasattr(value, "month"):
+            return datetime(value.year, value.month, value.day)
+
+        # Drop annotations like "[eBook #84]"
+        text = re.sub(r"\[.*?]|\(.*?\)", "", str(value)).strip()
+        try:
+            parsed = date_parser.parse(text, default=datetime(1, 1, 1))
+        except (ValueError, OverflowError):
+            return None
+        return parsed if parsed.year > 1 else None
@@ -1,76 +1,167 @@
 import json
 import re
+from dataclasses import replace
 from datetime import datetime
-from pathlib import Path
 from typing import Optional
 
 from langfuse import openai
 from openai import OpenAI
 
+from document_bot.analytics import emit, record_cache_lookup
+from home.domain.deadline import remaining_timeout
 from home.domain.file_metadata import FileMetadata
+from home.domain.stored_file import StoredFile
+from home.domain.token_usage import current_session, record_usage, usage_from_openai
 from home.infrastructure.base_file_metadata_extractor import BaseFileMetadataExtractor
+from home.infrastructure.content_hash import hash_file
+from home.infrastructure.file_metadata_cache import FileMetadataCache
+from home.infrastructure.heuristic_metadata_extractor import HeuristicMetadataExtractor
+from home.infrastructure.openai_http_client import get_http_client
+from home.infrastructure.text_sample import read_text_sample, stored_text_sample
+from home.infrastructure.usage_budget import get_usage_budget
+
+
+# Bump whenever the prompt changes so cached extractions from the old prompt are not reused
+PROMPT_VERSION = "v2"
+model = "gpt-4o-mini"
+
+FIELD_DESCRIPTIONS = {
+    "title": '"string - the document title"',
+    "authors": '["array of author names without titles"]',
+    "published_date": '"YYYY-MM-DD or null"',
+    "publication_year": 'integer or null',
+    "editor": '"string or null"',
+    "publisher": '"string or null"',
+    "category": '"string - broad category"',
+    "keywords": '["3-10 strings - main themes and topics"]',
+    "abstract": '"string - brief summary under 300 chars, or null"',
+    "language": '"string - e.g. english"',
+    "document_type": '"string - specific type"',
+    "subject_area": '"string - main field"',
+}
+
+FIELD_GUIDELINES = {
+    "title": '- title: Extract or infer the document title',
+    "authors": '- authors: Full names without "Dr.", "Prof.", etc. For "Mary Wollstonecraft Shelley" use "Mary Shelley"',
+    "published_date": '- published_date/publication_year: Use ORIGINAL publication date for reprints/classics',
+    "category": '- category: Broad type like "Fiction", "Non-fiction", "Academic", "Technical"',
+    "keywords": '- keywords: Identify main themes from content (e.g., for gothic horror: ["gothic", "horror", "science fiction", "monster", "creation", "ethics"])',
+    "abstract": '- abstract: Summarize the main content/plot/purpose',
+    "language": '- language: Lowercase English name of the language, like "english" or "french"',
+    "document_type": '- document_type: Specific type like "Novel", "Research Paper", "Tutorial", "Essay"',
+    "subject_area": '- subject_area: Field like "Literature", "Computer Science", "Environmental Science"',
+}
 
 
 class OpenAIMetadataExtractor(BaseFileMetadataExtractor):
     llm: OpenAI
+    cache: Optional[FileMetadataCache]
+    fast_path: Optional[HeuristicMetadataExtractor]
 
-    def __init__(self, api_key):
+    def __init__(self, api_key, cache: Optional[FileMetadataCache] = None,
+                 fast_path: Optional[HeuristicMetadataExtractor] = None):
         self.llm = openai.OpenAI(
             api_key=api_key,
+            http_client=get_http_client(),
         )
+        self.cache = cache
+        self.fast_path = fast_path
 
-    def _extract_text_from_file(self, file_path):
-        file_path = Path(file_path)
-        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-            return f.read()
-    
-    def _get_text_sample(self, text: str, max_chars: int = 12000) -> str:
-        if len(text) <= max_chars:
-            return text
-        
-        beginning_chars = int(max_chars * 0.6)
-        end_chars = int(max_chars * 0.4)
-        
-        return text[:beginning_chars] + "\n\n[... middle content omitted ...]\n\n" + text[-end_chars:]
-
-    def extract_metadata(self, file_path, max_chars=12000) -> FileMetadata:
-        base_metadata = super().extract_metadata(file_path)
-
-        if Path(file_path).stat().st_size == 0:
+    def extract_metadata(self, file_path, max_chars=12000, stored_file: Optional[StoredFile] = None) -> FileMetadata:
+        base_metadata = super().extract_metadata(file_path, stored_file=stored_file)
+
+        if base_metadata.file_size == 0:
             return base_metadata
 
-        file_content = self._extract_text_from_file(file_path)
-        text_sample = self._get_text_sample(file_content, max_chars)
+        # The fields the header gives are trusted, the LLM is only asked for the others
+        known_metadata = None
+        if self.fast_path:
+            known_metadata = self.fast_path.try_extract_metadata(file_path, stored_file, base_metadata)
+        fields = [field for field in FIELD_DESCRIPTIONS
+                  if known_metadata is None or not getattr(known_metadata, field)]
+        if self.fast_path:
+            # What the fast path saves is the fields the LLM is no longer asked for, rarely the whole call
+            emit("metadata_fast_path", {
+                "header_fields": len(FIELD_DESCRIPTIONS) - len(fields),
+                "llm_fields": len(fields),
+                "llm_skipped": not fields,
+            })
+        if not fields:
+            return known_metadata
+
+        # The header parse is deterministic, so a document always asks for the same fields
+        prompt_version = f"{PROMPT_VERSION}-{max_chars}" + ("" if known_metadata is None else "-partial")
+        if self.cache:
+            if not base_metadata.content_hash:
+                base_metadata = replace(base_metadata, content_hash=hash_file(file_path))
+
+            cached_json = self.cache.get(base_metadata.content_hash, prompt_version, model)
+            record_cache_lookup("file_metadata", hit=cached_json is not None, meta={
+                "model": model,
+                "prompt_version": prompt_version,
+            })
+            if cached_json is not None:
+                return self._merge(self._json_to_file_metadata(base_metadata, cached_json), known_metadata)
+
+        if stored_file:
+            text_sample = stored_text_sample(stored_file, max_chars)
+        else:
+            text_sample = read_text_sample(file_path, max_chars)
+
+        prompt = self._prompt(fields, text_sample, known_metadata)
+
+        get_usage_budget().check_tokens(current_session(), "metadata_extraction")
+        # Runs alongside the embedding of the upload, within the upload's deadline
+        timeout = remaining_timeout("metadata_extraction")
+        response = self.llm.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": "You are a precise metadata extraction system. Analyze documents and extract accurate metadata. Focus on identifying the true nature and themes of the content. Return only valid JSON."},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0,
+            **({"timeout": timeout} if timeout is not None else {})
+        )
+        usage = usage_from_openai(response.usage)
+        if usage:
+            record_usage("metadata_extraction", model, usage)
+
+        response_text = response.choices[0].message.content
+
+        json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
+        if json_match:
+            metadata_json = json.loads(json_match.group())
+        else:
+            metadata_json = json.loads(response_text)
+
+        if self.cache:
+            self.cache.set(base_metadata.content_hash, prompt_version, model, metadata_json)
+
+        return self._merge(self._json_to_file_metadata(base_metadata, metadata_json), known_metadata)
 
-        prompt = f"""Extract metadata from this document. Analyze the content carefully to identify key themes and information.
+    def _prompt(self, fields: list[str], text_sample: str, known_metadata: Optional[FileMetadata]) -> str:
+        schema = ",\n".join(f'  "{field}": {FIELD_DESCRIPTIONS[field]}' for field in fields)
+        guidelines = "\n".join(guideline for field, guideline in FIELD_GUIDELINES.items()
+                               if field in fields or (field == "published_date" and "publication_year" in fields))
+        known = ""
+        if known_metadata:
+            known = "\nAlready known about the document:\n" + "\n".join(
+                f"- {field}: {', '.join(value) if isinstance(value, list) else value}"
+                for field in FIELD_DESCRIPTIONS
+                if field not in fields and (value := getattr(known_metadata, field))
+            ) + "\n"
+
+        return f"""Extract metadata from this document. Analyze the content carefully to identify key themes and information.
 
 Return ONLY a valid JSON object with these exact fields:
 
 {{
-  "title": "string - the document title",
-  "authors": ["array of author names without titles"],
-  "published_date": "YYYY-MM-DD or null",
-  "publication_year": integer or null,
-  "editor": "string or null",
-  "publisher": "string or null",
-  "category": "string - broad category",
-  "keywords": ["3-10 strings - main themes and topics"],
-  "abstract": "string - brief summary under 300 chars, or null",
-  "language": "string - e.g. English",
-  "document_type": "string - specific type",
-  "subject_area": "string - main field"
+{schema}
 }}
 
 Field Guidelines:
-- title: Extract or infer the document title
-- authors: Full names without "Dr.", "Prof.", etc. For "Mary Wollstonecraft Shelley" use "Mary Shelley"
-- published_date/publication_year: Use ORIGINAL publication date for reprints/classics
-- category: Broad type like "Fiction", "Non-fiction", "Academic", "Technical"
-- keywords: Identify main themes from content (e.g., for gothic horror: ["gothic", "horror", "science fiction", "monster", "creation", "ethics"])
-- abstract: Summarize the main content/plot/purpose
-- document_type: Specific type like "Novel", "Research Paper", "Tutorial", "Essay"
-- subject_area: Field like "Literature", "Computer Science", "Environmental Science"
-
+{guidelines}
+{known}
 Examples:
 - Classic novel: category="Fiction", document_type="Novel", subject_area="Literature"
 - Research paper: category="Academic", document_type="Research Paper", subject_area="Computer Science"
@@ -81,28 +172,11 @@ Document:
 
 JSON only:"""
 
-        response = self.llm.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a precise metadata extraction system. Analyze documents and extract accurate metadata. Focus on identifying the true nature and themes of the content. Return only valid JSON."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0
-        )
-
-        response_text = response.choices[0].message.content
-
-        json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-        if json_match:
-            return self._json_to_file_metadata(
-                base_metadata,
-                json.loads(json_match.group()),
-            )
-        else:
-            return self._json_to_file_metadata(
-                base_metadata,
-                json.loads(response_text),
-            )
+    def _merge(self, metadata: FileMetadata, known_metadata: Optional[FileMetadata]) -> FileMetadata:
+        if known_metadata is None:
+            return metadata
+        return replace(metadata, **{field: getattr(known_metadata, field) for field in FIELD_DESCRIPTIONS
+                                    if getattr(known_metadata, field)})
 
     def _parse_datetime(self, value: str | datetime | None) -> Optional[datetime]:
         if value is None:
@@ -127,6 +201,7 @@ JSON only:"""
             created_time=base_metadata.created_time,
             modified_time=base_metadata.modified_time,
             upload_time=base_metadata.upload_time,
+            content_hash=base_metadata.content_hash,
             title=json_data.get('title'),
             authors=json_data.get('authors'),
             published_date=self._parse_datetime(json_data.get('published_date')),
@@ -136,7 +211,7 @@ JSON only:"""
             category=json_data.get('category'),
             keywords=json_data.get('keywords'),
             abstract=json_data.get('abstract'),
-            language=json_data.get('language'),
+            language=(json_data.get('language') or '').lower() or None,
             document_type=json_data.get('document_type'),
             subject_area=json_data.get('subject_area'),
         )
@@ -0,0 +1,189 @@
+import asyncio
+import importlib.util
+import os
+import threading
+import weakref
+from typing import AsyncIterator, Callable, Iterator, Optional
+
+import httpx
+
+from document_bot.analytics import error, track_http_pool
+
+
+def http_timeout() -> httpx.Timeout:
+    """Timeouts of OpenAI requests, also given to LangChain clients, which don't take them from the HTTP client."""
+    return httpx.Timeout(
+        float(os.getenv("OPENAI_HTTP_TIMEOUT_SECONDS", "60")),
+        connect=float(os.getenv("OPENAI_HTTP_CONNECT_TIMEOUT_SECONDS", "5")),
+    )
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=int(os.getenv("OPENAI_HTTP_MAX_CONNECTIONS", "100")),
+        max_keepalive_connections=int(os.getenv("OPENAI_HTTP_MAX_KEEPALIVE_CONNECTIONS", "20")),
+        keepalive_expiry=float(os.getenv("OPENAI_HTTP_KEEPALIVE_EXPIRY_SECONDS", "30")),
+    )
+
+
+def _http2() -> bool:
+    if os.getenv("OPENAI_HTTP2", "False") != "True":
+        return False
+    # HTTP/2 needs the optional h2 package (httpx[http2])
+    if importlib.util.find_spec("h2") is None:
+        error("openai_http_client", {"message": "OPENAI_HTTP2 is set but h2 is not installed, using HTTP/1.1"})
+        return False
+    return True
+
+
+class _ResponseStream(httpx.SyncByteStream, httpx.AsyncByteStream):
+    """A response body that calls on_close once, when the response is closed."""
+
+    def __init__(self, stream, on_close: Callable[[], None]):
+        self.stream = stream
+        self.on_close = on_close
+        self.closed = False
+
+    def __iter__(self) -> Iterator[bytes]:
+        yield from self.stream
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self.stream:
+            yield chunk
+
+    def close(self) -> None:
+        try:
+            self.stream.close()
+        finally:
+            self._closed()
+
+    async def aclose(self) -> None:
+        try:
+            await self.stream.aclose()
+        finally:
+            self._closed()
+
+    def _closed(self) -> None:
+        if not self.closed:
+            self.closed = True
+            self.on_close()
+
+
+class _CountedTransport:
+    """Count the requests in flight, from sending one until its response is closed."""
+
+    def __init__(self):
+        self.active = 0
+        self.active_lock = threading.Lock()
+
+    def _add_active(self, n: int) -> None:
+        with self.active_lock:
+            self.active += n
+
+    def _counted(self, response: httpx.Response) -> httpx.Response:
+        return httpx.Response(
+            response.status_code,
+            headers=response.headers,
+            stream=_ResponseStream(response.stream, lambda: self._add_active(-1)),
+            extensions=response.extensions,
+        )
+
+
+class _PooledTransport(_CountedTransport, httpx.BaseTransport):
+    def __init__(self, transport: httpx.BaseTransport):
+        super().__init__()
+        self.transport = transport
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        self._add_active(1)
+        try:
+            return self._counted(self.transport.handle_request(request))
+        except BaseException:
+            self._add_active(-1)
+            raise
+
+    def close(self) -> None:
+        self.transport.close()
+
+    def stats(self) -> dict:
+        return {"active": self.active, "pools": 1}
+
+
+class _LoopLocalTransport(_CountedTransport, httpx.AsyncBaseTransport):
+    """
+    A connection pool per event loop, created by new_transport on the loop's first request.
+
+    Asyncio connections can't be used from another loop than the one that opened them, and
+    under WSGI each async view runs in its own loop. A loop's pool is dropped with the loop.
+    """
+
+    def __init__(self, new_transport: Callable[[], httpx.AsyncBaseTransport]):
+        super().__init__()
+        self.new_transport = new_transport
+        self.transports: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        self.lock = threading.Lock()
+
+    def transport(self) -> httpx.AsyncBaseTransport:
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            transport = self.transports.get(loop)
+            if transport is None:
+                transport = self.transports[loop] = self.new_transport()
+            return transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        transport = self.transport()
+        self._add_active(1)
+        try:
+            return self._counted(await transport.handle_async_request(request))
+        except BaseException:
+            self._add_active(-1)
+            raise
+
+    async def aclose(self) -> None:
+        with self.lock:
+            transport = self.transports.pop(asyncio.get_running_loop(), None)
+        if transport is not None:
+            await transport.aclose()
+
+    def stats(self) -> dict:
+        with self.lock:
+            pools = len(self.transports)
+        return {"active": self.active, "pools": pools}
+
+
+_client: Optional[httpx.Client] = None
+_async_client: Optional[httpx.AsyncClient] = None
+_lock = threading.Lock()
+
+
+def get_http_client() -> httpx.Client:
+    """
+    The HTTP client shared by every synchronous OpenAI client in the process.
+
+    Sharing one keep-alive pool lets the chat model, embeddings and moderation calls of
+    a request reuse open TLS connections instead of each client opening its own.
+    """
+    global _client
+    with _lock:
+        if _client is None:
+            transport = _PooledTransport(httpx.HTTPTransport(http2=_http2(), limits=_limits()))
+            _client = httpx.Client(transport=transport, timeout=http_timeout())
+            track_http_pool("openai", transport.stats)
+        return _client
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """
+    Like get_http_client, for the asynchronous OpenAI clients.
+
+    The client is shared, its connections are kept in a pool per event loop.
+    """
+    global _async_client
+    with _lock:
+        if _async_client is None:
+            http2, limits = _http2(), _limits()
+            transport = _LoopLocalTransport(lambda: httpx.AsyncHTTPTransport(http2=http2, limits=limits))
+            _async_client = httpx.AsyncClient(transport=transport, timeout=http_timeout())
+            track_http_pool("openai_async", transport.stats)
+        return _async_client
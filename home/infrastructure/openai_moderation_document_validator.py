@@ -0,0 +1,150 @@
+import contextvars
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from langchain_core.documents import Document
+from openai import OpenAI
+
+from document_bot.analytics import record_document_validation_event, record_cache_lookup
+from home.domain.deadline import remaining_timeout
+from home.domain.document_validator import DocumentValidator
+from home.domain.invalid_document_error import InvalidDocumentError
+from home.infrastructure.circuit_breaker import CircuitBreaker
+from home.infrastructure.content_hash import new_content_hasher
+from home.infrastructure.openai_http_client import get_http_client
+
+# Categories that reject a document however few of its chunks are flagged
+ZERO_TOLERANCE_CATEGORIES = ("sexual_minors", "self_harm_instructions", "illicit_violent")
+
+
+class OpenAIModerationDocumentValidator(DocumentValidator):
+    """
+    Screen uploaded chunks with the moderation endpoint before they are embedded.
+
+    Chunks are packed into input arrays of batch_size, at most max_concurrency requests
+    are in flight, and results are cached per chunk hash so known content is not re-sent.
+
+    Literature is full of violence, so a document is only rejected when a chunk is flagged
+    in a zero tolerance category, or when more than max_flagged_share of its chunks are flagged.
+    """
+
+    def __init__(self, api_key: str, model: str = "omni-moderation-latest", batch_size: int = None,
+                 max_concurrency: int = None, cache_size: int = None, max_flagged_share: float = None,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.client = OpenAI(api_key=api_key, http_client=get_http_client())
+        self.model = model
+        self.batch_size = batch_size or int(os.getenv("MODERATION_BATCH_SIZE", "32"))
+        self.max_concurrency = max_concurrency or int(os.getenv("MODERATION_MAX_CONCURRENCY", "4"))
+        self.cache_size = cache_size or int(os.getenv("MODERATION_CACHE_SIZE", "50000"))
+        self.max_flagged_share = max_flagged_share or float(os.getenv("MODERATION_MAX_FLAGGED_SHARE", "0.25"))
+        # Shared with the question moderation, it is the same endpoint
+        self.breaker = breaker or CircuitBreaker("moderation")
+        # chunk hash -> flagged categories, empty when the chunk passed
+        self._cache: OrderedDict[str, list[str]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def validate_documents(self, documents: list[Document], user_id: Optional[str] = None) -> None:
+        t0 = time.perf_counter()
+
+        chunk_hashes = [self._hash(doc.page_content) for doc in documents]
+        results = self._cached_results(chunk_hashes)
+
+        pending = {}
+        for chunk_hash, doc in zip(chunk_hashes, documents):
+            if chunk_hash not in results:
+                pending.setdefault(chunk_hash, doc.page_content)
+
+        cache_hits = len(documents) - sum(1 for chunk_hash in chunk_hashes if chunk_hash in pending)
+        if cache_hits:
+            record_cache_lookup("document_moderation", hit=True, count=cache_hits)
+        if pending:
+            record_cache_lookup("document_moderation", hit=False, count=len(documents) - cache_hits)
+
+        pending_hashes = list(pending)
+        batches = [pending_hashes[i:i + self.batch_size] for i in range(0, len(pending_hashes), self.batch_size)]
+        if batches:
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches))) as executor:
+                futures = [
+                    executor.submit(contextvars.copy_context().run, self._moderate, [pending[h] for h in batch])
+                    for batch in batches
+                ]
+                for batch, future in zip(batches, futures):
+                    results.update(zip(batch, future.result()))
+            self._store(results)
+
+        flagged_chunks = [i for i, chunk_hash in enumerate(chunk_hashes) if results[chunk_hash]]
+        duration_ms = (time.perf_counter() - t0) * 1000.0
+        meta = {
+            "model": self.model,
+            "num_requests": len(batches),
+            "cache_hits": cache_hits,
+        }
+
+        categories = sorted({cat for i in flagged_chunks for cat in results[chunk_hashes[i]]})
+        flagged_share = len(flagged_chunks) / len(documents) if documents else 0.0
+        if flagged_chunks:
+            meta.update({
+                "flagged_categories": categories,
+                "flagged_chunks": flagged_chunks[:20],
+                "flagged_share": round(flagged_share, 3),
+            })
+
+        zero_tolerance = [cat for cat in categories if cat in ZERO_TOLERANCE_CATEGORIES]
+        if zero_tolerance or flagged_share > self.max_flagged_share:
+            reason = f"Document contains inappropriate content: {', '.join(zero_tolerance or categories)}"
+            record_document_validation_event(
+                validator_name="openai_document_moderation",
+                passed=False,
+                duration_ms=duration_ms,
+                num_chunks=len(documents),
+                reason=reason,
+                user_id=user_id,
+                meta=meta,
+            )
+            raise InvalidDocumentError(reason)
+
+        record_document_validation_event(
+            validator_name="openai_document_moderation",
+            passed=True,
+            duration_ms=duration_ms,
+            num_chunks=len(documents),
+            user_id=user_id,
+            meta=meta,
+        )
+
+    def _moderate(self, texts: list[str]) -> list[list[str]]:
+        # Without a request deadline the client's default timeout applies
+        timeout = remaining_timeout("document_moderation")
+        response = self.breaker.call(lambda: self.client.moderations.create(
+            model=self.model,
+            input=texts,
+            **({"timeout": timeout} if timeout is not None else {})
+        ))
+        return [
+            [cat for cat, flagged in result.categories.model_dump().items() if flagged] if result.flagged else []
+            for result in response.results
+        ]
+
+    def _hash(self, text: str) -> str:
+        hasher = new_content_hasher()
+        hasher.update(text.encode('utf-8'))
+        return hasher.hexdigest()
+
+    def _cached_results(self, chunk_hashes: list[str]) -> dict[str, list[str]]:
+        with self._lock:
+            results = {}
+            for chunk_hash in chunk_hashes:
+                if chunk_hash in self._cache:
+                    self._cache.move_to_end(chunk_hash)
+                    results[chunk_hash] = self._cache[chunk_hash]
+            return results
+
+    def _store(self, results: dict[str, list[str]]) -> None:
+        with self._lock:
+            self._cache.update(results)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
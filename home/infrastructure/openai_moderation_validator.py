@@ -1,29 +1,85 @@
+import asyncio
+import os
 import time
 from typing import Optional
 
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 
 from document_bot.analytics import record_validation_event
+from home.domain.deadline import remaining_timeout
 from home.domain.invalid_question_error import InvalidQuestionError
 from home.domain.question_validator import QuestionValidator
+from home.infrastructure.circuit_breaker import CircuitBreaker
+from home.infrastructure.openai_http_client import get_async_http_client, get_http_client
 
 
 class OpenAIModerationValidator(QuestionValidator):
-    def __init__(self, api_key: str, model: str = "omni-moderation-latest"):
-        self.client = OpenAI(api_key=api_key)
+    def __init__(self, api_key: str, model: str = "omni-moderation-latest", batch_size: int = None):
+        self.client = OpenAI(api_key=api_key, http_client=get_http_client())
+        self.async_client = AsyncOpenAI(api_key=api_key, http_client=get_async_http_client())
         self.model = model
+        self.batch_size = batch_size or int(os.getenv("MODERATION_BATCH_SIZE", "32"))
+        # While open, questions fail fast instead of going unmoderated
+        self.breaker = CircuitBreaker("moderation")
 
     def validate(self, question: str, user_id: Optional[str] = None) -> None:
         t0 = time.perf_counter()
 
-        response = self.client.moderations.create(
+        timeout_kwargs = self._timeout_kwargs()
+        response = self.breaker.call(lambda: self.client.moderations.create(
             model=self.model,
-            input=question
-        )
+            input=question,
+            **timeout_kwargs
+        ))
+
+        self._check_result(question, response.results[0], (time.perf_counter() - t0) * 1000.0, user_id)
+
+    async def avalidate(self, question: str, user_id: Optional[str] = None) -> None:
+        t0 = time.perf_counter()
+
+        timeout_kwargs = self._timeout_kwargs()
+        response = await self.breaker.acall(lambda: self.async_client.moderations.create(
+            model=self.model,
+            input=question,
+            **timeout_kwargs
+        ))
+
+        self._check_result(question, response.results[0], (time.perf_counter() - t0) * 1000.0, user_id)
+
+    async def avalidate_batch(self, questions: list[str],
+                              user_id: Optional[str] = None) -> list[Optional[InvalidQuestionError]]:
+        """Moderate the questions in batch_size inputs per request, the requests running concurrently."""
+        batches = [questions[i:i + self.batch_size] for i in range(0, len(questions), self.batch_size)]
+        results = await asyncio.gather(*(self._amoderate_batch(batch, user_id) for batch in batches))
+        return [failure for batch_results in results for failure in batch_results]
+
+    async def _amoderate_batch(self, questions: list[str],
+                               user_id: Optional[str]) -> list[Optional[InvalidQuestionError]]:
+        t0 = time.perf_counter()
+
+        timeout_kwargs = self._timeout_kwargs()
+        response = await self.breaker.acall(lambda: self.async_client.moderations.create(
+            model=self.model,
+            input=questions,
+            **timeout_kwargs
+        ))
 
-        result = response.results[0]
         duration_ms = (time.perf_counter() - t0) * 1000.0
+        failures = []
+        for question, result in zip(questions, response.results):
+            try:
+                self._check_result(question, result, duration_ms, user_id)
+                failures.append(None)
+            except InvalidQuestionError as e:
+                failures.append(e)
+        return failures
+
+    def _timeout_kwargs(self) -> dict:
+        # Without a request deadline the client's default timeout applies
+        timeout = remaining_timeout("moderation")
+        return {"timeout": timeout} if timeout is not None else {}
 
+    def _check_result(self, question: str, result, duration_ms: float, user_id: Optional[str]) -> None:
         if result.flagged:
             categories = [cat for cat, flagged in result.categories.model_dump().items() if flagged]
             reason = f"Question contains inappropriate content: {', '.join(categories)}"
@@ -57,4 +113,4 @@ class OpenAIModerationValidator(QuestionValidator):
                 duration_ms=duration_ms,
                 user_id=user_id,
                 meta={"model": self.model}
-            )
\ No newline at end of file
+            )
@@ -1,3 +1,6 @@
+import asyncio
+import multiprocessing
+import uuid
 from typing import List
 
 from langchain.schema import Document
@@ -6,15 +9,32 @@ from langchain_community.document_loaders import TextLoader
 from langchain_openai import OpenAIEmbeddings
 from langchain_pinecone import PineconeVectorStore
 from pinecone import Pinecone, ServerlessSpec
+from urllib3.exceptions import MaxRetryError, TimeoutError as Urllib3TimeoutError
 
+from home.domain.deadline import remaining_timeout
+from home.domain.deadline_exceeded_error import DeadlineExceededError
 from home.domain.document_repository import DocumentRepository
 from home.domain.file_metadata import FileMetadata
+from home.domain.token_usage import TokenUsage, current_session, record_usage
+from home.infrastructure.admission_controller import get_admission_controller
+from home.infrastructure.circuit_breaker import CircuitBreaker
+from home.infrastructure.context_packer import token_counter
+from home.infrastructure.hedged_caller import HedgedCaller, HedgingPolicy
+from home.infrastructure.openai_http_client import get_async_http_client, get_http_client, http_timeout
+from home.infrastructure.usage_budget import get_usage_budget
+
+# Metadata key of the chunk text, as written by PineconeVectorStore
+TEXT_KEY = "text"
+EMBEDDING_MODEL = "text-embedding-3-small"
+# Vectors per upsert request, Pinecone caps a request at 2MB
+UPSERT_BATCH_SIZE = 100
 
 
 class PineconeDocumentRepository(DocumentRepository):
 
     def __init__(self, api_key: str, index_name: str, openai_api_key: str = None):
         self.index_name = index_name
+        self.corpus_version = 0
         self.pc = Pinecone(api_key=api_key)
         self.dimension = 1536
 
@@ -24,7 +44,17 @@ class PineconeDocumentRepository(DocumentRepository):
             self._create_index()
             self.index = self.pc.Index(index_name)
 
-        self.embeddings = OpenAIEmbeddings(model="text-embedding-3-small", api_key=openai_api_key)
+        # Retries are left to the hedged caller, which budgets them, instead of the client
+        self.embeddings = OpenAIEmbeddings(model=EMBEDDING_MODEL, api_key=openai_api_key, max_retries=0,
+                                           http_client=get_http_client(), http_async_client=get_async_http_client(),
+                                           timeout=http_timeout())
+        self.embedding_caller = HedgedCaller("embedding", HedgingPolicy(initial_delay_ms=500.0, max_delay_ms=5000.0))
+        # Batches take longer than single queries, they aren't hedged and don't skew the single query percentiles
+        self.batch_embedding_caller = HedgedCaller("embedding_batch")
+        self.embeddings_breaker = CircuitBreaker("embeddings")
+        self.embedding_admission = get_admission_controller("embedding")
+        self.usage_budget = get_usage_budget()
+        self.vector_store_breaker = CircuitBreaker("vector_store")
         self.vector_store = PineconeVectorStore(
             index_name=index_name,
             embedding=self.embeddings
@@ -56,9 +86,7 @@ class PineconeDocumentRepository(DocumentRepository):
 
         return loader.load()
 
-    def upload_document(self, file_path: str, file_metadata: FileMetadata) -> List[Document]:
-        documents = self.load_document(file_path)
-
+    def _to_metadata_dict(self, file_metadata: FileMetadata) -> dict:
         metadata_dict = {
             'file_name': file_metadata.file_name,
             'file_path': file_metadata.file_path,
@@ -69,6 +97,8 @@ class PineconeDocumentRepository(DocumentRepository):
             'upload_time': file_metadata.upload_time.isoformat(),
         }
 
+        if file_metadata.content_hash:
+            metadata_dict['content_hash'] = file_metadata.content_hash
         if file_metadata.title:
             metadata_dict['title'] = file_metadata.title
         if file_metadata.authors:
@@ -94,6 +124,12 @@ class PineconeDocumentRepository(DocumentRepository):
         if file_metadata.subject_area:
             metadata_dict['subject_area'] = file_metadata.subject_area
 
+        return metadata_dict
+
+    def split_document(self, file_path: str, file_metadata: FileMetadata) -> List[Document]:
+        documents = self.load_document(file_path)
+
+        metadata_dict = self._to_metadata_dict(file_metadata)
         for doc in documents:
             doc.metadata.update(metadata_dict)
 
@@ -104,18 +140,147 @@ class PineconeDocumentRepository(DocumentRepository):
         )
         chunks = text_splitter.split_documents(documents)
 
+        document_id = file_metadata.content_hash or str(uuid.uuid4())
         for i, chunk in enumerate(chunks):
+            chunk.id = f"{document_id}#{i}"
             chunk.metadata['chunk_index'] = i
             chunk.metadata['total_chunks'] = len(chunks)
             chunk.metadata['chunk_text'] = chunk.page_content[:500]
 
-        PineconeVectorStore.from_documents(
-            documents=chunks,
-            embedding=self.embeddings,
-            index_name=self.index_name
-        )
-
         return chunks
 
+    def add_documents(self, documents: List[Document]) -> List[Document]:
+        return self.add_embedded_documents(documents, self.embed_documents(documents))
+
+    def embed_documents(self, documents: List[Document]) -> list[list[float]]:
+        texts = [doc.page_content for doc in documents]
+        num_tokens = self._check_embedding_budget("document_embedding", texts)
+        # Shares the embedding endpoint's admission and breaker with the queries, an upload can't flood it
+        with self.embedding_admission.admit():
+            embeddings = self.embeddings_breaker.call(lambda: self.batch_embedding_caller.call(
+                lambda: self.embeddings.embed_documents(texts, **self._timeout_kwargs("document_embedding"))
+            ))
+        self._record_embedding_usage("document_embedding", num_tokens)
+        return embeddings
+
+    def add_embedded_documents(self, documents: List[Document], embeddings: list[list[float]]) -> List[Document]:
+        vectors = [
+            (doc.id, embedding, {**doc.metadata, TEXT_KEY: doc.page_content})
+            for doc, embedding in zip(documents, embeddings)
+        ]
+        timeout = remaining_timeout("vector_upsert")
+        try:
+            async_results = [
+                self.index.upsert(vectors=vectors[i:i + UPSERT_BATCH_SIZE], async_req=True,
+                                  **({"_request_timeout": timeout} if timeout is not None else {}))
+                for i in range(0, len(vectors), UPSERT_BATCH_SIZE)
+            ]
+            # Without a timeout a hung upsert would hold the upload past its deadline
+            [result.get(timeout=remaining_timeout("vector_upsert")) for result in async_results]
+        except Exception as e:
+            # Don't leave part of a document searchable, the ids are deterministic so a retry upserts it again.
+            # Pinecone caps a delete at 1000 ids, so the ids are deleted in the upserts' batches.
+            ids = [doc.id for doc in documents]
+            for i in range(0, len(ids), UPSERT_BATCH_SIZE):
+                self.index.delete(ids=ids[i:i + UPSERT_BATCH_SIZE])
+            if isinstance(e, multiprocessing.TimeoutError):
+                raise DeadlineExceededError("vector_upsert") from e
+            raise
+        self.corpus_version += 1
+
+        return documents
+
+    def get_corpus_version(self) -> int:
+        return self.corpus_version
+
+    def update_document_metadata(self, documents: List[Document], file_metadata: FileMetadata) -> List[Document]:
+        metadata_dict = self._to_metadata_dict(file_metadata)
+        for doc in documents:
+            doc.metadata.update(metadata_dict)
+
+        return documents
+
     def similarity_search(self, query: str, k: int = 4) -> list[Document]:
-        return self.vector_store.similarity_search(query, k)
+        return self.vector_store_breaker.call(lambda: self.vector_store.similarity_search(query, k))
+
+    def embed_query(self, query: str) -> list[float]:
+        num_tokens = self._check_embedding_budget("query_embedding", [query])
+        with self.embedding_admission.admit():
+            # The request timeout ends a hedged call's thread at the deadline instead of leaving it running
+            embedding = self.embeddings_breaker.call(lambda: self.embedding_caller.call(
+                lambda: self.embeddings.embed_query(query, **self._timeout_kwargs("query_embedding"))
+            ))
+        self._record_embedding_usage("query_embedding", num_tokens)
+        return embedding
+
+    def similarity_search_by_vector(self, embedding: list[float], k: int = 4) -> list[Document]:
+        # Queried directly as the vector store doesn't pass a request timeout through to the index
+        timeout = remaining_timeout("vector_search")
+        results = self.vector_store_breaker.call(lambda: self._query(embedding, k, timeout))
+        return self._with_scores([
+            (Document(id=match["id"], page_content=match["metadata"].pop(TEXT_KEY), metadata=match["metadata"]),
+             match["score"])
+            for match in results["matches"]
+            if TEXT_KEY in match["metadata"]
+        ])
+
+    def _query(self, embedding: list[float], k: int, timeout: float = None) -> dict:
+        try:
+            return self.index.query(
+                vector=embedding,
+                top_k=k,
+                include_metadata=True,
+                **({"_request_timeout": timeout} if timeout is not None else {}),
+            )
+        except (MaxRetryError, Urllib3TimeoutError) as e:
+            timed_out = isinstance(e, Urllib3TimeoutError) or isinstance(e.reason, Urllib3TimeoutError)
+            # The request timeout is what was left of the deadline, so the request's time ran out
+            if timed_out and timeout is not None:
+                raise DeadlineExceededError("vector_search") from e
+            raise
+
+    async def aembed_query(self, query: str) -> list[float]:
+        num_tokens = self._check_embedding_budget("query_embedding", [query])
+        async with self.embedding_admission.aadmit():
+            embedding = await self.embeddings_breaker.acall(
+                lambda: self.embedding_caller.acall(lambda: self.embeddings.aembed_query(query))
+            )
+        self._record_embedding_usage("query_embedding", num_tokens)
+        return embedding
+
+    async def aembed_queries(self, queries: list[str]) -> list[list[float]]:
+        # A query is embedded like a document, so a batch of queries is a single embeddings request
+        num_tokens = self._check_embedding_budget("query_embedding", queries)
+        async with self.embedding_admission.aadmit():
+            embeddings = await self.embeddings_breaker.acall(
+                lambda: self.batch_embedding_caller.acall(lambda: self.embeddings.aembed_documents(queries))
+            )
+        self._record_embedding_usage("query_embedding", num_tokens)
+        return embeddings
+
+    async def asimilarity_search_by_vector(self, embedding: list[float], k: int = 4) -> list[Document]:
+        # PineconeVectorStore's async search closes its cached index's aiohttp session after each query,
+        # failing every later one, so the sync client and its connection pool are used from a thread
+        return await asyncio.to_thread(self.similarity_search_by_vector, embedding, k)
+
+    def _check_embedding_budget(self, stage: str, texts: list[str]) -> int:
+        """The tokens of the texts, raising QuotaExceededError when they are over the session's budget."""
+        # OpenAIEmbeddings drops the response's usage, but embeddings are billed by exactly the input's tokens
+        count_tokens = token_counter(EMBEDDING_MODEL)
+        num_tokens = sum(count_tokens(text) for text in texts)
+        self.usage_budget.check_tokens(current_session(), stage, num_tokens)
+        return num_tokens
+
+    def _timeout_kwargs(self, stage: str) -> dict:
+        # Without a request deadline the client's default timeout applies
+        timeout = remaining_timeout(stage)
+        return {"timeout": timeout} if timeout is not None else {}
+
+    def _record_embedding_usage(self, stage: str, num_tokens: int) -> None:
+        record_usage(stage, EMBEDDING_MODEL, TokenUsage(prompt=num_tokens))
+
+    def _with_scores(self, results: list[tuple[Document, float]]) -> list[Document]:
+        # Pinecone returns the scores anyway, keeping them lets the model router see how clear-cut retrieval was
+        for doc, score in results:
+            doc.metadata["score"] = score
+        return [doc for doc, _ in results]
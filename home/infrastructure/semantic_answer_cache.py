@@ -0,0 +1,99 @@
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+from home.domain.quoted_answer import QuotedAnswer
+
+
+@dataclass(frozen=True)
+class SemanticCacheHit:
+    answer: QuotedAnswer
+    question: str
+    similarity: float
+    generation_ms: float
+
+
+@dataclass(frozen=True)
+class _Entry:
+    embedding: np.ndarray
+    question: str
+    answer: QuotedAnswer
+    generation_ms: float
+    stored_at: float
+
+
+class SemanticAnswerCache:
+    """
+    In-memory answers keyed by the retrieved sources, matched by question embedding.
+
+    Answers are only shared between questions that retrieved exactly the same
+    sources, and whose embeddings have a cosine similarity of at least threshold.
+    """
+
+    def __init__(self, threshold: float = None, max_size: int = None, ttl_seconds: int = None,
+                 max_questions_per_sources: int = 8, audit_rate: float = None):
+        self.threshold = threshold or float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+        self.max_size = max_size or int(os.getenv("SEMANTIC_CACHE_SIZE", "1000"))
+        self.ttl_seconds = ttl_seconds or int(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", "86400"))
+        self.max_questions_per_sources = max_questions_per_sources
+        self.audit_rate = audit_rate if audit_rate is not None else float(os.getenv("SEMANTIC_CACHE_AUDIT_RATE", "0.05"))
+        self._entries: OrderedDict[str, list[_Entry]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, sources_key: str, embedding: list[float]) -> Optional[SemanticCacheHit]:
+        query = self._normalize(embedding)
+
+        with self._lock:
+            now = time.time()
+            entries = [entry for entry in self._entries.get(sources_key, [])
+                       if now - entry.stored_at <= self.ttl_seconds]
+            if not entries:
+                self._entries.pop(sources_key, None)
+                return None
+
+            self._entries[sources_key] = entries
+            self._entries.move_to_end(sources_key)
+
+        similarities = np.stack([entry.embedding for entry in entries]) @ query
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.threshold:
+            return None
+
+        entry = entries[best]
+        return SemanticCacheHit(
+            answer=entry.answer,
+            question=entry.question,
+            similarity=float(similarities[best]),
+            generation_ms=entry.generation_ms,
+        )
+
+    def set(self, sources_key: str, embedding: list[float], question: str, answer: QuotedAnswer,
+            generation_ms: float) -> None:
+        entry = _Entry(
+            embedding=self._normalize(embedding),
+            question=question,
+            answer=answer,
+            generation_ms=generation_ms,
+            stored_at=time.time(),
+        )
+
+        with self._lock:
+            entries = self._entries.get(sources_key, []) + [entry]
+            self._entries[sources_key] = entries[-self.max_questions_per_sources:]
+            self._entries.move_to_end(sources_key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def should_audit(self) -> bool:
+        return random.random() < self.audit_rate
+
+    def _normalize(self, embedding: list[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
@@ -0,0 +1,88 @@
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.ok = False
+
+
+class SingleFlight:
+    """
+    Run a function at most once at a time per key.
+
+    Callers arriving while the function runs for their key wait for it and share
+    its result instead of running it again. Only results are shared: when the
+    running call fails, each waiting caller runs its own function instead, as the
+    failure may belong to the caller that ran it, like its budget or its deadline.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Return the result and whether it was shared with an already running call."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if not call.ok:
+                return fn(), False
+            return call.result, True
+
+        try:
+            call.result = fn()
+            call.ok = True
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result, False
+
+
+class AsyncSingleFlight:
+    """
+    SingleFlight for coroutines, sharing in-flight calls between tasks of the same event loop.
+
+    When the running call fails or is cancelled, as when its client went away, each waiting task runs its own.
+    """
+
+    def __init__(self):
+        # Each future resolves to whether the call succeeded and its result
+        self._calls: Dict[Tuple[int, str], asyncio.Future] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Return the result and whether it was shared with an already running call."""
+        # Futures belong to one event loop, so calls are only shared within a loop
+        call_key = (id(asyncio.get_running_loop()), key)
+        future = self._calls.get(call_key)
+        if future is not None:
+            # A waiter being cancelled must not cancel the shared call
+            ok, result = await asyncio.shield(future)
+            if not ok:
+                return await fn(), False
+            return result, True
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[call_key] = future
+        ok, result = False, None
+        try:
+            result = await fn()
+            ok = True
+        finally:
+            del self._calls[call_key]
+            future.set_result((ok, result))
+
+        return result, False
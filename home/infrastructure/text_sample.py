@@ -0,0 +1,84 @@
+import codecs
+import os
+
+from home.domain.stored_file import StoredFile
+
+MIDDLE_OMITTED = "\n\n[... middle content omitted ...]\n\n"
+HEAD_RATIO = 0.6
+TAIL_RATIO = 0.4
+MAX_UTF8_BYTES_PER_CHAR = 4
+
+
+def _normalize_newlines(text: str) -> str:
+    # Same newlines as reading the file in text mode
+    return text.replace('\r\n', '\n').replace('\r', '\n')
+
+
+def decode(data: bytes) -> str:
+    return _normalize_newlines(data.decode('utf-8', errors='ignore'))
+
+
+def decode_head(data: bytes) -> str:
+    # An incremental decoder holds back a multi-byte character cut at the end of the range
+    return _normalize_newlines(codecs.getincrementaldecoder('utf-8')(errors='ignore').decode(data, final=False))
+
+
+def decode_tail(data: bytes) -> str:
+    # Skip continuation bytes of a multi-byte character cut at the start of the range
+    start = 0
+    while start < min(len(data), MAX_UTF8_BYTES_PER_CHAR - 1) and (data[start] & 0xC0) == 0x80:
+        start += 1
+    return decode(data[start:])
+
+
+def sample_text(text: str, max_chars: int = 12000) -> str:
+    if len(text) <= max_chars:
+        return text
+
+    beginning_chars = int(max_chars * HEAD_RATIO)
+    end_chars = int(max_chars * TAIL_RATIO)
+
+    return text[:beginning_chars] + MIDDLE_OMITTED + text[-end_chars:]
+
+
+def _sample_head_and_tail(head: bytes, tail: bytes, max_chars: int) -> str:
+    beginning_chars = int(max_chars * HEAD_RATIO)
+    end_chars = int(max_chars * TAIL_RATIO)
+
+    return decode_head(head)[:beginning_chars] + MIDDLE_OMITTED + decode_tail(tail)[-end_chars:]
+
+
+def read_text_head(file_path: str, max_chars: int) -> str:
+    with open(file_path, 'rb') as f:
+        return decode_head(f.read(max_chars * MAX_UTF8_BYTES_PER_CHAR))[:max_chars]
+
+
+def read_text_sample(file_path: str, max_chars: int = 12000) -> str:
+    """
+    Read the first 60% and last 40% of max_chars characters of a UTF-8 file.
+
+    Only the needed byte ranges are read, so memory and I/O don't grow with the file size.
+    """
+    beginning_bytes = int(max_chars * HEAD_RATIO) * MAX_UTF8_BYTES_PER_CHAR
+    end_bytes = int(max_chars * TAIL_RATIO) * MAX_UTF8_BYTES_PER_CHAR
+
+    with open(file_path, 'rb') as f:
+        file_size = f.seek(0, os.SEEK_END)
+        f.seek(0)
+
+        # Below this size the content may still fit in max_chars, and reading it all stays bounded
+        if file_size <= max_chars * MAX_UTF8_BYTES_PER_CHAR:
+            return sample_text(decode(f.read()), max_chars)
+
+        head = f.read(beginning_bytes)
+        f.seek(-end_bytes, os.SEEK_END)
+        tail = f.read(end_bytes)
+
+    return _sample_head_and_tail(head, tail, max_chars)
+
+
+def stored_text_sample(stored_file: StoredFile, max_chars: int = 12000) -> str:
+    if stored_file.file_size <= len(stored_file.head):
+        return sample_text(decode(stored_file.head), max_chars)
+
+    return _sample_head_and_tail(stored_file.head, stored_file.tail, max_chars)
@@ -0,0 +1,185 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Optional
+
+from document_bot.analytics import record_quota_rejection
+from home.domain.quota_exceeded_error import QuotaExceededError
+
+SESSION = "session"
+GLOBAL = "global"
+TOKENS = "tokens"
+REQUESTS = "requests"
+# Buckets of a window, how finely usage expires
+NUM_BUCKETS = 60
+
+
+def _limit(name: str, default: str) -> Optional[int]:
+    # 0 turns the budget off
+    return int(os.getenv(name, default)) or None
+
+
+class _SlidingWindow:
+    """What was used over the last window_seconds, kept in buckets so memory stays bounded however busy it gets."""
+
+    def __init__(self, window_seconds: float):
+        self.window_seconds = window_seconds
+        self.bucket_seconds = window_seconds / NUM_BUCKETS
+        # [start, amount] of each bucket, oldest first
+        self.buckets: deque[list] = deque()
+        self.used = 0
+
+    def expire(self, now: float) -> None:
+        while self.buckets and self.buckets[0][0] + self.window_seconds <= now:
+            self.used -= self.buckets.popleft()[1]
+
+    def add(self, amount: int, now: float) -> None:
+        start = now - now % self.bucket_seconds
+        if self.buckets and self.buckets[-1][0] == start:
+            self.buckets[-1][1] += amount
+        else:
+            self.buckets.append([start, amount])
+        self.used += amount
+
+    def seconds_until(self, used: int, now: float) -> float:
+        """Seconds until no more than used is left in the window, as the oldest buckets expire."""
+        remaining, wait = self.used, 0.0
+        for start, amount in self.buckets:
+            if remaining <= used:
+                break
+            remaining -= amount
+            wait = start + self.window_seconds - now
+        return max(0.0, wait)
+
+
+class _Usage:
+    def __init__(self, window_seconds: float):
+        self.tokens = _SlidingWindow(window_seconds)
+        self.requests = _SlidingWindow(window_seconds)
+
+    def expire(self, now: float) -> None:
+        self.tokens.expire(now)
+        self.requests.expire(now)
+
+
+class UsageBudget:
+    """
+    Token and request budgets of each session and of the whole process, over a sliding window.
+
+    Requests are counted as they arrive and turned away at once, before any model call, when
+    the session or the service has no requests or tokens left. Generations and embeddings
+    check the token budgets again before they are sent. Tokens are charged once a call has
+    reported them, so a call may overshoot the budget and the next one is turned away.
+    Sessions are kept in memory, the least recently used beyond max_sessions are forgotten.
+    """
+
+    def __init__(self, session_tokens: int = None, session_requests: int = None, global_tokens: int = None,
+                 global_requests: int = None, window_seconds: float = None, max_sessions: int = None):
+        self.session_tokens = session_tokens or _limit("SESSION_TOKEN_BUDGET", "200000")
+        self.session_requests = session_requests or _limit("SESSION_REQUEST_BUDGET", "100")
+        self.global_tokens = global_tokens or _limit("GLOBAL_TOKEN_BUDGET", "0")
+        self.global_requests = global_requests or _limit("GLOBAL_REQUEST_BUDGET", "0")
+        self.window_seconds = window_seconds or float(os.getenv("USAGE_BUDGET_WINDOW_SECONDS", "3600"))
+        self.max_sessions = max_sessions or int(os.getenv("USAGE_BUDGET_MAX_SESSIONS", "10000"))
+        self._sessions: OrderedDict[str, _Usage] = OrderedDict()
+        self._global = _Usage(self.window_seconds)
+        self._lock = threading.Lock()
+
+    def acquire_requests(self, session_id: Optional[str], count: int = 1) -> None:
+        """Count count requests of the session, raising QuotaExceededError when they are over a budget."""
+        with self._lock:
+            now = time.monotonic()
+            budgets = self._budgets(session_id, now)
+            rejection = None
+            for scope, usage, token_limit, request_limit in budgets:
+                rejection = (rejection or self._rejection(scope, TOKENS, usage.tokens, token_limit, 0, now)
+                             or self._rejection(scope, REQUESTS, usage.requests, request_limit, count, now))
+            if rejection is None:
+                for _, usage, _, _ in budgets:
+                    usage.requests.add(count, now)
+
+        if rejection is not None:
+            self._reject(rejection, "request", session_id)
+
+    def max_requests(self) -> Optional[int]:
+        """The most requests a session can acquire at once, more never fit in a window. None without a limit."""
+        limits = [limit for limit in (self.session_requests, self.global_requests) if limit is not None]
+        return min(limits) if limits else None
+
+    def check_tokens(self, session_id: Optional[str], stage: str, tokens: int = 0) -> None:
+        """Raise QuotaExceededError when the session or the service has no tokens left for a call of the stage."""
+        with self._lock:
+            now = time.monotonic()
+            rejection = None
+            for scope, usage, token_limit, _ in self._budgets(session_id, now):
+                rejection = rejection or self._rejection(scope, TOKENS, usage.tokens, token_limit, tokens, now)
+
+        if rejection is not None:
+            self._reject(rejection, stage, session_id)
+
+    def charge_tokens(self, session_id: Optional[str], tokens: int) -> None:
+        with self._lock:
+            now = time.monotonic()
+            for _, usage, _, _ in self._budgets(session_id, now):
+                usage.tokens.add(tokens, now)
+
+    def quota(self, session_id: Optional[str]) -> dict:
+        """The budgets of the session and the service, with what is used and left of them."""
+        with self._lock:
+            now = time.monotonic()
+            quota = {"window_seconds": self.window_seconds}
+            for scope, usage, token_limit, request_limit in self._budgets(session_id, now):
+                quota[scope] = {
+                    TOKENS: self._remaining(usage.tokens, token_limit),
+                    REQUESTS: self._remaining(usage.requests, request_limit),
+                }
+            return quota
+
+    def _budgets(self, session_id: Optional[str],
+                 now: float) -> list[tuple[str, _Usage, Optional[int], Optional[int]]]:
+        """The scope, usage and token and request limits of each budget a call of the session counts towards."""
+        self._global.expire(now)
+        budgets = [(GLOBAL, self._global, self.global_tokens, self.global_requests)]
+        if session_id:
+            usage = self._sessions.get(session_id)
+            if usage is None:
+                usage = self._sessions[session_id] = _Usage(self.window_seconds)
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            usage.expire(now)
+            budgets.append((SESSION, usage, self.session_tokens, self.session_requests))
+        return budgets
+
+    def _rejection(self, scope: str, resource: str, window: _SlidingWindow, limit: Optional[int], amount: int,
+                   now: float) -> Optional[QuotaExceededError]:
+        if limit is None or (window.used < limit and window.used + amount <= limit):
+            return None
+        retry_after_seconds = window.seconds_until(max(0, limit - max(amount, 1)), now)
+        return QuotaExceededError(scope, resource, max(1, math.ceil(retry_after_seconds)))
+
+    def _reject(self, e: QuotaExceededError, stage: str, session_id: Optional[str]) -> None:
+        record_quota_rejection(e.scope, e.resource, stage, session_id)
+        raise e
+
+    def _remaining(self, window: _SlidingWindow, limit: Optional[int]) -> dict:
+        return {
+            "limit": limit,
+            "used": window.used,
+            "remaining": max(0, limit - window.used) if limit is not None else None,
+        }
+
+
+_budget: Optional[UsageBudget] = None
+_budget_lock = threading.Lock()
+
+
+def get_usage_budget() -> UsageBudget:
+    """The budget shared by everything in the process."""
+    global _budget
+    with _budget_lock:
+        if _budget is None:
+            _budget = UsageBudget()
+        return _budget
@@ -11,3 +11,8 @@ def delete_messages():
 def add_message(author: str, content: str):
     Message.objects.create(author=author, content=content).save()
     debug("add_message", { content: content, author: author})
+
+
+async def aadd_message(author: str, content: str):
+    await Message.objects.acreate(author=author, content=content)
+    debug("add_message", {"content": content, "author": author})
@@ -1,18 +1,22 @@
+import asyncio
 import os
 
 import django
 
 from home.domain.ai_assistant import AiAssistant
 from home.domain.file_uploader import FileUploader
+from home.domain.quoted_answer import QuotedAnswer
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'document_bot.settings')
 django.setup()
 
+from django.conf import settings
 from django.test import TestCase
 from unittest.mock import Mock, patch, call
 from django.core.files.uploadedfile import SimpleUploadedFile
 
 from home.app.ask_question_form import AskQuestionForm, LOCAL_STORAGE_PATH
+from home.domain.deadline import current_deadline
 
 
 class TestAskQuestionForm(TestCase):
@@ -71,9 +75,88 @@ class TestAskQuestionForm(TestCase):
 
         form.upload_and_ask_question(file=uploaded_file)
 
-        mock_file_uploader.upload_file.assert_called_once_with(file_path)
+        mock_file_uploader.upload_file.assert_called_once_with(file_path, stored_file=None, user_id=None)
         mock_ai_assistant.answer.assert_called_once_with('What is this document about?', uploaded_document_chunks, user_id=None)
         mock_add_message.assert_has_calls([
             call('user', 'What is this document about?'),
             call('assistant', 'It is about testing')
         ])
+
+    @patch('home.app.ask_question_form.aadd_message')
+    def test_aupload_and_stream_answer_saves_complete_answer(
+            self,
+            mock_aadd_message,
+    ):
+        form = AskQuestionForm(data={'question': 'Who wrote Frankenstein?'})
+        self.assertTrue(form.is_valid())
+
+        answer = QuotedAnswer(answer="Mary Shelley", citations=[])
+
+        async def events(*args, **kwargs):
+            yield {"type": "token", "text": "Mary Shelley"}
+            yield {"type": "answer", "answer": answer}
+
+        mock_ai_assistant = Mock(spec=AiAssistant)
+        mock_ai_assistant.astream_answer = Mock(side_effect=events)
+        form.ai_assistant = mock_ai_assistant
+        form.file_uploader = Mock(spec=FileUploader)
+
+        async def collect():
+            return [event async for event in await form.aupload_and_stream_answer(file=None)]
+
+        streamed = asyncio.run(collect())
+
+        self.assertEqual(2, len(streamed))
+        mock_ai_assistant.astream_answer.assert_called_once_with('Who wrote Frankenstein?', None, user_id=None)
+        mock_aadd_message.assert_has_awaits([
+            call('user', 'Who wrote Frankenstein?'),
+            call('assistant', answer.to_string())
+        ])
+
+    @patch('home.app.ask_question_form.aadd_message')
+    def test_aupload_and_ask_question_returns_answer(
+            self,
+            mock_aadd_message,
+    ):
+        form = AskQuestionForm(data={'question': 'What is the meaning of life?'})
+        self.assertTrue(form.is_valid())
+
+        mock_ai_assistant = Mock(spec=AiAssistant)
+        mock_ai_assistant.aanswer.return_value = '42'
+        form.ai_assistant = mock_ai_assistant
+        form.file_uploader = Mock(spec=FileUploader)
+
+        answer = asyncio.run(form.aupload_and_ask_question(file=None))
+
+        self.assertEqual('42', answer)
+        mock_ai_assistant.aanswer.assert_awaited_once_with('What is the meaning of life?', None, user_id=None)
+        mock_aadd_message.assert_has_awaits([
+            call('user', 'What is the meaning of life?'),
+            call('assistant', '42')
+        ])
+
+    @patch('home.app.ask_question_form.add_message')
+    def test_question_deadline_starts_after_the_upload(
+            self,
+            mock_add_message,
+    ):
+        deadlines = {}
+        form = AskQuestionForm(data={'question': 'What is this document about?'})
+        self.assertTrue(form.is_valid())
+
+        mock_file_uploader = Mock(spec=FileUploader)
+        mock_file_uploader.upload_file.side_effect = lambda *args, **kwargs: deadlines.update(
+            upload=current_deadline()
+        ) or []
+        mock_ai_assistant = Mock(spec=AiAssistant)
+        mock_ai_assistant.answer.side_effect = lambda *args, **kwargs: deadlines.update(
+            question=current_deadline()
+        ) or 'It is about testing'
+        form.ai_assistant = mock_ai_assistant
+        form.file_uploader = mock_file_uploader
+
+        form.upload_and_ask_question(file=SimpleUploadedFile("test_document.txt", b"This is test content"))
+
+        self.assertGreater(deadlines["upload"].remaining(), settings.REQUEST_DEADLINE_SECONDS)
+        self.assertTrue(0 < deadlines["question"].remaining() <= settings.REQUEST_DEADLINE_SECONDS)
+        self.assertIsNone(current_deadline())
@@ -0,0 +1,57 @@
+import os
+import tempfile
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'document_bot.settings')
+django.setup()
+
+from django.test import TestCase, override_settings
+
+from home.app.content_addressed_upload_handler import ContentAddressedUploadHandler
+from home.infrastructure.content_hash import new_content_hasher
+
+
+class TestContentAddressedUploadHandler(TestCase):
+
+    def setUp(self):
+        self.storage_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.storage_dir.cleanup)
+
+    def _upload(self, file_name: str, content: bytes, chunk_size: int = 4):
+        handler = ContentAddressedUploadHandler()
+        handler.new_file("file", file_name, "text/plain", len(content))
+        for start in range(0, len(content), chunk_size):
+            self.assertIsNone(handler.receive_data_chunk(content[start:start + chunk_size], start))
+        return handler.file_complete(len(content))
+
+    def test_file_is_stored_under_its_content_hash(self):
+        content = b"This is test content"
+        expected_hash = new_content_hasher()
+        expected_hash.update(content)
+
+        with override_settings(LOCAL_STORAGE_PATH=self.storage_dir.name, UPLOAD_SAMPLE_BYTES=8):
+            uploaded_file = self._upload("test_document.txt", content)
+        uploaded_file.close()
+
+        stored_file = uploaded_file.stored_file
+        self.assertEqual(stored_file.content_hash, expected_hash.hexdigest())
+        self.assertEqual(stored_file.file_path,
+                         os.path.join(self.storage_dir.name, expected_hash.hexdigest(), "test_document.txt"))
+        self.assertEqual(stored_file.file_size, len(content))
+        self.assertEqual(stored_file.head, b"This is ")
+        self.assertEqual(stored_file.tail, b" content")
+        self.assertEqual(uploaded_file.temporary_file_path(), stored_file.file_path)
+
+        with open(stored_file.file_path, 'rb') as f:
+            self.assertEqual(f.read(), content)
+
+    def test_same_content_is_stored_once(self):
+        with override_settings(LOCAL_STORAGE_PATH=self.storage_dir.name):
+            first = self._upload("test_document.txt", b"Same content")
+            second = self._upload("test_document.txt", b"Same content")
+        first.close()
+        second.close()
+
+        self.assertEqual(first.stored_file.file_path, second.stored_file.file_path)
+        self.assertEqual(os.listdir(os.path.join(self.storage_dir.name, ".uploads")), [])
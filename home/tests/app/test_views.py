@@ -0,0 +1,87 @@
+import json
+import os
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'document_bot.settings')
+django.setup()
+
+from django.test import Client, TestCase
+from unittest.mock import patch
+
+from home.app.ask_question_form import AskQuestionForm
+from home.domain.quota_exceeded_error import QuotaExceededError
+
+CSRF_TOKEN = 'a' * 32
+
+
+class TestViews(TestCase):
+
+    def setUp(self):
+        self.client = Client(enforce_csrf_checks=True)
+        # The cookie the page sets, sent back in the header like the page's script does
+        self.client.cookies['csrftoken'] = CSRF_TOKEN
+
+    def _post(self, body: str, content_type: str = 'application/json', csrf: bool = True):
+        headers = {'HTTP_X_CSRFTOKEN': CSRF_TOKEN} if csrf else {}
+        return self.client.post('/answer_batch', body, content_type=content_type, **headers)
+
+    def _over_quota(self, mock_ai_assistant):
+        mock_ai_assistant.usage_budget.max_requests.return_value = 100
+        mock_ai_assistant.usage_budget.acquire_requests.side_effect = QuotaExceededError("session", "requests", 42)
+
+    @patch.object(AskQuestionForm, 'ai_assistant')
+    def test_ask_question_over_the_quota_is_told_when_to_retry(self, mock_ai_assistant):
+        self._over_quota(mock_ai_assistant)
+
+        response = self.client.post('/ask_question', {'question': 'What is AI?'}, HTTP_X_CSRFTOKEN=CSRF_TOKEN)
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '42')
+        mock_ai_assistant.aanswer.assert_not_called()
+
+    @patch.object(AskQuestionForm, 'ai_assistant')
+    def test_stream_answer_over_the_quota_is_told_when_to_retry(self, mock_ai_assistant):
+        self._over_quota(mock_ai_assistant)
+
+        response = self.client.post('/stream_answer', {'question': 'What is AI?'}, HTTP_X_CSRFTOKEN=CSRF_TOKEN)
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '42')
+        mock_ai_assistant.astream_answer.assert_not_called()
+
+    @patch.object(AskQuestionForm, 'ai_assistant')
+    def test_answer_batch_over_the_quota_is_told_when_to_retry(self, mock_ai_assistant):
+        self._over_quota(mock_ai_assistant)
+
+        response = self._post(json.dumps({'questions': ['What is AI?', 'Who wrote Frankenstein?']}))
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '42')
+        mock_ai_assistant.usage_budget.acquire_requests.assert_called_once()
+        self.assertEqual(mock_ai_assistant.usage_budget.acquire_requests.call_args.args[1], 2)
+
+    @patch.object(AskQuestionForm, 'ai_assistant')
+    def test_answer_batch_larger_than_the_request_budget_is_refused_without_retry_after(self, mock_ai_assistant):
+        mock_ai_assistant.usage_budget.max_requests.return_value = 100
+
+        response = self._post(json.dumps({'questions': ['What is AI?'] * 101}))
+
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(response.has_header('Retry-After'))
+        self.assertEqual(response.json()['errors']['questions'], ['At most 100 questions can be sent at once.'])
+        mock_ai_assistant.usage_budget.acquire_requests.assert_not_called()
+
+    @patch.object(AskQuestionForm, 'ai_assistant')
+    def test_answer_batch_is_rejected_without_a_csrf_token(self, mock_ai_assistant):
+        response = self._post(json.dumps({'questions': ['What is AI?']}), csrf=False)
+
+        self.assertEqual(response.status_code, 403)
+        mock_ai_assistant.usage_budget.acquire_requests.assert_not_called()
+
+    @patch.object(AskQuestionForm, 'ai_assistant')
+    def test_answer_batch_requires_a_json_body(self, mock_ai_assistant):
+        response = self._post('questions=What+is+AI%3F', content_type='application/x-www-form-urlencoded')
+
+        self.assertEqual(response.status_code, 415)
+        mock_ai_assistant.usage_budget.acquire_requests.assert_not_called()
@@ -1,12 +1,30 @@
+import asyncio
+import threading
 from unittest import TestCase
-from unittest.mock import Mock, patch
+from unittest.mock import AsyncMock, Mock, patch
 
-from home.domain.ai_assistant import AiAssistant, model, model_provider
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, LLMResult
+
+from home.domain.ai_assistant import AUDIT_SESSION, AiAssistant, DEGRADED_ANSWER, model, model_provider
+from home.domain.compact_answer import CompactAnswer, CompactCitation
+from home.domain.deadline import Deadline, current_deadline, deadline_scope
+from home.domain.deadline_exceeded_error import DeadlineExceededError
 from home.domain.document_repository import DocumentRepository
 from home.domain.invalid_question_error import InvalidQuestionError
+from home.domain.model_router import ModelRouter
+from home.domain.overloaded_error import OverloadedError
 from home.domain.question_validator import QuestionValidator
+from home.domain.quota_exceeded_error import QuotaExceededError
 from home.domain.quoted_answer import QuotedAnswer
 from home.domain.state import State
+from home.domain.token_usage import usage_scope
+from home.infrastructure.admission_controller import AdmissionController
+from home.infrastructure.context_packer import ContextPacker, token_counter
+from home.infrastructure.openai_http_client import get_async_http_client, get_http_client, http_timeout
+from home.infrastructure.semantic_answer_cache import SemanticAnswerCache
+from home.infrastructure.usage_budget import UsageBudget
 
 
 class TestAIAssistant(TestCase):
@@ -32,16 +50,22 @@ class TestAIAssistant(TestCase):
         mock_span.__enter__ = Mock(return_value=mock_span)
         mock_span.__exit__ = Mock(return_value=False)
         mock_langfuse.start_as_current_span.return_value = mock_span
+        mock_langfuse.start_as_current_generation.return_value = mock_span
         mock_get_client.return_value = mock_langfuse
+        self.mock_span = mock_span
 
         self.mock_document_repository = Mock(spec_set=DocumentRepository)
         self.mock_validator = Mock(spec_set=QuestionValidator)
         self.subject = AiAssistant(
             document_repository=self.mock_document_repository,
-            question_validator=self.mock_validator
+            question_validator=self.mock_validator,
+            context_packer=ContextPacker(model, max_tokens=6000, count_tokens=lambda text: len(text.split()))
         )
 
-        self.mock_init_chat_model.assert_called_once_with(model, model_provider=model_provider)
+        self.mock_init_chat_model.assert_called_once_with(model, model_provider=model_provider, max_retries=0,
+                                                          http_client=get_http_client(),
+                                                          http_async_client=get_async_http_client(),
+                                                          timeout=http_timeout(), stream_usage=True)
 
     def test_retrieve(self):
         question = "What is the meaning of life?"
@@ -52,37 +76,146 @@ class TestAIAssistant(TestCase):
             "answer": QuotedAnswer(answer="", citations=[])
         }
         documents = [Mock()]
+        embedding = [0.1, 0.2]
         expected_state = initial_state.copy()
         expected_state["existing_documents"] = documents
+        expected_state["question_embedding"] = embedding
 
-        self.mock_document_repository.similarity_search.return_value = documents
+        self.mock_document_repository.embed_query.return_value = embedding
+        self.mock_document_repository.similarity_search_by_vector.return_value = documents
 
         self.assertEqual(
             expected_state,
             self.subject.retrieve(initial_state),
         )
 
-        self.mock_document_repository.similarity_search.assert_called_once_with(question)
+        self.mock_document_repository.embed_query.assert_called_once_with(question)
+        self.mock_document_repository.similarity_search_by_vector.assert_called_once_with(embedding)
 
     def test_answer_validates_question(self):
         question = "What is AI?"
-        self.mock_document_repository.similarity_search.return_value = []
+        self.mock_document_repository.embed_query.return_value = [0.1, 0.2]
+        self.mock_document_repository.similarity_search_by_vector.return_value = []
 
         mock_answer = QuotedAnswer(answer="AI is artificial intelligence", citations=[])
         self.subject.llm.invoke = Mock(return_value=mock_answer)
 
         self.subject.answer(question, [])
 
-        self.mock_validator.validate.assert_called_once_with(question, user_id=None)
+        self.mock_validator.validate_locally.assert_called_once_with(question, user_id=None)
+        self.mock_validator.validate_remotely.assert_called_once_with(question, user_id=None)
+
+    def test_answer_sends_the_conversation_with_a_follow_up_question(self):
+        self.mock_document_repository.get_corpus_version.return_value = 1
+        self.mock_document_repository.embed_query.return_value = [0.1, 0.2]
+        self.mock_document_repository.similarity_search_by_vector.return_value = [
+            Document(id="doc-1", page_content="Content", metadata={"source": "Frankenstein.txt"})
+        ]
+        self.subject.llm.invoke = Mock(side_effect=[
+            QuotedAnswer(answer="Mary Shelley wrote it.", citations=[]),
+            QuotedAnswer(answer="In 1818.", citations=[]),
+        ])
+
+        self.subject.answer("Who wrote Frankenstein?", [], user_id="session")
+        self.subject.answer("When did she?", [], user_id="session")
+
+        first_messages, second_messages = [call[0][0].to_messages()
+                                           for call in self.subject.llm.invoke.call_args_list]
+        self.assertEqual(len(first_messages), 3)
+        self.assertIn("User: Who wrote Frankenstein?\nAssistant: Mary Shelley wrote it.", second_messages[2].content)
+        self.assertEqual(second_messages[3].content, "When did she?")
+
+    def test_answer_to_a_follow_up_question_is_cached_with_its_conversation(self):
+        self.mock_document_repository.get_corpus_version.return_value = 1
+        self.mock_document_repository.embed_query.return_value = [0.1, 0.2]
+        self.mock_document_repository.similarity_search_by_vector.return_value = [
+            Document(id="doc-1", page_content="Content", metadata={"source": "Frankenstein.txt"})
+        ]
+        # A cited answer keeps the question on the fast tier, whose cached answers are looked up
+        self.subject.llm.invoke = Mock(return_value=QuotedAnswer.model_validate(
+            {"answer": "Answer", "citations": [{"source_id": 1, "quote": "Content"}]}
+        ))
+
+        self.subject.answer("What is this?", [], user_id="session")
+        self.subject.answer("What is this?", [], user_id="session")
+        self.subject.answer("What is this?", [], user_id="other session")
+        # The other session has had the same conversation by now, so the follow-up's answer is reused
+        self.subject.answer("What is this?", [], user_id="other session")
+
+        self.assertEqual(self.subject.llm.invoke.call_count, 2)
+        first_prompt, follow_up_prompt = [call[0][0].to_messages() for call in self.subject.llm.invoke.call_args_list]
+        self.assertEqual(len(first_prompt), 3)
+        self.assertEqual(len(follow_up_prompt), 4)
+
+    @patch('home.domain.token_usage.record_token_usage')
+    def test_answer_records_the_tokens_and_cost_of_the_generation(self, mock_record_token_usage):
+        self.mock_document_repository.embed_query.return_value = [0.1, 0.2]
+        self.mock_document_repository.similarity_search_by_vector.return_value = []
+
+        def invoke(prompt_value, config=None):
+            message = AIMessage(content="", response_metadata={"model_name": "gpt-4o-mini-2024-07-18"},
+                                usage_metadata={"input_tokens": 2000, "output_tokens": 100, "total_tokens": 2100,
+                                                "input_token_details": {"cache_read": 1024}})
+            for callback in config["callbacks"]:
+                callback.on_llm_end(LLMResult(generations=[[ChatGeneration(message=message)]]))
+            return QuotedAnswer(answer="Answer", citations=[])
+
+        self.subject.llm.invoke = Mock(side_effect=invoke)
+
+        self.subject.answer("What is AI?", [], user_id="session")
+
+        tokens = {"prompt": 2000, "completion": 100, "cached": 1024, "total": 2100}
+        stage, llm_model, recorded_tokens, cost_usd = mock_record_token_usage.call_args.args
+        self.assertEqual((stage, llm_model, recorded_tokens), ("generate", model, tokens))
+        # The cached part of the prompt is billed at half the price
+        self.assertAlmostEqual(cost_usd, (976 * 0.15 + 1024 * 0.075 + 100 * 0.60) / 1_000_000)
+        self.assertEqual(mock_record_token_usage.call_args.kwargs["user_id"], "session")
+        self.mock_span.update.assert_any_call(
+            usage_details={"input": 2000, "output": 100, "input_cache_read": 1024, "total": 2100},
+            cost_details={"total": cost_usd},
+        )
+        trace_metadata = self.mock_span.update.call_args.kwargs["metadata"]
+        self.assertEqual(trace_metadata["usage"], {"tokens": {"generate": tokens}, "cost_usd": 0.000283})
+
+    def test_answer_is_not_generated_for_a_session_over_its_token_budget(self):
+        self.mock_document_repository.embed_query.return_value = [0.1, 0.2]
+        self.mock_document_repository.similarity_search_by_vector.return_value = []
+        self.subject.usage_budget = UsageBudget(session_tokens=100, window_seconds=60)
+        self.subject.usage_budget.charge_tokens("session", 100)
+        self.subject.llm.invoke = Mock()
+
+        with self.assertRaises(QuotaExceededError):
+            self.subject.answer("What is AI?", [], user_id="session")
+
+        self.subject.llm.invoke.assert_not_called()
 
     def test_answer_raises_when_validation_fails(self):
         question = "This is a very long question" * 100
-        self.mock_validator.validate.side_effect = InvalidQuestionError("Question too long")
+        self.mock_validator.validate_locally.side_effect = InvalidQuestionError("Question too long")
+        self.subject.llm.invoke = Mock()
 
         with self.assertRaises(InvalidQuestionError):
             self.subject.answer(question, [])
 
-        self.mock_document_repository.similarity_search.assert_not_called()
+        self.subject.llm.invoke.assert_not_called()
+        self.mock_document_repository.embed_query.assert_not_called()
+        self.mock_validator.validate_remotely.assert_not_called()
+
+    def test_answer_retrieves_while_validating(self):
+        question = "What is AI?"
+        retrieval_started = threading.Event()
+        self.mock_document_repository.embed_query.side_effect = lambda q: retrieval_started.set() or [0.1, 0.2]
+        self.mock_document_repository.similarity_search_by_vector.return_value = []
+        # Validation only completes once retrieval has started
+        self.mock_validator.validate_remotely.side_effect = lambda q, user_id=None: self.assertTrue(
+            retrieval_started.wait(timeout=5)
+        )
+        self.subject.llm.invoke = Mock(return_value=QuotedAnswer(answer="Answer", citations=[]))
+
+        self.subject.answer(question, [])
+
+        self.mock_document_repository.embed_query.assert_called_once_with(question)
+        self.subject.llm.invoke.assert_called_once()
 
     def test_generate_with_existing_documents_only(self):
         doc1 = Mock()
@@ -162,4 +295,610 @@ class TestAIAssistant(TestCase):
         self.assertIn("[Source 2]", prompt_text)
         self.assertIn("[Source 3]", prompt_text)
         self.assertIn("[Source 4]", prompt_text)
-        self.assertIn("[Source 5]", prompt_text)
\ No newline at end of file
+        self.assertIn("[Source 5]", prompt_text)
+
+    def test_generate_keeps_the_instructions_identical_across_questions(self):
+        self.subject.llm.invoke = Mock(return_value=QuotedAnswer(answer="Answer", citations=[]))
+
+        for question, content in [("What is this?", "Content 1"), ("Who wrote it?", "Content 2")]:
+            self.subject.generate({
+                "existing_documents": [Document(page_content=content)],
+                "question": question,
+                "new_document": [],
+                "answer": QuotedAnswer(answer="", citations=[])
+            })
+
+        first_messages, second_messages = [call[0][0].to_messages() for call in self.subject.llm.invoke.call_args_list]
+        self.assertEqual(first_messages[0], second_messages[0])
+        self.assertNotIn("Content", first_messages[0].content)
+        self.assertIn("Content 1", first_messages[1].content)
+        self.assertIn("You have 1 sources available.", first_messages[1].content)
+        # Providers only cache a prompt prefix of at least 1024 tokens
+        self.assertGreaterEqual(token_counter(model)(first_messages[0].content), 1024)
+
+    def test_answer_packs_the_sources_and_builds_the_prompt_once(self):
+        self.mock_document_repository.get_corpus_version.return_value = 1
+        self.mock_document_repository.embed_query.return_value = [0.1, 0.2]
+        self.mock_document_repository.similarity_search_by_vector.return_value = [
+            Document(id="doc-1", page_content="Content", metadata={"source": "Frankenstein.txt"})
+        ]
+        self.subject.llm.invoke = Mock(return_value=QuotedAnswer(answer="Answer", citations=[]))
+        self.subject.context_packer.pack = Mock(wraps=self.subject.context_packer.pack)
+
+        self.subject.answer("What is this?", [], user_id="session")
+
+        self.subject.context_packer.pack.assert_called_once()
+        self.subject.llm.invoke.assert_called_once()
+
+    @patch('home.domain.ai_assistant.get_client')
+    @patch('home.domain.ai_assistant.init_chat_model')
+    def test_generate_in_compact_citation_mode_resolves_quotes_from_the_sources(self, mock_init_chat_model, _):
+        chat_model = Mock()
+        mock_init_chat_model.return_value = chat_model
+        subject = AiAssistant(
+            document_repository=self.mock_document_repository,
+            question_validator=self.mock_validator,
+            context_packer=ContextPacker(model, max_tokens=6000, count_tokens=lambda text: len(text.split())),
+            citation_mode="compact",
+        )
+        chat_model.with_structured_output.assert_any_call(CompactAnswer)
+        subject.llm.invoke = Mock(return_value=CompactAnswer(answer="Eight feet.", citations=[
+            CompactCitation(source_id=1, sentence_ids=[2]),
+        ]))
+
+        result = subject.generate({
+            "existing_documents": [Document(page_content="It was a dark night. The creature is eight feet tall.")],
+            "question": "How tall is the creature?",
+            "new_document": [],
+            "answer": QuotedAnswer(answer="", citations=[])
+        })
+
+        self.assertEqual(result["answer"], QuotedAnswer.model_validate({"answer": "Eight feet.", "citations": [
+            {"source_id": 1, "quote": "The creature is eight feet tall."},
+        ]}))
+        messages = subject.llm.invoke.call_args[0][0].to_messages()
+        self.assertIn("<1>", messages[0].content)
+        self.assertIn("<1> It was a dark night. <2> The creature is eight feet tall.", messages[1].content)
+
+    @patch('home.domain.ai_assistant.init_chat_model')
+    def test_generate_routes_difficult_questions_to_the_strong_model(self, mock_init_chat_model):
+        self.subject.model_router = ModelRouter(fast_model=model, strong_model="gpt-4o")
+        self.subject.model_router.record_outcome(
+            "What is this?", self.subject.model_router.route("What is this?", [], 1), fell_back=True, num_citations=0
+        )
+        strong_llm = Mock()
+        strong_llm.invoke.return_value = QuotedAnswer(answer="Strong answer", citations=[])
+        mock_init_chat_model.return_value.with_structured_output.return_value = strong_llm
+        self.subject.llm.invoke = Mock()
+
+        result = self.subject.generate({
+            "existing_documents": [Document(page_content="Content")],
+            "question": "What is this?",
+            "new_document": [],
+            "answer": QuotedAnswer(answer="", citations=[])
+        })
+
+        self.assertEqual(result["answer"].answer, "Strong answer")
+        mock_init_chat_model.assert_called_once_with("gpt-4o", model_provider=model_provider, max_retries=0,
+                                                     http_client=get_http_client(),
+                                                     http_async_client=get_async_http_client(),
+                                                     timeout=http_timeout(), stream_usage=True)
+        self.subject.llm.invoke.assert_not_called()
+
+    @patch('home.domain.ai_assistant.init_chat_model')
+    def test_generate_falls_back_to_the_other_tier_when_the_model_fails(self, mock_init_chat_model):
+        self.subject.model_router = ModelRouter(fast_model=model, strong_model="gpt-4o")
+        strong_llm = Mock()
+        strong_llm.invoke.return_value = QuotedAnswer(answer="Strong answer", citations=[])
+        mock_init_chat_model.return_value.with_structured_output.return_value = strong_llm
+        self.subject.llm.invoke = Mock(side_effect=TimeoutError("slow"))
+
+        result = self.subject.generate({
+            "existing_documents": [Document(page_content="Content")],
+            "question": "What is this?",
+            "new_document": [],
+            "answer": QuotedAnswer(answer="", citations=[])
+        })
+
+        self.assertEqual(result["answer"].answer, "Strong answer")
+        self.assertEqual(self.subject.model_router.past_difficulty("What is this?"), 1)
+
+    def test_generate_answers_with_the_top_passages_when_no_tier_can_answer(self):
+        self.subject.model_router = ModelRouter(fast_model=model, strong_model=model)
+        self.subject.llm.invoke = Mock(side_effect=TimeoutError("slow"))
+
+        result = self.subject.generate({
+            "existing_documents": [Document(page_content=f"Passage {i}") for i in range(5)],
+            "question": "What is this?",
+            "new_document": [],
+            "answer": QuotedAnswer(answer="", citations=[])
+        })
+
+        self.assertTrue(result["degraded"])
+        self.assertEqual(result["answer"].answer, DEGRADED_ANSWER)
+        self.assertEqual([(citation.source_id, citation.quote) for citation in result["answer"].citations],
+                         [(1, "Passage 0"), (2, "Passage 1"), (3, "Passage 2")])
+
+    def test_generate_raises_when_no_tier_can_answer_and_nothing_was_retrieved(self):
+        self.subject.model_router = ModelRouter(fast_model=model, strong_model=model)
+        self.subject.llm.invoke = Mock(side_effect=TimeoutError("slow"))
+
+        with self.assertRaises(TimeoutError):
+            self.subject.generate({
+                "existing_documents": [],
+                "question": "What is this?",
+                "new_document": [],
+                "answer": QuotedAnswer(answer="", citations=[])
+            })
+
+    def test_generate_fails_fast_once_the_chat_model_circuit_is_open(self):
+        self.subject.model_router = ModelRouter(fast_model=model, strong_model=model)
+        self.subject.llm_breaker.failure_threshold = 2
+        self.subject.llm.invoke = Mock(side_effect=ValueError("server error"))
+        state: State = {
+            "existing_documents": [Document(page_content="Passage")],
+            "question": "What is this?",
+            "new_document": [],
+            "answer": QuotedAnswer(answer="", citations=[])
+        }
+
+        for _ in range(3):
+            result = self.subject.generate(state)
+
+        self.assertTrue(result["degraded"])
+        self.assertEqual(self.subject.llm.invoke.call_count, 2)
+
+    def test_generate_answers_with_the_top_passages_once_the_deadline_has_passed(self):
+        self.subject.llm.invoke = Mock()
+
+        with deadline_scope(Deadline.after(-1)):
+            result = self.subject.generate({
+                "existing_documents": [Document(page_content="Passage")],
+                "question": "What is this?",
+                "new_document": [],
+                "answer": QuotedAnswer(answer="", citations=[])
+            })
+
+        self.assertTrue(result["degraded"])
+        self.subject.llm.invoke.assert_not_called()
+
+    def test_answer_does_not_retrieve_once_the_deadline_has_passed(self):
+        with deadline_scope(Deadline.after(-1)):
+            with self.assertRaises(DeadlineExceededError):
+                self.subject.retrieve({"question": "What is this?"})
+
+        self.mock_document_repository.embed_query.assert_not_called()
+
+    def test_generate_is_turned_away_when_no_generation_slot_is_free(self):
+        self.subject.generation_admission = AdmissionController("generation", max_concurrent=1, max_queue=0)
+        self.subject.llm.invoke = Mock()
+
+        with self.subject.generation_admission.admit():
+            with self.assertRaises(OverloadedError):
+                self.subject.generate({
+                    "existing_documents": [Document(page_content="Passage")],
+                    "question": "What is this?",
+                    "new_document": [],
+                    "answer": QuotedAnswer(answer="", citations=[])
+                })
+
+        self.subject.llm.invoke.assert_not_called()
+
+    def test_astream_answer_streams_the_top_passages_when_no_tier_can_answer(self):
+        self.mock_document_repository.aembed_query.return_value = [0.1, 0.2]
+        self.mock_document_repository.asimilarity_search_by_vector.return_value = [
+            Document(page_content="Passage", metadata={"source": "Frankenstein.txt"})
+        ]
+        self.subject.model_router = ModelRouter(fast_model=model, strong_model=model)
+
+        async def failing_answers(prompt_value, config=None):
+            raise TimeoutError("slow")
+            yield
+
+        self.subject.streaming_llm = Mock()
+        self.subject.streaming_llm.astream = failing_answers
+
+        async def collect():
+            return [event async for event in self.subject.astream_answer("What is this?", [])]
+
+        events = asyncio.run(collect())
+
+        self.assertEqual({"type": "token", "text": DEGRADED_ANSWER}, events[0])
+        self.assertEqual("Passage", events[-1]["answer"].citations[0].quote)
+
+    def test_unknown_citation_mode_is_rejected(self):
+        with self.assertRaises(ValueError):
+            AiAssistant(
+                document_repository=self.mock_document_repository,
+                question_validator=self.mock_validator,
+                citation_mode="quotes",
+            )
+
+    def _cacheable_state(self, question: str, embedding: list[float] = None,
+                         document_id: str = "abc#0") -> State:
+        state: State = {
+            "existing_documents": [Document(id=document_id, page_content="Existing content")],
+            "question": question,
+            "new_document": [],
+            "answer": QuotedAnswer(answer="", citations=[])
+        }
+        if embedding:
+            state["question_embedding"] = embedding
+        return state
+
+    def test_generate_reuses_answer_for_repeated_question(self):
+        self.mock_document_repository.get_corpus_version.return_value = 1
+        mock_answer = QuotedAnswer.model_validate(
+            {"answer": "Answer", "citations": [{"source_id": 1, "quote": "Existing content"}]}
+        )
+        self.subject.llm.invoke = Mock(return_value=mock_answer)
+
+        first = self.subject.generate(self._cacheable_state("What is this?"))
+        second = self.subject.generate(self._cacheable_state("  what is THIS "))
+
+        self.assertEqual(first, {"answer": mock_answer})
+        self.assertEqual(second, {"answer": mock_answer, "cache_hit": "exact"})
+        self.subject.llm.invoke.assert_called_once()
+
+    @patch('home.domain.ai_assistant.init_chat_model')
+    def test_generate_caches_answers_per_routed_model(self, mock_init_chat_model):
+        self.mock_document_repository.get_corpus_version.return_value = 1
+        self.subject.model_router = ModelRouter(fast_model=model, strong_model="gpt-4o")
+        strong_llm = Mock()
+        strong_llm.invoke.return_value = QuotedAnswer(answer="Strong answer", citations=[])
+        mock_init_chat_model.return_value.with_structured_output.return_value = strong_llm
+        # An answer without citations marks the question as difficult, so it is routed to the strong tier next
+        self.subject.llm.invoke = Mock(return_value=QuotedAnswer(answer="Fast answer", citations=[]))
+
+        first = self.subject.generate(self._cacheable_state("What is this?"))
+        second = self.subject.generate(self._cacheable_state("What is this?"))
+        third = self.subject.generate(self._cacheable_state("What is this?"))
+
+        self.assertEqual(first, {"answer": QuotedAnswer(answer="Fast answer", citations=[])})
+        self.assertEqual(second, {"answer": QuotedAnswer(answer="Strong answer", citations=[])})
+        self.assertEqual(third, {"answer": QuotedAnswer(answer="Strong answer", citations=[]), "cache_hit": "exact"})
+        self.subject.llm.invoke.assert_called_once()
+        strong_llm.invoke.assert_called_once()
+
+    def test_generate_ignores_cached_answer_after_corpus_changes(self):
+        self.mock_document_repository.get_corpus_version.return_value = 1
+        self.subject.llm.invoke = Mock(return_value=QuotedAnswer(answer="Answer", citations=[]))
+
+        self.subject.generate(self._cacheable_state("What is this?"))
+        self.mock_document_repository.get_corpus_version.return_value = 2
+        result = self.subject.generate(self._cacheable_state("What is this?"))
+
+        self.assertNotIn("cache_hit", result)
+        self.assertEqual(2, self.subject.llm.invoke.call_count)
+
+    def test_generate_reuses_answer_for_paraphrased_question_with_same_sources(self):
+        self.subject.semantic_answer_cache = SemanticAnswerCache(threshold=0.95, audit_rate=0)
+        self.mock_document_repository.get_corpus_version.return_value = 1
+        mock_answer = QuotedAnswer(answer="Answer", citations=[])
+        self.subject.llm.invoke = Mock(return_value=mock_answer)
+
+        self.subject.generate(self._cacheable_state("Who wrote Frankenstein?", [1.0, 0.0]))
+        result = self.subject.generate(self._cacheable_state("Who is the author of Frankenstein?", [0.99, 0.05]))
+
+        self.assertEqual(result, {"answer": mock_answer, "cache_hit": "semantic"})
+        self.subject.llm.invoke.assert_called_once()
+
+    @patch('home.domain.token_usage.record_token_usage')
+    def test_semantic_hit_audit_is_metered_like_a_generation(self, mock_record_token_usage):
+        self.subject.semantic_answer_cache = SemanticAnswerCache(threshold=0.95, audit_rate=1)
+        self.subject.audit_executor = Mock()
+        self.subject.audit_executor.submit.side_effect = lambda fn, *args: fn(*args)
+        self.subject.generation_admission = Mock(wraps=self.subject.generation_admission)
+        self.mock_document_repository.get_corpus_version.return_value = 1
+
+        def invoke(prompt_value, config=None):
+            message = AIMessage(content="", response_metadata={"model_name": "gpt-4o-mini-2024-07-18"},
+                                usage_metadata={"input_tokens": 200, "output_tokens": 10, "total_tokens": 210})
+            for callback in config["callbacks"]:
+                callback.on_llm_end(LLMResult(generations=[[ChatGeneration(message=message)]]))
+            return QuotedAnswer(answer="Answer", citations=[])
+
+        self.subject.llm.invoke = Mock(side_effect=invoke)
+
+        self.subject.generate(self._cacheable_state("Who wrote Frankenstein?", [1.0, 0.0]))
+        result = self.subject.generate(self._cacheable_state("Who is the author of Frankenstein?", [0.99, 0.05]))
+
+        self.assertEqual(result["cache_hit"], "semantic")
+        self.assertEqual(["generate", "audit"], [call.args[0] for call in mock_record_token_usage.call_args_list])
+        self.assertEqual(2, self.subject.generation_admission.admit.call_count)
+
+    @patch('home.domain.token_usage.record_token_usage')
+    def test_semantic_hit_audit_is_accounted_to_the_audit_session_with_its_own_deadline(self,
+                                                                                        mock_record_token_usage):
+        self.subject.semantic_answer_cache = SemanticAnswerCache(threshold=0.95, audit_rate=1)
+        audits = []
+        self.subject.audit_executor = Mock()
+        self.subject.audit_executor.submit.side_effect = lambda fn, *args: audits.append((fn, args))
+        self.mock_document_repository.get_corpus_version.return_value = 1
+
+        def invoke(prompt_value, config=None):
+            message = AIMessage(content="", response_metadata={"model_name": "gpt-4o-mini-2024-07-18"},
+                                usage_metadata={"input_tokens": 200, "output_tokens": 10, "total_tokens": 210})
+            for callback in config["callbacks"]:
+                callback.on_llm_end(LLMResult(generations=[[ChatGeneration(message=message)]]))
+            return QuotedAnswer(answer="Answer", citations=[])
+
+        self.subject.llm.invoke = Mock(side_effect=invoke)
+
+        with usage_scope("session") as ledger, deadline_scope(Deadline.after(5)):
+            self.subject.generate(self._cacheable_state("Who wrote Frankenstein?", [1.0, 0.0]))
+            self.subject.generate(self._cacheable_state("Who is the author of Frankenstein?", [0.99, 0.05]))
+        # The audit runs once the request is over, its deadline long gone
+        with usage_scope("session"), deadline_scope(Deadline.after(-1)):
+            for fn, args in audits:
+                fn(*args)
+
+        self.assertEqual([("generate", "session"), ("audit", AUDIT_SESSION)],
+                         [(call.args[0], call.kwargs["user_id"]) for call in mock_record_token_usage.call_args_list])
+        self.assertEqual(["generate"], list(ledger.as_dict()["tokens"]))
+
+    def test_generate_ignores_paraphrased_question_with_other_sources(self):
+        self.subject.semantic_answer_cache = SemanticAnswerCache(threshold=0.95, audit_rate=0)
+        self.mock_document_repository.get_corpus_version.return_value = 1
+        self.subject.llm.invoke = Mock(return_value=QuotedAnswer(answer="Answer", citations=[]))
+
+        self.subject.generate(self._cacheable_state("Who wrote Frankenstein?", [1.0, 0.0]))
+        result = self.subject.generate(
+            self._cacheable_state("Who is the author of Frankenstein?", [0.99, 0.05], document_id="def#0")
+        )
+
+        self.assertNotIn("cache_hit", result)
+        self.assertEqual(2, self.subject.llm.invoke.call_count)
+
+    def test_answer_validates_each_caller_of_a_coalesced_question(self):
+        self.mock_document_repository.embed_query.return_value = [0.1, 0.2]
+        self.mock_document_repository.similarity_search_by_vector.return_value = []
+        shared_answer = QuotedAnswer(answer="Shared answer", citations=[])
+        self.subject.single_flight = Mock()
+        self.subject.single_flight.do.return_value = (
+            {"question": "What is AI?", "existing_documents": [], "answer": shared_answer},
+            True
+        )
+        self.subject.llm.invoke = Mock()
+
+        answer = self.subject.answer("What is AI?", [], user_id="user-1")
+
+        self.assertEqual(shared_answer.to_string(), answer)
+        self.mock_validator.validate_remotely.assert_called_once_with("What is AI?", user_id="user-1")
+        self.assertEqual("what is ai", self.subject.single_flight.do.call_args[0][0])
+        self.subject.llm.invoke.assert_not_called()
+
+    def test_a_follow_up_question_is_only_coalesced_with_the_same_conversation(self):
+        state = self._cacheable_state("What did she do?")
+        first = self.subject._flight_key({**state, "history": "User: Who is Mary?\nAssistant: A writer."})
+        same = self.subject._flight_key({**state, "history": "User: Who is Mary?\nAssistant: A writer."})
+        other = self.subject._flight_key({**state, "history": "User: Who is Elizabeth?\nAssistant: A cousin."})
+
+        self.assertEqual(first, same)
+        self.assertNotEqual(first, other)
+        self.assertNotEqual(first, self.subject._flight_key(state))
+
+    def test_session_over_its_budget_is_rejected_before_joining_a_shared_run(self):
+        self.mock_document_repository.embed_query.return_value = [0.1, 0.2]
+        self.mock_document_repository.similarity_search_by_vector.return_value = []
+        self.subject.usage_budget = UsageBudget(session_tokens=100, window_seconds=60)
+        self.subject.usage_budget.charge_tokens("over budget", 100)
+        self.subject.single_flight = Mock()
+
+        with self.assertRaises(QuotaExceededError):
+            self.subject.answer("What is AI?", [], user_id="over budget")
+
+        self.subject.single_flight.do.assert_not_called()
+
+    def test_shared_run_does_not_check_the_budget_of_the_session_running_it(self):
+        self.subject.usage_budget = Mock()
+        self.subject.llm.invoke = Mock(return_value=QuotedAnswer(answer="AI is artificial intelligence",
+                                                                 citations=[]))
+
+        result = self.subject.generate({**self._cacheable_state("What is AI?"), "cache_checked": True})
+
+        self.assertEqual("AI is artificial intelligence", result["answer"].answer)
+        self.subject.usage_budget.check_tokens.assert_not_called()
+
+    def test_astream_answer_does_not_count_an_invalid_answer_against_the_chat_model(self):
+        self.mock_document_repository.aembed_query.return_value = [0.1, 0.2]
+        self.mock_document_repository.asimilarity_search_by_vector.return_value = []
+        self.subject.llm_breaker.failure_threshold = 1
+
+        async def invalid_answers(prompt_value, config=None):
+            yield {"answer": "Mary"}
+            yield {"answer": "Mary", "citations": 1}
+
+        self.subject.streaming_llm = Mock()
+        self.subject.streaming_llm.astream = invalid_answers
+
+        async def collect():
+            return [event async for event in self.subject.astream_answer("Who wrote Frankenstein?", [])]
+
+        with self.assertRaises(ValueError):
+            asyncio.run(collect())
+
+        self.assertEqual(self.subject.llm_breaker.failures, 0)
+
+    @patch('home.domain.ai_assistant.init_chat_model')
+    def test_astream_answer_falls_back_when_the_model_fails_before_the_first_token(self, mock_init_chat_model):
+        self.mock_document_repository.aembed_query.return_value = [0.1, 0.2]
+        self.mock_document_repository.asimilarity_search_by_vector.return_value = []
+        self.subject.model_router = ModelRouter(fast_model=model, strong_model="gpt-4o")
+
+        async def failing_answers(prompt_value, config=None):
+            raise TimeoutError("slow")
+            yield
+
+        async def partial_answers(prompt_value, config=None):
+            yield {"answer": "Mary Shelley", "citations": []}
+
+        self.subject.streaming_llm = Mock()
+        self.subject.streaming_llm.astream = failing_answers
+        strong_llm = Mock()
+        strong_llm.astream = partial_answers
+        mock_init_chat_model.return_value.with_structured_output.return_value = strong_llm
+
+        async def collect():
+            return [event async for event in self.subject.astream_answer("Who wrote Frankenstein?", [])]
+
+        events = asyncio.run(collect())
+
+        self.assertEqual({"type": "token", "text": "Mary Shelley"}, events[0])
+        self.assertEqual("Mary Shelley", events[-1]["answer"].answer)
+
+    def test_astream_answer_raises_when_validation_fails(self):
+        self.mock_validator.validate_locally.side_effect = InvalidQuestionError("Question too long")
+        self.subject.streaming_llm = Mock()
+
+        async def collect():
+            return [event async for event in self.subject.astream_answer("What is AI?", [])]
+
+        with self.assertRaises(InvalidQuestionError):
+            asyncio.run(collect())
+
+        self.subject.streaming_llm.astream.assert_not_called()
+
+    def test_aanswer_awaits_validation_retrieval_and_generation(self):
+        self.mock_document_repository.aembed_query.return_value = [0.1, 0.2]
+        self.mock_document_repository.asimilarity_search_by_vector.return_value = []
+        mock_answer = QuotedAnswer(answer="AI is artificial intelligence", citations=[])
+        self.subject.llm.ainvoke = AsyncMock(return_value=mock_answer)
+
+        answer = asyncio.run(self.subject.aanswer("What is AI?", [], user_id="user-1"))
+
+        self.assertEqual(mock_answer.to_string(), answer)
+        self.mock_validator.avalidate_remotely.assert_awaited_once_with("What is AI?", user_id="user-1")
+        self.mock_document_repository.aembed_query.assert_awaited_once_with("What is AI?")
+        self.mock_document_repository.asimilarity_search_by_vector.assert_awaited_once_with([0.1, 0.2])
+        self.subject.llm.ainvoke.assert_awaited_once()
+
+    def test_aanswer_batch_validates_and_embeds_the_questions_in_batches(self):
+        rejected = InvalidQuestionError("Rejected")
+        self.mock_validator.avalidate_batch.return_value = [None, rejected, None]
+        self.mock_document_repository.aembed_queries.return_value = [[1.0, 0.0], [0.0, 1.0]]
+        self.mock_document_repository.asimilarity_search_by_vector.return_value = []
+        self.subject.llm.ainvoke = AsyncMock(side_effect=lambda prompt_value, config=None: QuotedAnswer(
+            answer=f"Answer to {prompt_value.to_messages()[-1].content}", citations=[]
+        ))
+
+        async def run():
+            return [result async for result in self.subject.aanswer_batch(["First?", "Bad?", "Third?"])]
+
+        results = sorted(asyncio.run(run()), key=lambda result: result["index"])
+
+        self.assertEqual(results[0]["answer"].answer, "Answer to First?")
+        self.assertIs(results[1]["error"], rejected)
+        self.assertEqual(results[2]["answer"].answer, "Answer to Third?")
+        self.mock_validator.avalidate_batch.assert_awaited_once_with(["First?", "Bad?", "Third?"], user_id=None)
+        self.mock_document_repository.aembed_queries.assert_awaited_once_with(["First?", "Third?"])
+
+    @patch('home.domain.ai_assistant.record_question_attempt')
+    def test_aanswer_batch_records_each_question_like_a_single_one(self, mock_record_question_attempt):
+        rejected = InvalidQuestionError("Rejected")
+        self.mock_validator.avalidate_batch.return_value = [rejected, None]
+        self.mock_document_repository.aembed_queries.return_value = [[0.1]]
+        self.mock_document_repository.asimilarity_search_by_vector.return_value = []
+        self.subject.llm.ainvoke = AsyncMock(return_value=QuotedAnswer(answer="Answer", citations=[]))
+        self.subject.flagged_tracker = Mock()
+        self.subject.flagged_tracker.record_success.return_value = True
+
+        async def run():
+            return [result async for result in self.subject.aanswer_batch(["Bad?", "Good?"], user_id="user-1")]
+
+        results = sorted(asyncio.run(run()), key=lambda result: result["index"])
+
+        self.assertIs(results[0]["error"], rejected)
+        self.assertEqual(results[1]["answer"].answer, "Answer")
+        self.subject.flagged_tracker.record_flagged.assert_called_once_with("user-1")
+        self.subject.flagged_tracker.record_success.assert_called_once_with("user-1")
+        mock_record_question_attempt.assert_any_call(user_id="user-1", flagged=True, validator_failed="Rejected")
+        mock_record_question_attempt.assert_any_call(user_id="user-1", flagged=False, is_recovery=True)
+
+    def test_aanswer_batch_moderates_and_embeds_within_the_deadline(self):
+        deadlines = []
+        self.mock_validator.avalidate_batch.side_effect = lambda questions, user_id=None: (
+            deadlines.append(current_deadline()) or [None]
+        )
+        self.mock_document_repository.aembed_queries.side_effect = lambda questions: (
+            deadlines.append(current_deadline()) or [[0.1]]
+        )
+        self.mock_document_repository.asimilarity_search_by_vector.return_value = []
+        self.subject.llm.ainvoke = AsyncMock(return_value=QuotedAnswer(answer="Answer", citations=[]))
+
+        async def run():
+            return [result async for result in self.subject.aanswer_batch(["First?"], deadline_seconds=5)]
+
+        asyncio.run(run())
+
+        self.assertIs(deadlines[0], deadlines[1])
+        self.assertTrue(0 < deadlines[0].remaining() <= 5)
+
+    def test_aanswer_batch_reports_a_failed_question_and_answers_the_others(self):
+        self.mock_validator.avalidate_batch.return_value = [None, None]
+        self.mock_document_repository.aembed_queries.return_value = [[0.1], [0.2]]
+        self.mock_document_repository.asimilarity_search_by_vector.side_effect = [ValueError("server error"), []]
+        self.subject.llm.ainvoke = AsyncMock(return_value=QuotedAnswer(answer="Answer", citations=[]))
+
+        async def run():
+            return [result async for result in self.subject.aanswer_batch(["First?", "Second?"])]
+
+        results = sorted(asyncio.run(run()), key=lambda result: result["index"])
+
+        self.assertIsInstance(results[0]["error"], ValueError)
+        self.assertEqual(results[1]["answer"].answer, "Answer")
+
+    def test_aanswer_raises_when_validation_fails(self):
+        self.mock_validator.validate_locally.side_effect = InvalidQuestionError("Question too long")
+
+        with self.assertRaises(InvalidQuestionError):
+            asyncio.run(self.subject.aanswer("What is AI?", []))
+
+        self.subject.llm.ainvoke.assert_not_called()
+        self.mock_document_repository.aembed_query.assert_not_called()
+        self.mock_validator.avalidate_remotely.assert_not_called()
+
+    def test_aanswer_retrieves_while_validating(self):
+        async def run():
+            retrieval_started = asyncio.Event()
+
+            async def embed_query(question):
+                retrieval_started.set()
+                return [0.1, 0.2]
+
+            async def validate(question, user_id=None):
+                await asyncio.wait_for(retrieval_started.wait(), timeout=5)
+
+            self.mock_document_repository.aembed_query.side_effect = embed_query
+            self.mock_document_repository.asimilarity_search_by_vector.return_value = []
+            self.mock_validator.avalidate_remotely.side_effect = validate
+            self.subject.llm.ainvoke = AsyncMock(return_value=QuotedAnswer(answer="Answer", citations=[]))
+
+            return await self.subject.aanswer("What is AI?", [])
+
+        self.assertEqual(QuotedAnswer(answer="Answer", citations=[]).to_string(), asyncio.run(run()))
+
+    def test_astream_answer_yields_answer_text_then_complete_answer(self):
+        self.mock_document_repository.aembed_query.return_value = [0.1, 0.2]
+        self.mock_document_repository.asimilarity_search_by_vector.return_value = []
+
+        async def partial_answers(prompt_value, config=None):
+            yield {"answer": "Mary"}
+            yield {"answer": "Mary Shelley", "citations": [{"source_id": 1, "quote": "by Mary"}]}
+
+        self.subject.streaming_llm = Mock()
+        self.subject.streaming_llm.astream = partial_answers
+
+        async def collect():
+            return [event async for event in self.subject.astream_answer("Who wrote Frankenstein?", [],
+                                                                         user_id="user-1")]
+
+        events = asyncio.run(collect())
+
+        self.assertEqual([
+            {"type": "token", "text": "Mary"},
+            {"type": "token", "text": " Shelley"},
+        ], events[:-1])
+        self.assertEqual("answer", events[-1]["type"])
+        self.assertEqual("by Mary", events[-1]["answer"].citations[0].quote)
+        self.mock_validator.avalidate_remotely.assert_awaited_once_with("Who wrote Frankenstein?", user_id="user-1")
@@ -0,0 +1,82 @@
+from unittest import TestCase
+
+from home.domain.citation_resolver import number_sentences, resolve_citations, split_sentences
+from home.domain.compact_answer import CompactAnswer, CompactCitation
+from home.domain.quoted_answer import QuotedAnswer
+
+SOURCE = "The creature is eight feet tall. It learns to read!\n\nIt flees to the Arctic? Victor follows it."
+
+
+class TestCitationResolver(TestCase):
+    def test_split_sentences(self):
+        self.assertEqual(split_sentences(SOURCE), [
+            "The creature is eight feet tall.",
+            "It learns to read!",
+            "It flees to the Arctic?",
+            "Victor follows it.",
+        ])
+
+    def test_split_sentences_breaks_on_paragraphs_and_keeps_the_text_verbatim(self):
+        self.assertEqual(split_sentences("Chapter 1\n\nIt was a dark\nand  stormy night"), [
+            "Chapter 1",
+            "It was a dark\nand  stormy night",
+        ])
+
+    def test_number_sentences_folds_whitespace(self):
+        self.assertEqual(number_sentences("It was a dark\nand  stormy night.  It rained."),
+                         "<1> It was a dark and stormy night. <2> It rained.")
+
+    def test_number_sentences(self):
+        self.assertEqual(
+            number_sentences(SOURCE),
+            "<1> The creature is eight feet tall. <2> It learns to read! <3> It flees to the Arctic? <4> Victor follows it."
+        )
+
+    def test_resolve_citations_copies_the_cited_sentences(self):
+        answer = CompactAnswer(answer="Eight feet.", citations=[
+            CompactCitation(source_id=2, sentence_ids=[1]),
+            CompactCitation(source_id=2, sentence_ids=[3, 2]),
+        ])
+
+        result = resolve_citations(answer, ["Other source.", SOURCE])
+
+        self.assertEqual(result, QuotedAnswer.model_validate({"answer": "Eight feet.", "citations": [
+            {"source_id": 2, "quote": "The creature is eight feet tall."},
+            {"source_id": 2, "quote": "It learns to read!\n\nIt flees to the Arctic?"},
+        ]}))
+
+    def test_resolve_citations_quotes_the_source_verbatim(self):
+        source = "It was a dark\nand  stormy night.\nThe rain fell   in torrents. The wind blew."
+        answer = CompactAnswer(answer="Stormy.", citations=[
+            CompactCitation(source_id=1, sentence_ids=[1, 2]),
+            CompactCitation(source_id=1, sentence_ids=[1, 3]),
+        ])
+
+        result = resolve_citations(answer, [source])
+
+        self.assertEqual([citation.quote for citation in result.citations], [
+            "It was a dark\nand  stormy night.\nThe rain fell   in torrents.",
+            "It was a dark\nand  stormy night. ... The wind blew.",
+        ])
+        self.assertIn(result.citations[0].quote, source)
+
+    def test_resolve_citations_marks_gaps_between_sentences(self):
+        answer = CompactAnswer(answer="Answer", citations=[CompactCitation(source_id=1, sentence_ids=[1, 4])])
+
+        result = resolve_citations(answer, [SOURCE])
+
+        self.assertEqual(result.citations[0].quote, "The creature is eight feet tall. ... Victor follows it.")
+
+    def test_resolve_citations_drops_unknown_sources_and_sentences(self):
+        answer = CompactAnswer(answer="Answer", citations=[
+            CompactCitation(source_id=3, sentence_ids=[1]),
+            CompactCitation(source_id=0, sentence_ids=[1]),
+            CompactCitation(source_id=1, sentence_ids=[9]),
+            CompactCitation(source_id=1, sentence_ids=[9, 2]),
+        ])
+
+        result = resolve_citations(answer, [SOURCE])
+
+        self.assertEqual([(citation.source_id, citation.quote) for citation in result.citations],
+                         [(1, "It learns to read!")])
+        self.assertEqual(result.to_string(), 'Answer\n\n"It learns to read!"')
@@ -0,0 +1,164 @@
+import asyncio
+import threading
+import time
+from typing import Optional
+from unittest import TestCase
+from unittest.mock import AsyncMock, Mock, patch
+
+from home.domain.composite_question_validator import CompositeQuestionValidator
+from home.domain.invalid_question_error import InvalidQuestionError
+from home.domain.max_length_validator import MaxLengthValidator
+from home.domain.question_validator import QuestionValidator
+
+
+class SlowValidator(QuestionValidator):
+    def __init__(self, release: threading.Event):
+        self.release = release
+
+    def validate(self, question: str, user_id: Optional[str] = None) -> None:
+        self.release.wait(timeout=5)
+
+    async def avalidate(self, question: str, user_id: Optional[str] = None) -> None:
+        await asyncio.sleep(5)
+
+
+class MeetingValidator(QuestionValidator):
+    """Passes once every party of the barrier is validating at the same time."""
+
+    def __init__(self, barrier: threading.Barrier):
+        self.barrier = barrier
+
+    def validate(self, question: str, user_id: Optional[str] = None) -> None:
+        self.barrier.wait(timeout=2)
+
+
+class RejectingValidator(QuestionValidator):
+    def validate(self, question: str, user_id: Optional[str] = None) -> None:
+        raise InvalidQuestionError("Rejected")
+
+    async def avalidate(self, question: str, user_id: Optional[str] = None) -> None:
+        raise InvalidQuestionError("Rejected")
+
+
+class TestCompositeQuestionValidator(TestCase):
+    def setUp(self):
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def test_runs_local_validators_first(self):
+        remote_validator = Mock(spec=QuestionValidator)
+        remote_validator.local = False
+
+        subject = CompositeQuestionValidator([remote_validator, MaxLengthValidator(max_length=5)])
+
+        with self.assertRaises(InvalidQuestionError):
+            subject.validate("This question is too long")
+
+        remote_validator.validate.assert_not_called()
+
+    def test_validate_locally_and_remotely_split_the_validators(self):
+        remote_validator = Mock(spec=QuestionValidator)
+        remote_validator.local = False
+        remote_validator.avalidate = AsyncMock()
+
+        subject = CompositeQuestionValidator([remote_validator, MaxLengthValidator(max_length=5)])
+
+        with self.assertRaises(InvalidQuestionError):
+            subject.validate_locally("This question is too long")
+        remote_validator.validate.assert_not_called()
+
+        subject.validate_remotely("This question is too long")
+        asyncio.run(subject.avalidate_remotely("This question is too long"))
+
+        remote_validator.validate.assert_called_once_with("This question is too long", user_id=None)
+        remote_validator.avalidate.assert_awaited_once_with("This question is too long", user_id=None)
+
+    def test_concurrent_validate_fails_without_waiting_for_slow_validators(self):
+        subject = CompositeQuestionValidator([SlowValidator(self.release), RejectingValidator()], concurrent=True)
+
+        t0 = time.perf_counter()
+        with self.assertRaises(InvalidQuestionError):
+            subject.validate("What is AI?")
+
+        self.assertLess(time.perf_counter() - t0, 1)
+
+    def test_concurrent_validate_passes_when_every_validator_passes(self):
+        self.release.set()
+        subject = CompositeQuestionValidator([SlowValidator(self.release), MaxLengthValidator()], concurrent=True)
+
+        subject.validate("What is AI?")
+
+    def test_concurrent_validate_serves_several_callers_at_once(self):
+        callers = 4
+        barrier = threading.Barrier(callers * 2)
+        subject = CompositeQuestionValidator([MeetingValidator(barrier), MeetingValidator(barrier)],
+                                             concurrent=True, max_workers=callers * 2)
+        errors = []
+
+        def ask():
+            try:
+                subject.validate("What is AI?")
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=ask) for _ in range(callers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=5)
+
+        self.assertEqual(errors, [])
+
+    def test_concurrent_validate_runs_a_single_remote_validator_on_the_calling_thread(self):
+        threads = []
+        remote_validator = Mock(spec=QuestionValidator)
+        remote_validator.local = False
+        remote_validator.validate.side_effect = lambda question, user_id=None: threads.append(threading.get_ident())
+
+        subject = CompositeQuestionValidator([remote_validator, MaxLengthValidator()], concurrent=True)
+        subject.validate("What is AI?")
+
+        self.assertIsNone(subject.executor)
+        self.assertEqual(threads, [threading.get_ident()])
+
+    def test_concurrent_avalidate_cancels_slow_validators_on_failure(self):
+        subject = CompositeQuestionValidator([SlowValidator(self.release), RejectingValidator()], concurrent=True)
+
+        t0 = time.perf_counter()
+        with self.assertRaises(InvalidQuestionError):
+            asyncio.run(subject.avalidate("What is AI?"))
+
+        self.assertLess(time.perf_counter() - t0, 1)
+
+    @patch('home.domain.composite_question_validator.record_validator_duration')
+    def test_records_each_validator_duration(self, mock_record_validator_duration):
+        self.release.set()
+        subject = CompositeQuestionValidator([SlowValidator(self.release), MaxLengthValidator()], concurrent=True)
+
+        subject.validate("What is AI?")
+
+        self.assertEqual(
+            {"MaxLengthValidator", "SlowValidator"},
+            {call.args[0] for call in mock_record_validator_duration.call_args_list}
+        )
+
+    def test_avalidate_batch_skips_remote_validators_for_rejected_questions(self):
+        remote_validator = Mock(spec=QuestionValidator)
+        remote_validator.local = False
+        remote_validator.avalidate_batch = AsyncMock(return_value=[None])
+
+        subject = CompositeQuestionValidator([remote_validator, MaxLengthValidator(max_length=12)], concurrent=True)
+
+        failures = asyncio.run(subject.avalidate_batch(["What is AI?", "This question is too long"]))
+
+        self.assertIsNone(failures[0])
+        self.assertIsInstance(failures[1], InvalidQuestionError)
+        remote_validator.avalidate_batch.assert_awaited_once_with(["What is AI?"], user_id=None)
+
+    def test_avalidate_batch_keeps_the_first_failure_of_each_question(self):
+        subject = CompositeQuestionValidator([RejectingValidator(), MaxLengthValidator(max_length=12)])
+
+        failures = asyncio.run(subject.avalidate_batch(["What is AI?", "This question is too long"]))
+
+        self.assertEqual(str(failures[0]), "Rejected")
+        self.assertIn("too long", str(failures[1]))
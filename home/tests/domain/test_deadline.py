@@ -0,0 +1,32 @@
+import asyncio
+from unittest import TestCase
+
+from home.domain.deadline import Deadline, check_deadline, current_deadline, deadline_scope, remaining_timeout
+from home.domain.deadline_exceeded_error import DeadlineExceededError
+
+
+class TestDeadline(TestCase):
+    def test_remaining_timeout_is_none_without_a_deadline(self):
+        self.assertIsNone(remaining_timeout("test"))
+
+    def test_remaining_timeout_is_the_time_left(self):
+        with deadline_scope(Deadline.after(10)):
+            self.assertTrue(9 < remaining_timeout("test") <= 10)
+
+        self.assertIsNone(current_deadline())
+
+    def test_check_deadline_raises_once_the_deadline_has_passed(self):
+        with deadline_scope(Deadline.after(-1)):
+            with self.assertRaises(DeadlineExceededError) as context:
+                check_deadline("retrieve")
+
+        self.assertEqual(context.exception.stage, "retrieve")
+
+    def test_deadline_follows_the_request_into_threads(self):
+        deadline = Deadline.after(10)
+
+        async def run():
+            with deadline_scope(deadline):
+                return await asyncio.to_thread(current_deadline)
+
+        self.assertIs(asyncio.run(run()), deadline)
@@ -4,26 +4,69 @@ from unittest.mock import Mock
 from langchain_core.documents import Document
 
 from home.domain.file_uploader import FileUploader
-from home.tests.test_factory import UPLOAD_FILE_PATH, UPLOAD_OPEN_AI_FILE_METADATA
+from home.domain.invalid_document_error import InvalidDocumentError
+from home.tests.test_factory import UPLOAD_FILE_PATH, UPLOAD_OPEN_AI_FILE_METADATA, UPLOAD_BASE_FILE_METADATA
 
 
 class FileUploaderTest(TestCase):
-    mock_file_metadata_extractor = Mock()
-    mock_document_repository = Mock()
-    subject = FileUploader(
-        file_metadata_extractor=mock_file_metadata_extractor,
-        document_repository=mock_document_repository,
-    )
 
-    def test_file_uploader(self):
-        expected_documents = [Document("some test content")]
+    def setUp(self):
+        self.mock_file_metadata_extractor = Mock()
+        self.mock_base_file_metadata_extractor = Mock()
+        self.mock_document_repository = Mock()
+        self.mock_document_validator = Mock()
+        self.subject = FileUploader(
+            file_metadata_extractor=self.mock_file_metadata_extractor,
+            document_repository=self.mock_document_repository,
+            base_file_metadata_extractor=self.mock_base_file_metadata_extractor,
+            document_validator=self.mock_document_validator,
+        )
 
         self.mock_file_metadata_extractor.extract_metadata.return_value = UPLOAD_OPEN_AI_FILE_METADATA
-        self.mock_document_repository.upload_document.return_value = expected_documents
+        self.mock_base_file_metadata_extractor.extract_metadata.return_value = UPLOAD_BASE_FILE_METADATA
+
+    def test_file_uploader(self):
+        split_documents = [Document("some test content", id="abc#0")]
+        embeddings = [[0.1, 0.2]]
+        documents_with_metadata = [Document("some test content", id="abc#0", metadata={"title": "Frankenstein"})]
+        expected_documents = documents_with_metadata
 
-        documents = self.subject.upload_file(UPLOAD_FILE_PATH)
+        self.mock_document_repository.split_document.return_value = split_documents
+        self.mock_document_repository.embed_documents.return_value = embeddings
+        self.mock_document_repository.update_document_metadata.return_value = documents_with_metadata
+        self.mock_document_repository.add_embedded_documents.return_value = expected_documents
+
+        documents = self.subject.upload_file(UPLOAD_FILE_PATH, user_id="user-1")
 
         self.assertEqual(documents, expected_documents)
 
-        self.mock_file_metadata_extractor.extract_metadata.assert_called_once_with(UPLOAD_FILE_PATH)
-        self.mock_document_repository.upload_document.assert_called_once_with(UPLOAD_FILE_PATH, UPLOAD_OPEN_AI_FILE_METADATA)
\ No newline at end of file
+        self.mock_file_metadata_extractor.extract_metadata.assert_called_once_with(UPLOAD_FILE_PATH, stored_file=None)
+        self.mock_base_file_metadata_extractor.extract_metadata.assert_called_once_with(UPLOAD_FILE_PATH,
+                                                                                        stored_file=None)
+        self.mock_document_repository.split_document.assert_called_once_with(UPLOAD_FILE_PATH,
+                                                                             UPLOAD_BASE_FILE_METADATA)
+        self.mock_document_validator.validate_documents.assert_called_once_with(split_documents, user_id="user-1")
+        self.mock_document_repository.embed_documents.assert_called_once_with(split_documents)
+        self.mock_document_repository.update_document_metadata.assert_called_once_with(split_documents,
+                                                                                       UPLOAD_OPEN_AI_FILE_METADATA)
+        self.mock_document_repository.add_embedded_documents.assert_called_once_with(documents_with_metadata,
+                                                                                     embeddings)
+
+    def test_file_uploader_adds_nothing_when_the_metadata_extraction_fails(self):
+        self.mock_document_repository.split_document.return_value = [Document("some test content", id="abc#0")]
+        self.mock_file_metadata_extractor.extract_metadata.side_effect = RuntimeError("OpenAI is down")
+
+        with self.assertRaises(RuntimeError):
+            self.subject.upload_file(UPLOAD_FILE_PATH)
+
+        self.mock_document_repository.add_embedded_documents.assert_not_called()
+
+    def test_file_uploader_does_not_embed_rejected_documents(self):
+        self.mock_document_repository.split_document.return_value = [Document("some flagged content")]
+        self.mock_document_validator.validate_documents.side_effect = InvalidDocumentError("Flagged")
+
+        with self.assertRaises(InvalidDocumentError):
+            self.subject.upload_file(UPLOAD_FILE_PATH)
+
+        self.mock_document_repository.embed_documents.assert_not_called()
+        self.mock_document_repository.add_embedded_documents.assert_not_called()
@@ -0,0 +1,63 @@
+from unittest import TestCase
+
+from home.domain.model_router import FAST, STRONG, ModelRoute, ModelRouter
+
+
+class TestModelRouter(TestCase):
+    def setUp(self):
+        self.subject = ModelRouter(fast_model="small", strong_model="large", long_question_chars=50,
+                                   many_sources=4, flat_score_spread=0.05)
+
+    def test_route_sends_easy_questions_to_the_fast_tier(self):
+        route = self.subject.route("Who wrote it?", [0.9, 0.7], 2)
+
+        self.assertEqual(route, ModelRoute(FAST, "small", ()))
+
+    def test_route_needs_two_signals_for_the_strong_tier(self):
+        long_question = "Why " * 20
+
+        self.assertEqual(self.subject.route(long_question, [0.9, 0.7], 2).tier, FAST)
+        self.assertEqual(
+            self.subject.route(long_question, [0.81, 0.8], 6),
+            ModelRoute(STRONG, "large", ("long_question", "many_sources", "flat_scores"))
+        )
+
+    def test_route_sends_questions_that_were_difficult_before_to_the_strong_tier(self):
+        self.subject.record_outcome("Who wrote it?", ModelRoute(FAST, "small"), fell_back=False, num_citations=0)
+
+        route = self.subject.route("who wrote it", [0.9, 0.7], 2)
+
+        self.assertEqual(route, ModelRoute(STRONG, "large", ("past_difficulty",)))
+
+    def test_record_outcome_ignores_cited_answers_of_the_fast_tier(self):
+        self.subject.record_outcome("Who wrote it?", ModelRoute(FAST, "small"), fell_back=False, num_citations=2)
+
+        self.assertEqual(self.subject.past_difficulty("Who wrote it?"), 0)
+
+    def test_record_outcome_counts_fallbacks(self):
+        self.subject.record_outcome("Who wrote it?", ModelRoute(STRONG, "large"), fell_back=True, num_citations=2)
+
+        self.assertEqual(self.subject.past_difficulty("Who wrote it?"), 1)
+
+    def test_record_outcome_forgets_the_oldest_questions(self):
+        subject = ModelRouter(fast_model="small", strong_model="large", max_tracked_questions=1)
+        subject.record_outcome("first", ModelRoute(FAST, "small"), fell_back=True, num_citations=0)
+        subject.record_outcome("second", ModelRoute(FAST, "small"), fell_back=True, num_citations=0)
+
+        self.assertEqual(subject.past_difficulty("first"), 0)
+        self.assertEqual(subject.past_difficulty("second"), 1)
+
+    def test_fallback_switches_tier(self):
+        self.assertEqual(self.subject.fallback(ModelRoute(FAST, "small", ("a",))),
+                         ModelRoute(STRONG, "large", ("a", "fallback")))
+        self.assertEqual(self.subject.fallback(ModelRoute(STRONG, "large")),
+                         ModelRoute(FAST, "small", ("fallback",)))
+
+    def test_a_single_model_has_no_strong_tier_nor_fallback(self):
+        subject = ModelRouter(fast_model="small", strong_model="small", long_question_chars=5)
+        subject.record_outcome("Who wrote it?", ModelRoute(FAST, "small"), fell_back=False, num_citations=0)
+
+        route = subject.route("Who wrote it?", [], 10)
+
+        self.assertEqual(route.tier, FAST)
+        self.assertIsNone(subject.fallback(route))
@@ -0,0 +1,60 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+from openai.types.completion_usage import CompletionUsage, PromptTokensDetails
+
+from home.domain.token_usage import TokenUsage, current_usage, estimate_cost_usd, record_usage, usage_from_metadata, \
+    usage_from_openai, usage_scope
+
+
+class TestTokenUsage(TestCase):
+    def test_estimate_cost_usd(self):
+        self.assertAlmostEqual(estimate_cost_usd("gpt-4o-mini", {"prompt": 1_000_000, "completion": 100_000}), 0.21)
+        self.assertIsNone(estimate_cost_usd("unknown", {"prompt": 10, "completion": 10}))
+        self.assertIsNone(estimate_cost_usd("gpt-4o-mini", None))
+
+    def test_estimate_cost_usd_bills_cached_prompt_tokens_at_the_cached_price(self):
+        tokens = {"prompt": 1_000_000, "cached": 1_000_000, "completion": 0}
+
+        self.assertAlmostEqual(estimate_cost_usd("gpt-4o-mini", tokens), 0.075)
+
+    def test_usage_from_metadata(self):
+        usage = usage_from_metadata({"input_tokens": 1200, "output_tokens": 80, "total_tokens": 1280,
+                                     "input_token_details": {"audio": 0, "cache_read": 1024}})
+
+        self.assertEqual(usage, TokenUsage(prompt=1200, completion=80, cached=1024))
+        self.assertEqual(usage.total, 1280)
+
+    def test_usage_from_openai(self):
+        usage = usage_from_openai(CompletionUsage(prompt_tokens=1200, completion_tokens=80, total_tokens=1280,
+                                                  prompt_tokens_details=PromptTokensDetails(cached_tokens=1024)))
+
+        self.assertEqual(usage, TokenUsage(prompt=1200, completion=80, cached=1024))
+        self.assertIsNone(usage_from_openai(None))
+
+    @patch('home.domain.token_usage.record_token_usage')
+    def test_record_usage_adds_to_the_current_ledgers(self, mock_record_token_usage):
+        with usage_scope("session") as request_usage:
+            with usage_scope() as question_usage:
+                cost_usd = record_usage("generate", "gpt-4o-mini", TokenUsage(prompt=1_000_000))
+            record_usage("query_embedding", "text-embedding-3-small", TokenUsage(prompt=1_000_000))
+
+        self.assertAlmostEqual(cost_usd, 0.15)
+        self.assertEqual(question_usage.as_dict(), {
+            "tokens": {"generate": {"prompt": 1_000_000, "completion": 0, "cached": 0, "total": 1_000_000}},
+            "cost_usd": 0.15,
+        })
+        self.assertEqual(set(request_usage.by_stage), {"generate", "query_embedding"})
+        self.assertAlmostEqual(request_usage.cost_usd, 0.17)
+        self.assertIsNone(current_usage())
+        mock_record_token_usage.assert_called_with(
+            "query_embedding", "text-embedding-3-small",
+            {"prompt": 1_000_000, "completion": 0, "cached": 0, "total": 1_000_000}, 0.02, user_id="session"
+        )
+
+    @patch('home.domain.token_usage.record_token_usage')
+    def test_record_usage_without_a_ledger_is_still_exported(self, mock_record_token_usage):
+        record_usage("conversation_summary", "gpt-4o-mini", TokenUsage(prompt=10, completion=5))
+
+        mock_record_token_usage.assert_called_once()
+        self.assertIsNone(mock_record_token_usage.call_args.kwargs["user_id"])
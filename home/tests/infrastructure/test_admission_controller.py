@@ -0,0 +1,113 @@
+import asyncio
+import threading
+from unittest import TestCase
+
+from home.domain.deadline import Deadline, deadline_scope
+from home.domain.overloaded_error import OverloadedError
+from home.infrastructure.admission_controller import AdmissionController
+
+
+class TestAdmissionController(TestCase):
+    def test_admit_runs_calls_under_the_limit_at_once(self):
+        subject = AdmissionController("test", max_concurrent=2, max_queue=0, max_wait_seconds=1)
+
+        with subject.admit():
+            with subject.admit():
+                self.assertEqual(subject.in_flight, 2)
+
+        self.assertEqual(subject.in_flight, 0)
+
+    def test_admit_rejects_at_once_when_the_queue_is_full(self):
+        subject = AdmissionController("test", max_concurrent=1, max_queue=0, max_wait_seconds=5)
+
+        with subject.admit():
+            with self.assertRaises(OverloadedError) as context:
+                with subject.admit():
+                    pass
+
+        self.assertEqual(context.exception.reason, "queue_full")
+        self.assertGreaterEqual(context.exception.retry_after_seconds, 1)
+
+    def test_admit_rejects_after_waiting_too_long(self):
+        subject = AdmissionController("test", max_concurrent=1, max_queue=1, max_wait_seconds=0.05)
+
+        with subject.admit():
+            with self.assertRaises(OverloadedError) as context:
+                with subject.admit():
+                    pass
+
+        self.assertEqual(context.exception.reason, "wait_timeout")
+        self.assertEqual(len(subject.waiters), 0)
+
+    def test_admit_waits_no_longer_than_the_deadline(self):
+        subject = AdmissionController("test", max_concurrent=1, max_queue=1, max_wait_seconds=60)
+
+        with subject.admit():
+            with deadline_scope(Deadline.after(0.05)):
+                with self.assertRaises(OverloadedError):
+                    with subject.admit():
+                        pass
+
+    def test_admit_hands_a_released_slot_to_the_waiting_call(self):
+        subject = AdmissionController("test", max_concurrent=1, max_queue=1, max_wait_seconds=5)
+        admitted = []
+        release = threading.Event()
+
+        def hold():
+            with subject.admit():
+                release.wait(5)
+
+        def wait():
+            with subject.admit():
+                admitted.append(subject.in_flight)
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        while subject.in_flight == 0:
+            release.wait(0.001)
+        waiter = threading.Thread(target=wait)
+        waiter.start()
+        while not subject.waiters:
+            release.wait(0.001)
+        release.set()
+        holder.join()
+        waiter.join()
+
+        self.assertEqual(admitted, [1])
+        self.assertEqual(subject.in_flight, 0)
+
+    def test_aadmit_queues_tasks_in_order(self):
+        subject = AdmissionController("test", max_concurrent=1, max_queue=2, max_wait_seconds=5)
+        order = []
+
+        async def task(name):
+            async with subject.aadmit():
+                order.append(name)
+                await asyncio.sleep(0.01)
+
+        async def run():
+            await asyncio.gather(task("first"), task("second"), task("third"))
+
+        asyncio.run(run())
+
+        self.assertEqual(order, ["first", "second", "third"])
+        self.assertEqual(subject.in_flight, 0)
+
+    def test_aadmit_gives_up_the_queue_place_of_a_cancelled_task(self):
+        subject = AdmissionController("test", max_concurrent=1, max_queue=1, max_wait_seconds=5)
+
+        async def wait():
+            async with subject.aadmit():
+                pass
+
+        async def run():
+            async with subject.aadmit():
+                waiter = asyncio.create_task(wait())
+                await asyncio.sleep(0.01)
+                waiter.cancel()
+                await asyncio.gather(waiter, return_exceptions=True)
+                self.assertEqual(len(subject.waiters), 0)
+
+        asyncio.run(run())
+
+        self.assertEqual(subject.in_flight, 0)
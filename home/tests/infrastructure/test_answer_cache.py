@@ -0,0 +1,36 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+from home.domain.quoted_answer import QuotedAnswer
+from home.infrastructure.answer_cache import AnswerCache
+
+
+class TestAnswerCache(TestCase):
+    def setUp(self):
+        self.subject = AnswerCache(max_size=2, ttl_seconds=60)
+        self.answer = QuotedAnswer(answer="Answer", citations=[])
+
+    def test_get_returns_stored_answer(self):
+        self.subject.set("key", self.answer)
+
+        self.assertEqual(self.answer, self.subject.get("key"))
+        self.assertIsNone(self.subject.get("other"))
+
+    def test_evicts_least_recently_used(self):
+        self.subject.set("a", self.answer)
+        self.subject.set("b", self.answer)
+        self.subject.get("a")
+        self.subject.set("c", self.answer)
+
+        self.assertIsNotNone(self.subject.get("a"))
+        self.assertIsNone(self.subject.get("b"))
+        self.assertIsNotNone(self.subject.get("c"))
+
+    @patch('home.infrastructure.answer_cache.time.time')
+    def test_expires_after_ttl(self, mock_time):
+        mock_time.return_value = 1000
+        self.subject.set("key", self.answer)
+
+        mock_time.return_value = 1061
+
+        self.assertIsNone(self.subject.get("key"))
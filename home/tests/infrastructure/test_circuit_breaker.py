@@ -0,0 +1,121 @@
+import asyncio
+import time
+from unittest import TestCase
+from unittest.mock import Mock
+
+from home.domain.deadline import Deadline, deadline_scope
+from home.domain.deadline_exceeded_error import DeadlineExceededError
+from home.domain.dependency_unavailable_error import DependencyUnavailableError
+from home.infrastructure.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+
+class TestCircuitBreaker(TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.subject = CircuitBreaker("test", failure_threshold=2, recovery_seconds=30, clock=lambda: self.now)
+
+    def _fail(self):
+        with self.assertRaises(ConnectionError):
+            self.subject.call(Mock(side_effect=ConnectionError("down")))
+
+    def test_call_returns_the_result(self):
+        self.assertEqual(self.subject.call(lambda: 42), 42)
+        self.assertEqual(self.subject.state, CLOSED)
+
+    def test_opens_after_consecutive_failures(self):
+        self._fail()
+        self.assertEqual(self.subject.state, CLOSED)
+        self._fail()
+        self.assertEqual(self.subject.state, OPEN)
+
+        fn = Mock()
+        with self.assertRaises(DependencyUnavailableError) as raised:
+            self.subject.call(fn)
+        fn.assert_not_called()
+        self.assertEqual(raised.exception.dependency, "test")
+
+    def test_a_success_resets_the_failure_count(self):
+        self._fail()
+        self.subject.call(lambda: 42)
+        self._fail()
+
+        self.assertEqual(self.subject.state, CLOSED)
+
+    def test_a_successful_probe_closes_the_circuit(self):
+        self._fail()
+        self._fail()
+        self.now = 30
+
+        self.assertEqual(self.subject.call(lambda: 42), 42)
+        self.assertEqual(self.subject.state, CLOSED)
+
+    def test_a_failed_probe_reopens_the_circuit(self):
+        self._fail()
+        self._fail()
+        self.now = 30
+        self._fail()
+
+        self.assertEqual(self.subject.state, OPEN)
+        self.now = 59
+        with self.assertRaises(DependencyUnavailableError):
+            self.subject.call(lambda: 42)
+
+    def test_only_one_probe_runs_while_half_open(self):
+        self._fail()
+        self._fail()
+        self.now = 30
+        self.subject.before_call()
+
+        self.assertEqual(self.subject.state, HALF_OPEN)
+        with self.assertRaises(DependencyUnavailableError):
+            self.subject.call(lambda: 42)
+
+        # A probe abandoned without an outcome doesn't keep the circuit half open forever
+        self.now = 60
+        self.assertEqual(self.subject.call(lambda: 42), 42)
+
+    def test_errors_of_the_caller_are_not_failures(self):
+        subject = CircuitBreaker("test", failure_threshold=2, caller_errors=(PermissionError,))
+
+        for _ in range(2):
+            with self.assertRaises(PermissionError):
+                subject.call(Mock(side_effect=PermissionError("over quota")))
+
+        self.assertEqual(subject.state, CLOSED)
+        self.assertEqual(subject.failures, 0)
+
+    def test_errors_of_calls_started_past_the_deadline_are_not_failures(self):
+        for _ in range(2):
+            with deadline_scope(Deadline.after(-1)):
+                with self.assertRaises(DeadlineExceededError):
+                    self.subject.call(Mock(side_effect=DeadlineExceededError("generate")))
+                with self.assertRaises(ConnectionError):
+                    self.subject.call(Mock(side_effect=ConnectionError("timed out")))
+
+        self.assertEqual(self.subject.state, CLOSED)
+        self.assertEqual(self.subject.failures, 0)
+
+    def test_a_hung_dependency_opens_the_circuit(self):
+        def hang():
+            time.sleep(0.02)
+            raise DeadlineExceededError("generate")
+
+        for _ in range(2):
+            with deadline_scope(Deadline.after(0.01)), self.assertRaises(DeadlineExceededError):
+                self.subject.call(hang)
+
+        self.assertEqual(self.subject.state, OPEN)
+
+    def test_acall(self):
+        async def fail():
+            raise ConnectionError("down")
+
+        async def run():
+            for _ in range(2):
+                with self.assertRaises(ConnectionError):
+                    await self.subject.acall(fail)
+            with self.assertRaises(DependencyUnavailableError):
+                await self.subject.acall(fail)
+
+        asyncio.run(run())
+        self.assertEqual(self.subject.state, OPEN)
@@ -0,0 +1,101 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+from langchain_core.documents import Document
+
+from home.infrastructure.context_packer import ContextPacker, SOURCE_OVERHEAD_TOKENS
+
+
+def count_words(text: str) -> int:
+    return len(text.split())
+
+
+def chunk(index: int, text: str, content_hash: str = "hash") -> Document:
+    return Document(
+        id=f"{content_hash}#{index}",
+        page_content=text,
+        metadata={"content_hash": content_hash, "chunk_index": index},
+    )
+
+
+class TestContextPacker(TestCase):
+    def test_pack_keeps_every_source_within_budget(self):
+        subject = ContextPacker("gpt-4o-mini", max_tokens=1000, count_tokens=count_words)
+        existing = [Document(id="a#0", page_content="alpha beta"), Document(id="b#0", page_content="gamma")]
+        new = [chunk(0, "delta epsilon")]
+
+        context = subject.pack(existing, new, "What is alpha?")
+
+        self.assertEqual([source.text for source in context.existing_sources], ["alpha beta", "gamma"])
+        self.assertEqual([source.text for source in context.new_sources], ["delta epsilon"])
+        self.assertEqual(context.num_dropped, 0)
+        self.assertEqual(context.num_tokens, 5 + 3 * SOURCE_OVERHEAD_TOKENS)
+
+    def test_pack_drops_what_does_not_fit_keeping_retrieval_order_first(self):
+        subject = ContextPacker("gpt-4o-mini", max_tokens=2 * (SOURCE_OVERHEAD_TOKENS + 2), count_tokens=count_words)
+        existing = [Document(id="a#0", page_content="one two"), Document(id="b#0", page_content="three four")]
+        new = [chunk(0, "five six")]
+
+        context = subject.pack(existing, new, "question")
+
+        self.assertEqual([source.text for source in context.existing_sources], ["one two", "three four"])
+        self.assertEqual(context.new_sources, [])
+        self.assertEqual(context.num_dropped, 1)
+
+    def test_pack_prefers_new_document_chunks_matching_the_question(self):
+        subject = ContextPacker("gpt-4o-mini", max_tokens=2 * (SOURCE_OVERHEAD_TOKENS + 3), count_tokens=count_words)
+        new = [
+            chunk(0, "unrelated opening words"),
+            chunk(5, "the monster speaks"),
+            chunk(9, "creature monster glacier"),
+        ]
+
+        context = subject.pack([], new, "Where does the monster meet the creature?")
+
+        self.assertEqual([source.document.id for source in context.new_sources], ["hash#5", "hash#9"])
+
+    def test_pack_shows_new_document_chunks_in_document_order(self):
+        subject = ContextPacker("gpt-4o-mini", max_tokens=1000, count_tokens=count_words)
+        new = [chunk(0, "opening"), chunk(7, "monster")]
+
+        context = subject.pack([], new, "monster")
+
+        self.assertEqual([source.document.id for source in context.new_sources], ["hash#0", "hash#7"])
+
+    def test_pack_skips_new_document_chunks_already_retrieved(self):
+        subject = ContextPacker("gpt-4o-mini", max_tokens=1000, count_tokens=count_words)
+        retrieved = chunk(3, "already retrieved")
+
+        context = subject.pack([retrieved], [chunk(2, "other"), chunk(3, "already retrieved")], "question")
+
+        self.assertEqual([source.document.id for source in context.sources], ["hash#3", "hash#2"])
+
+    def test_pack_removes_the_overlap_with_the_previous_chunk(self):
+        subject = ContextPacker("gpt-4o-mini", max_tokens=1000, count_tokens=count_words)
+        overlap = "shared words carried over by the splitter"
+        new = [chunk(0, f"First chunk ends with {overlap}"), chunk(1, f"{overlap} and the second chunk goes on")]
+
+        context = subject.pack([], new, "question")
+
+        self.assertEqual(
+            [source.text for source in context.new_sources],
+            [f"First chunk ends with {overlap}", "and the second chunk goes on"]
+        )
+
+    def test_pack_keeps_chunks_of_different_documents_untouched(self):
+        subject = ContextPacker("gpt-4o-mini", max_tokens=1000, count_tokens=count_words)
+        overlap = "shared words carried over by the splitter"
+        new = [chunk(0, f"ends with {overlap}", "first"), chunk(1, f"{overlap} goes on", "second")]
+
+        context = subject.pack([], new, "question")
+
+        self.assertEqual([source.text for source in context.new_sources], [f"ends with {overlap}", f"{overlap} goes on"])
+
+    @patch('home.infrastructure.context_packer.token_counter')
+    def test_count_tokens_loads_the_model_encoding_lazily(self, mock_token_counter):
+        mock_token_counter.return_value = lambda text: 42
+        subject = ContextPacker("gpt-4o-mini", max_tokens=1000)
+
+        mock_token_counter.assert_not_called()
+        self.assertEqual(subject.count_tokens("anything"), 42)
+        mock_token_counter.assert_called_once_with("gpt-4o-mini")
@@ -0,0 +1,89 @@
+from unittest import TestCase
+from unittest.mock import Mock
+
+from home.domain.deadline import current_deadline
+from home.domain.token_usage import current_session
+from home.infrastructure.conversation_memory import ConversationMemory
+
+
+def count_words(text: str) -> int:
+    return len(text.split())
+
+
+class TestConversationMemory(TestCase):
+    def setUp(self):
+        self.summarize = Mock(return_value="They talked about Frankenstein.")
+        self.subject = ConversationMemory(self.summarize, count_words, max_turns=2, max_tokens=100,
+                                          max_sessions=10)
+
+    def _wait_for_summaries(self):
+        # One worker, so this runs after the summaries submitted before it
+        self.subject.executor.submit(lambda: None).result()
+
+    def test_history_is_empty_for_a_new_or_anonymous_session(self):
+        self.subject.add_turn(None, "Who wrote it?", "Mary Shelley.")
+
+        self.assertEqual(self.subject.history("session"), "")
+        self.assertEqual(self.subject.history(None), "")
+
+    def test_history_keeps_the_last_turns_verbatim(self):
+        self.subject.add_turn("session", "Who wrote Frankenstein?", "Mary Shelley.")
+        self.subject.add_turn("session", "When?", "In 1818.")
+
+        self.assertEqual(self.subject.history("session"),
+                         "User: Who wrote Frankenstein?\nAssistant: Mary Shelley.\n\nUser: When?\nAssistant: In 1818.")
+        self.summarize.assert_not_called()
+
+    def test_older_turns_are_folded_into_the_summary(self):
+        self.subject.add_turn("session", "Who wrote Frankenstein?", "Mary Shelley.")
+        self.subject.add_turn("session", "When?", "In 1818.")
+        self.subject.add_turn("session", "Where?", "In London.")
+        self._wait_for_summaries()
+
+        self.assertEqual(self.subject.history("session"),
+                         "Summary of the earlier conversation: They talked about Frankenstein.\n\n"
+                         "User: When?\nAssistant: In 1818.\n\nUser: Where?\nAssistant: In London.")
+        summary, turns = self.summarize.call_args.args
+        self.assertEqual(summary, "")
+        self.assertEqual([turn.question for turn in turns], ["Who wrote Frankenstein?"])
+
+    def test_summary_is_accounted_to_the_session_within_its_own_deadline(self):
+        seen = []
+        self.summarize.side_effect = lambda summary, turns: seen.append(
+            (current_session(), current_deadline())) or "They talked about Frankenstein."
+
+        for question in ["Who wrote Frankenstein?", "When?", "Where?"]:
+            self.subject.add_turn("session", question, "Mary Shelley.")
+        self._wait_for_summaries()
+
+        [(session_id, deadline)] = seen
+        self.assertEqual(session_id, "session")
+        self.assertTrue(0 < deadline.remaining() <= self.subject.summary_deadline_seconds)
+
+    def test_history_stays_within_the_token_cap(self):
+        for i in range(10):
+            self.subject.add_turn("session", f"Question {i}?", " ".join(["word"] * 60))
+        self._wait_for_summaries()
+
+        history = self.subject.history("session")
+
+        self.assertLessEqual(count_words(history), 100)
+        self.assertIn("Question 9?", history)
+        self.assertNotIn("Question 8?", history)
+
+    def test_turns_are_kept_when_the_summary_fails(self):
+        self.summarize.side_effect = ValueError("server error")
+        self.subject.add_turn("session", "Who wrote Frankenstein?", "Mary Shelley.")
+        self.subject.add_turn("session", "When?", "In 1818.")
+        self.subject.add_turn("session", "Where?", "In London.")
+        self._wait_for_summaries()
+
+        self.assertEqual(self.subject.history("session"),
+                         "User: When?\nAssistant: In 1818.\n\nUser: Where?\nAssistant: In London.")
+
+    def test_least_recently_used_sessions_are_forgotten(self):
+        for i in range(11):
+            self.subject.add_turn(f"session {i}", "Who wrote it?", "Mary Shelley.")
+
+        self.assertEqual(self.subject.history("session 0"), "")
+        self.assertNotEqual(self.subject.history("session 10"), "")
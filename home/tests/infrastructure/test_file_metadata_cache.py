@@ -0,0 +1,28 @@
+import tempfile
+from unittest import TestCase
+
+from home.infrastructure.file_metadata_cache import FileMetadataCache
+from home.tests.test_factory import OPENAI_FILE_METADATA_JSON
+
+
+class TestFileMetadataCache(TestCase):
+
+    def setUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        self.subject = FileMetadataCache(cache_dir.name)
+
+    def test_get_returns_none_when_missing(self):
+        self.assertIsNone(self.subject.get("abc", "v1", "gpt-4o-mini"))
+
+    def test_set_then_get(self):
+        self.subject.set("abc", "v1", "gpt-4o-mini", OPENAI_FILE_METADATA_JSON)
+
+        self.assertEqual(OPENAI_FILE_METADATA_JSON, self.subject.get("abc", "v1", "gpt-4o-mini"))
+
+    def test_entries_are_keyed_by_prompt_version_and_model(self):
+        self.subject.set("abc", "v1", "gpt-4o-mini", OPENAI_FILE_METADATA_JSON)
+
+        self.assertIsNone(self.subject.get("abc", "v2", "gpt-4o-mini"))
+        self.assertIsNone(self.subject.get("abc", "v1", "gpt-4o"))
+        self.assertIsNone(self.subject.get("def", "v1", "gpt-4o-mini"))
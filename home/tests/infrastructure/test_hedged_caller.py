@@ -0,0 +1,172 @@
+import asyncio
+import threading
+from unittest import TestCase
+from unittest.mock import Mock
+
+from home.domain.deadline import Deadline, deadline_scope
+from home.domain.deadline_exceeded_error import DeadlineExceededError
+from home.infrastructure.hedged_caller import HedgedCaller, HedgingPolicy, RetryPolicy
+
+NO_BACKOFF = RetryPolicy(max_retries=2, base_delay_ms=0, max_delay_ms=0, budget_ratio=0.1)
+
+
+class TestHedgedCaller(TestCase):
+    def test_call_returns_the_result(self):
+        subject = HedgedCaller("test", HedgingPolicy(initial_delay_ms=1000), NO_BACKOFF)
+
+        self.assertEqual(subject.call(lambda: 42), 42)
+
+    def test_call_fires_a_hedge_when_the_first_call_is_slow(self):
+        subject = HedgedCaller("test", HedgingPolicy(initial_delay_ms=10, budget_ratio=0.1), NO_BACKOFF)
+        release_first = threading.Event()
+        calls = []
+
+        def fn():
+            calls.append(len(calls))
+            if len(calls) == 1:
+                release_first.wait(5)
+                return "slow"
+            return "hedge"
+
+        try:
+            self.assertEqual(subject.call(fn), "hedge")
+        finally:
+            release_first.set()
+        self.assertEqual(len(calls), 2)
+
+    def test_call_does_not_hedge_over_budget(self):
+        subject = HedgedCaller("test", HedgingPolicy(initial_delay_ms=10, budget_ratio=0.0), NO_BACKOFF)
+        subject.hedge_budget.tokens = 0
+        fn = Mock(side_effect=lambda: threading.Event().wait(0.05) or "slow")
+
+        self.assertEqual(subject.call(fn), "slow")
+        fn.assert_called_once()
+
+    def test_call_retries_transient_errors(self):
+        subject = HedgedCaller("test", retry=NO_BACKOFF)
+        fn = Mock(side_effect=[TimeoutError("slow"), ConnectionError("reset"), "ok"])
+
+        self.assertEqual(subject.call(fn), "ok")
+        self.assertEqual(fn.call_count, 3)
+
+    def test_call_gives_up_after_max_retries(self):
+        subject = HedgedCaller("test", retry=NO_BACKOFF)
+        fn = Mock(side_effect=TimeoutError("slow"))
+
+        with self.assertRaises(TimeoutError):
+            subject.call(fn)
+        self.assertEqual(fn.call_count, 3)
+
+    def test_call_does_not_retry_other_errors(self):
+        subject = HedgedCaller("test", retry=NO_BACKOFF)
+        fn = Mock(side_effect=ValueError("bad request"))
+
+        with self.assertRaises(ValueError):
+            subject.call(fn)
+        fn.assert_called_once()
+
+    def test_call_does_not_retry_over_budget(self):
+        subject = HedgedCaller("test", retry=NO_BACKOFF)
+        subject.retry_budget.tokens = 0
+        fn = Mock(side_effect=TimeoutError("slow"))
+
+        with self.assertRaises(TimeoutError):
+            subject.call(fn)
+        fn.assert_called_once()
+
+    def test_call_is_not_made_once_the_deadline_has_passed(self):
+        subject = HedgedCaller("test", retry=NO_BACKOFF)
+        fn = Mock(return_value="ok")
+
+        with deadline_scope(Deadline.after(-1)):
+            with self.assertRaises(DeadlineExceededError):
+                subject.call(fn)
+        fn.assert_not_called()
+
+    def test_call_does_not_retry_when_the_backoff_would_outlast_the_deadline(self):
+        subject = HedgedCaller("test", retry=RetryPolicy(max_retries=2, base_delay_ms=60000, max_delay_ms=60000,
+                                                         budget_ratio=0.1))
+        subject._backoff_seconds = Mock(return_value=60.0)
+        fn = Mock(side_effect=TimeoutError("slow"))
+
+        with deadline_scope(Deadline.after(5)):
+            with self.assertRaises(TimeoutError):
+                subject.call(fn)
+        fn.assert_called_once()
+
+    def test_call_stops_waiting_for_a_slow_call_at_the_deadline(self):
+        subject = HedgedCaller("test", HedgingPolicy(initial_delay_ms=1000, budget_ratio=0.0), NO_BACKOFF)
+        release = threading.Event()
+
+        try:
+            with deadline_scope(Deadline.after(0.05)):
+                with self.assertRaises(DeadlineExceededError):
+                    subject.call(lambda: release.wait(5))
+        finally:
+            release.set()
+
+    def test_acall_cancels_the_call_at_the_deadline(self):
+        subject = HedgedCaller("test", retry=NO_BACKOFF)
+        cancelled = []
+
+        async def fn():
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        async def run():
+            with deadline_scope(Deadline.after(0.05)):
+                await subject.acall(fn)
+
+        with self.assertRaises(DeadlineExceededError):
+            asyncio.run(run())
+        self.assertEqual(cancelled, [True])
+
+    def test_hedge_delay_follows_the_latency_percentile(self):
+        subject = HedgedCaller("test", HedgingPolicy(percentile=90, initial_delay_ms=1000, min_delay_ms=1,
+                                                     max_delay_ms=500, min_samples=10))
+        self.assertEqual(subject.hedge_delay_ms(), 1000)
+
+        subject.latencies_ms.extend(range(1, 101))
+        self.assertEqual(subject.hedge_delay_ms(), 91)
+
+        subject.latencies_ms.extend([1000] * 100)
+        self.assertEqual(subject.hedge_delay_ms(), 500)
+
+    def test_acall_cancels_the_slow_call_when_the_hedge_wins(self):
+        subject = HedgedCaller("test", HedgingPolicy(initial_delay_ms=10, budget_ratio=0.1), NO_BACKOFF)
+        cancelled = []
+
+        async def run():
+            calls = []
+
+            async def fn():
+                calls.append(len(calls))
+                if len(calls) == 1:
+                    try:
+                        await asyncio.Event().wait()
+                    except asyncio.CancelledError:
+                        cancelled.append(True)
+                        raise
+                return "hedge"
+
+            result = await subject.acall(fn)
+            await asyncio.sleep(0)
+            return result
+
+        self.assertEqual(asyncio.run(run()), "hedge")
+        self.assertEqual(cancelled, [True])
+
+    def test_acall_retries_transient_errors(self):
+        subject = HedgedCaller("test", retry=NO_BACKOFF)
+        results = iter([TimeoutError("slow"), "ok"])
+
+        async def fn():
+            result = next(results)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        self.assertEqual(asyncio.run(subject.acall(fn)), "ok")
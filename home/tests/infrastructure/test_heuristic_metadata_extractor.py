@@ -0,0 +1,76 @@
+import os
+import tempfile
+from datetime import datetime
+from unittest import TestCase
+
+from home.infrastructure.heuristic_metadata_extractor import HeuristicMetadataExtractor
+from home.tests.test_factory import UPLOAD_FILE_PATH, UPLOAD_TUTORIAL_FILE_PATH, UPLOAD_EMPTY_FILE_PATH
+
+
+class TestHeuristicMetadataExtractor(TestCase):
+    subject = HeuristicMetadataExtractor()
+
+    def _write_file(self, content: str, suffix: str = ".md") -> str:
+        file = tempfile.NamedTemporaryFile('w', suffix=suffix, encoding='utf-8', delete=False)
+        file.write(content)
+        file.close()
+        self.addCleanup(os.unlink, file.name)
+        return file.name
+
+    def test_gutenberg_header(self):
+        actual = self.subject.try_extract_metadata(UPLOAD_FILE_PATH)
+
+        self.assertEqual("Frankenstein; Or, The Modern Prometheus", actual.title)
+        self.assertEqual(["Mary Wollstonecraft Shelley"], actual.authors)
+        self.assertEqual("english", actual.language)
+        self.assertEqual("Project Gutenberg", actual.publisher)
+        self.assertEqual(datetime(1993, 10, 1), actual.published_date)
+        self.assertIsNone(actual.abstract)
+
+    def test_markdown_labelled_header(self):
+        actual = self.subject.try_extract_metadata(UPLOAD_TUTORIAL_FILE_PATH)
+
+        self.assertEqual("Introduction to Machine Learning", actual.title)
+        self.assertEqual(["Sarah Johnson"], actual.authors)
+        self.assertEqual(datetime(2024, 3, 15), actual.published_date)
+        self.assertEqual(2024, actual.publication_year)
+        self.assertEqual("english", actual.language)
+        self.assertEqual(["machine learning", "neural networks", "deep learning", "AI fundamentals"], actual.keywords)
+
+    def test_front_matter(self):
+        file_path = self._write_file(
+            "---\n"
+            "title: Gardening Basics\n"
+            "authors:\n"
+            "  - Jane Doe\n"
+            "  - John Smith\n"
+            "date: 2023-05-02\n"
+            "language: English\n"
+            "tags: [gardening, plants]\n"
+            "---\n"
+            "# Gardening Basics\n"
+        )
+
+        actual = self.subject.try_extract_metadata(file_path)
+
+        self.assertEqual("Gardening Basics", actual.title)
+        self.assertEqual(["Jane Doe", "John Smith"], actual.authors)
+        self.assertEqual(datetime(2023, 5, 2), actual.published_date)
+        self.assertEqual("english", actual.language)
+        self.assertEqual(["gardening", "plants"], actual.keywords)
+
+    def test_returns_none_when_core_fields_are_missing(self):
+        file_path = self._write_file("# Meeting notes\n\nWe talked about the roadmap.\n")
+
+        self.assertIsNone(self.subject.try_extract_metadata(file_path))
+
+    def test_returns_none_when_file_is_empty(self):
+        self.assertIsNone(self.subject.try_extract_metadata(UPLOAD_EMPTY_FILE_PATH))
+
+    def test_extract_metadata_falls_back_to_file_metadata(self):
+        file_path = self._write_file("Just some text without any header.\n", suffix=".txt")
+
+        actual = self.subject.extract_metadata(file_path)
+
+        self.assertEqual(os.path.basename(file_path), actual.file_name)
+        self.assertIsNone(actual.title)
@@ -1,4 +1,6 @@
 import json
+import tempfile
+from dataclasses import replace
 from unittest import TestCase
 from unittest.mock import Mock, patch
 from datetime import datetime
@@ -6,10 +8,17 @@ from freezegun import freeze_time
 
 from openai.types.chat import ChatCompletionMessage
 from openai.types.chat.chat_completion import Choice, ChatCompletion
-
-from home.infrastructure.open_ai_metadata_extractor import OpenAIMetadataExtractor
+from openai.types.completion_usage import CompletionUsage
+
+from home.domain.deadline import Deadline, deadline_scope
+from home.domain.stored_file import StoredFile
+from home.infrastructure.content_hash import hash_file
+from home.infrastructure.file_metadata_cache import FileMetadataCache
+from home.infrastructure.heuristic_metadata_extractor import HeuristicMetadataExtractor
+from home.infrastructure.open_ai_metadata_extractor import OpenAIMetadataExtractor, FIELD_DESCRIPTIONS
+from home.infrastructure.openai_http_client import get_http_client
 from home.tests.test_factory import UPLOAD_OPEN_AI_FILE_METADATA, UPLOAD_FILE_PATH, OPENAI_FILE_METADATA_JSON, \
-    FROZEN_UPLOAD_TIME, UPLOAD_EMPTY_FILE_PATH, UPLOAD_EMPTY_FILE_METADATA
+    FROZEN_UPLOAD_TIME, UPLOAD_EMPTY_FILE_PATH, UPLOAD_EMPTY_FILE_METADATA, UPLOAD_BASE_FILE_METADATA
 
 
 class TestOpenAIMetadataExtractor(TestCase):
@@ -28,7 +37,7 @@ class TestOpenAIMetadataExtractor(TestCase):
 
         self.addCleanup(openai_patcher.stop)
 
-        mock_openai.assert_called_once_with(api_key=self.api_key)
+        mock_openai.assert_called_once_with(api_key=self.api_key, http_client=get_http_client())
 
     def _mock_response(self, content: str):
         mock_message = Mock(spec=ChatCompletionMessage)
@@ -39,6 +48,7 @@ class TestOpenAIMetadataExtractor(TestCase):
 
         mock_response = Mock(spec=ChatCompletion)
         mock_response.choices = [mock_choice]
+        mock_response.usage = CompletionUsage(prompt_tokens=1000, completion_tokens=100, total_tokens=1100)
 
         return mock_response
 
@@ -86,3 +96,93 @@ class TestOpenAIMetadataExtractor(TestCase):
         call_args = self.mock_client.chat.completions.create.call_args
         self.assertEqual(call_args.kwargs['model'], 'gpt-4o-mini')
         self.assertEqual(call_args.kwargs['temperature'], 0)
+
+    @freeze_time(FROZEN_UPLOAD_TIME)
+    def test_extract_metadata_uses_stored_file_sample(self):
+        mock_response = self._mock_response(json.dumps(OPENAI_FILE_METADATA_JSON))
+        self.mock_client.chat.completions.create.return_value = mock_response
+        stored_file = StoredFile(
+            file_path=UPLOAD_FILE_PATH,
+            content_hash="abc123",
+            file_size=UPLOAD_BASE_FILE_METADATA.file_size,
+            head=b"Stored head of the book",
+            tail=b"stored tail of the book",
+        )
+
+        with patch('home.infrastructure.open_ai_metadata_extractor.read_text_sample') as mock_read_text_sample:
+            actual = self.subject.extract_metadata(UPLOAD_FILE_PATH, stored_file=stored_file)
+
+        mock_read_text_sample.assert_not_called()
+        self.assertEqual(replace(UPLOAD_OPEN_AI_FILE_METADATA, content_hash="abc123"), actual)
+
+        prompt = self.mock_client.chat.completions.create.call_args.kwargs['messages'][1]['content']
+        self.assertIn("Stored head of the book\n\n[... middle content omitted ...]\n\nstored tail of the book", prompt)
+
+    def test_extract_metadata_times_out_with_the_upload_deadline(self):
+        self.mock_client.chat.completions.create.return_value = self._mock_response(
+            json.dumps(OPENAI_FILE_METADATA_JSON))
+
+        with deadline_scope(Deadline.after(2)):
+            self.subject.extract_metadata(UPLOAD_FILE_PATH)
+
+        timeout = self.mock_client.chat.completions.create.call_args.kwargs["timeout"]
+        self.assertTrue(0 < timeout <= 2)
+
+    def test_extract_metadata_is_cached_by_content_hash(self):
+        mock_response = self._mock_response(json.dumps(OPENAI_FILE_METADATA_JSON))
+        self.mock_client.chat.completions.create.return_value = mock_response
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        self.subject.cache = FileMetadataCache(cache_dir.name)
+
+        first = self.subject.extract_metadata(UPLOAD_FILE_PATH)
+        second = self.subject.extract_metadata(UPLOAD_FILE_PATH)
+
+        self.mock_client.chat.completions.create.assert_called_once()
+        self.assertEqual(first.content_hash, hash_file(UPLOAD_FILE_PATH))
+        self.assertEqual(replace(first, upload_time=second.upload_time), second)
+        self.assertEqual(UPLOAD_OPEN_AI_FILE_METADATA.title, second.title)
+        self.assertEqual(UPLOAD_OPEN_AI_FILE_METADATA.published_date, second.published_date)
+
+    def test_extract_metadata_asks_the_llm_only_for_what_the_fast_path_did_not_find(self):
+        self.subject.fast_path = HeuristicMetadataExtractor()
+        self.mock_client.chat.completions.create.return_value = self._mock_response(json.dumps({
+            "category": "Fiction",
+            "keywords": ["gothic", "monster"],
+            "abstract": "A scientist creates a living being.",
+            "document_type": "Novel",
+            "subject_area": "Literature",
+            "editor": None,
+        }))
+
+        actual = self.subject.extract_metadata(UPLOAD_FILE_PATH)
+
+        prompt = self.mock_client.chat.completions.create.call_args.kwargs['messages'][1]['content']
+        self.assertIn('"abstract"', prompt)
+        self.assertNotIn('"title"', prompt)
+        self.assertNotIn('"published_date"', prompt)
+        self.assertIn("- title: Frankenstein; Or, The Modern Prometheus", prompt)
+        self.assertEqual("Frankenstein; Or, The Modern Prometheus", actual.title)
+        self.assertEqual(["Mary Wollstonecraft Shelley"], actual.authors)
+        self.assertEqual("english", actual.language)
+        self.assertEqual(datetime(1993, 10, 1), actual.published_date)
+        self.assertEqual("A scientist creates a living being.", actual.abstract)
+        self.assertEqual("Fiction", actual.category)
+
+    @patch('home.infrastructure.open_ai_metadata_extractor.emit')
+    def test_extract_metadata_reports_the_fields_the_fast_path_took_from_the_header(self, mock_emit):
+        self.subject.fast_path = HeuristicMetadataExtractor()
+        self.mock_client.chat.completions.create.return_value = self._mock_response(json.dumps({
+            "category": "Fiction",
+        }))
+
+        self.subject.extract_metadata(UPLOAD_FILE_PATH)
+
+        prompt = self.mock_client.chat.completions.create.call_args.kwargs['messages'][1]['content']
+        mock_emit.assert_called_once()
+        event, props = mock_emit.call_args.args
+        self.assertEqual("metadata_fast_path", event)
+        self.assertFalse(props["llm_skipped"])
+        self.assertGreaterEqual(props["header_fields"], 4)
+        self.assertEqual(props["llm_fields"], sum(f'"{field}":' in prompt for field in FIELD_DESCRIPTIONS))
+        self.assertEqual(props["header_fields"] + props["llm_fields"], len(FIELD_DESCRIPTIONS))
@@ -0,0 +1,56 @@
+import asyncio
+from unittest import TestCase
+from unittest.mock import patch
+
+import httpx
+from openai import OpenAI
+
+from home.infrastructure.openai_http_client import _LoopLocalTransport, _PooledTransport, get_async_http_client, \
+    get_http_client, http_timeout
+
+
+class TestOpenAIHttpClient(TestCase):
+    def test_clients_are_shared_across_the_process(self):
+        self.assertIs(get_http_client(), get_http_client())
+        self.assertIs(get_async_http_client(), get_async_http_client())
+
+    def test_openai_clients_use_the_shared_timeout(self):
+        client = OpenAI(api_key="sk-test", http_client=get_http_client())
+
+        self.assertEqual(client.timeout, http_timeout())
+
+    @patch.dict('os.environ', {'OPENAI_HTTP_TIMEOUT_SECONDS': '20', 'OPENAI_HTTP_CONNECT_TIMEOUT_SECONDS': '2'})
+    def test_timeout_is_configurable(self):
+        self.assertEqual(http_timeout(), httpx.Timeout(20.0, connect=2.0))
+
+    def test_pooled_transport_counts_requests_until_their_response_is_closed(self):
+        transport = _PooledTransport(httpx.MockTransport(lambda request: httpx.Response(200, text="ok")))
+
+        with httpx.Client(transport=transport) as client:
+            with client.stream("GET", "https://api.openai.com/v1/models") as response:
+                self.assertEqual(transport.stats(), {"active": 1, "pools": 1})
+                response.read()
+
+        self.assertEqual(transport.stats(), {"active": 0, "pools": 1})
+
+    def test_async_client_keeps_a_pool_per_event_loop(self):
+        pools = []
+
+        def new_transport():
+            pools.append(httpx.MockTransport(lambda request: httpx.Response(200, text="ok")))
+            return pools[-1]
+
+        transport = _LoopLocalTransport(new_transport)
+        client = httpx.AsyncClient(transport=transport)
+
+        async def get_twice():
+            first = await client.get("https://api.openai.com/v1/models")
+            second = await client.get("https://api.openai.com/v1/models")
+            return first.text, second.text
+
+        # Each asyncio.run is a new loop, like an async view under WSGI
+        self.assertEqual(asyncio.run(get_twice()), ("ok", "ok"))
+        self.assertEqual(asyncio.run(get_twice()), ("ok", "ok"))
+
+        self.assertEqual(len(pools), 2)
+        self.assertEqual(transport.stats()["active"], 0)
@@ -0,0 +1,105 @@
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+from langchain_core.documents import Document
+
+from home.domain.deadline import Deadline, deadline_scope
+from home.domain.dependency_unavailable_error import DependencyUnavailableError
+from home.domain.invalid_document_error import InvalidDocumentError
+from home.infrastructure.openai_http_client import get_http_client
+from home.infrastructure.openai_moderation_document_validator import OpenAIModerationDocumentValidator
+
+
+class TestOpenAIModerationDocumentValidator(TestCase):
+    api_key = "test_api_key"
+
+    subject: OpenAIModerationDocumentValidator
+
+    def setUp(self):
+        openai_patcher = patch('home.infrastructure.openai_moderation_document_validator.OpenAI')
+        mock_openai = openai_patcher.start()
+        self.addCleanup(openai_patcher.stop)
+
+        self.mock_client = Mock()
+        mock_openai.return_value = self.mock_client
+        self.mock_client.moderations.create.side_effect = self._moderate
+
+        self.subject = OpenAIModerationDocumentValidator(self.api_key, batch_size=2, max_concurrency=2)
+
+        mock_openai.assert_called_once_with(api_key=self.api_key, http_client=get_http_client())
+
+    def _moderate(self, model, input, timeout=None):
+        results = []
+        for text in input:
+            categories = Mock()
+            categories.model_dump.return_value = {"violence": "violent" in text, "sexual_minors": "minors" in text}
+            results.append(Mock(flagged=any(categories.model_dump.return_value.values()), categories=categories))
+        return Mock(results=results)
+
+    def test_validate_documents_batches_chunks(self):
+        documents = [Document(f"Chunk {i}") for i in range(5)]
+
+        self.subject.validate_documents(documents)
+
+        self.assertEqual(3, self.mock_client.moderations.create.call_count)
+        sent = [text for call in self.mock_client.moderations.create.call_args_list for text in call.kwargs['input']]
+        self.assertEqual(sorted(sent), sorted(doc.page_content for doc in documents))
+        for call in self.mock_client.moderations.create.call_args_list:
+            self.assertEqual(call.kwargs['model'], "omni-moderation-latest")
+            self.assertLessEqual(len(call.kwargs['input']), 2)
+
+    def test_validate_documents_caches_results_per_chunk(self):
+        self.subject.validate_documents([Document("Chunk 1"), Document("Chunk 2")])
+        self.mock_client.moderations.create.reset_mock()
+
+        self.subject.validate_documents([Document("Chunk 1"), Document("Chunk 2"), Document("Chunk 2")])
+        self.mock_client.moderations.create.assert_not_called()
+
+        self.subject.validate_documents([Document("Chunk 1"), Document("Chunk 3")])
+        self.mock_client.moderations.create.assert_called_once()
+        self.assertEqual(["Chunk 3"], self.mock_client.moderations.create.call_args.kwargs['input'])
+
+    def test_validate_documents_raises_when_a_chunk_is_flagged(self):
+        documents = [Document("Chunk 1"), Document("A violent chunk"), Document("Chunk 3")]
+
+        with self.assertRaises(InvalidDocumentError) as context:
+            self.subject.validate_documents(documents)
+
+        self.assertIn("violence", str(context.exception))
+
+        # Flagged results are cached too
+        self.mock_client.moderations.create.reset_mock()
+        with self.assertRaises(InvalidDocumentError):
+            self.subject.validate_documents([Document("A violent chunk")])
+        self.mock_client.moderations.create.assert_not_called()
+
+    def test_validate_documents_accepts_a_few_flagged_chunks(self):
+        documents = [Document(f"Chunk {i}") for i in range(9)] + [Document("A violent chunk")]
+
+        self.subject.validate_documents(documents)
+
+    def test_validate_documents_rejects_a_zero_tolerance_category_in_any_chunk(self):
+        documents = [Document(f"Chunk {i}") for i in range(9)] + [Document("A chunk about minors")]
+
+        with self.assertRaises(InvalidDocumentError) as context:
+            self.subject.validate_documents(documents)
+
+        self.assertIn("sexual_minors", str(context.exception))
+
+    def test_validate_documents_sends_the_time_left_to_the_deadline(self):
+        with deadline_scope(Deadline.after(10)):
+            self.subject.validate_documents([Document("Chunk 1"), Document("Chunk 2"), Document("Chunk 3")])
+
+        for call in self.mock_client.moderations.create.call_args_list:
+            self.assertTrue(0 < call.kwargs['timeout'] <= 10)
+
+    def test_validate_documents_fails_fast_while_moderation_is_unavailable(self):
+        self.mock_client.moderations.create.side_effect = RuntimeError("OpenAI is down")
+        for _ in range(self.subject.breaker.failure_threshold):
+            with self.assertRaises(RuntimeError):
+                self.subject.validate_documents([Document("Chunk 1")])
+        self.mock_client.moderations.create.reset_mock()
+
+        with self.assertRaises(DependencyUnavailableError):
+            self.subject.validate_documents([Document("Chunk 1")])
+        self.mock_client.moderations.create.assert_not_called()
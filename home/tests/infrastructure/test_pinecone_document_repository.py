@@ -1,11 +1,19 @@
+import asyncio
+import multiprocessing
+from dataclasses import replace
 from unittest import TestCase
-from unittest.mock import Mock, patch
+from unittest.mock import MagicMock, Mock, patch
 
 from langchain_core.documents import Document
 from openai.types.chat import ChatCompletionMessage
 from openai.types.chat.chat_completion import Choice, ChatCompletion
 from pinecone import ServerlessSpec
+from urllib3.exceptions import MaxRetryError, ReadTimeoutError
 
+from home.domain.deadline import Deadline, deadline_scope
+from home.domain.deadline_exceeded_error import DeadlineExceededError
+from home.domain.dependency_unavailable_error import DependencyUnavailableError
+from home.domain.token_usage import TokenUsage
 from home.infrastructure.pinecone_document_repository import PineconeDocumentRepository
 from home.tests.test_factory import UPLOAD_FILE_PATH, UPLOAD_BASE_FILE_METADATA
 
@@ -78,13 +86,8 @@ class TestPineconeDocumentRepository(TestCase):
 
         return mock_response
 
-    @patch('home.infrastructure.pinecone_document_repository.PineconeVectorStore.from_documents')
     @patch('home.infrastructure.pinecone_document_repository.RecursiveCharacterTextSplitter')
-    def test_upload_document(
-            self,
-            mock_text_splitter_class,
-            mock_vector_store_from_documents
-    ):
+    def test_upload_document(self, mock_text_splitter_class):
         loaded_docs = [Document(page_content="Full document text", metadata={"source": "Frankenstein.txt"})]
 
         def mock_split_documents(docs):
@@ -99,8 +102,7 @@ class TestPineconeDocumentRepository(TestCase):
         mock_text_splitter.split_documents.side_effect = mock_split_documents
         mock_text_splitter_class.return_value = mock_text_splitter
 
-        mock_vector_store = Mock()
-        mock_vector_store_from_documents.return_value = mock_vector_store
+        self.mock_embeddings.embed_documents.return_value = [[0.1, 0.2], [0.3, 0.4]]
 
         with patch.object(self.subject, 'load_document', return_value=loaded_docs):
             result = self.subject.upload_document(UPLOAD_FILE_PATH, UPLOAD_BASE_FILE_METADATA)
@@ -117,10 +119,12 @@ class TestPineconeDocumentRepository(TestCase):
 
         mock_text_splitter.split_documents.assert_called_once_with(loaded_docs)
 
-        mock_vector_store_from_documents.assert_called_once()
-        call_kwargs = mock_vector_store_from_documents.call_args.kwargs
-        self.assertEqual(call_kwargs['index_name'], self.index_name)
-        self.assertEqual(len(call_kwargs['documents']), 2)
+        self.mock_embeddings.embed_documents.assert_called_once_with(["This is chunk 1", "This is chunk 2"])
+        self.mock_index.upsert.assert_called_once()
+        vectors = self.mock_index.upsert.call_args.kwargs['vectors']
+        self.assertEqual([vector[0] for vector in vectors], [doc.id for doc in result])
+        self.assertEqual([vector[1] for vector in vectors], [[0.1, 0.2], [0.3, 0.4]])
+        self.assertEqual(vectors[0][2]['text'], "This is chunk 1")
 
         for i, doc in enumerate(result):
             self.assertEqual(doc.metadata['file_name'], 'Frankenstein.txt')
@@ -134,6 +138,100 @@ class TestPineconeDocumentRepository(TestCase):
             self.assertIn('modified_time', doc.metadata)
             self.assertIn('upload_time', doc.metadata)
 
+    def test_update_document_metadata(self):
+        documents = [
+            Document(id="abc#0", page_content="This is chunk 1", metadata={"file_name": "Frankenstein.txt"}),
+            Document(id="abc#1", page_content="This is chunk 2", metadata={"file_name": "Frankenstein.txt"}),
+        ]
+        file_metadata = replace(UPLOAD_BASE_FILE_METADATA, title="Frankenstein", authors=["Mary Shelley"])
+
+        result = self.subject.update_document_metadata(documents, file_metadata)
+
+        self.assertEqual(result, documents)
+        for doc in result:
+            self.assertEqual(doc.metadata['title'], "Frankenstein")
+            self.assertEqual(doc.metadata['authors'], "Mary Shelley")
+        self.mock_index.update.assert_not_called()
+
+    def test_add_embedded_documents_upserts_in_batches(self):
+        documents = [Document(id=f"abc#{i}", page_content=f"chunk {i}", metadata={"title": "Frankenstein"})
+                     for i in range(250)]
+
+        self.subject.add_embedded_documents(documents, [[0.1, 0.2]] * 250)
+
+        self.assertEqual([len(call.kwargs['vectors']) for call in self.mock_index.upsert.call_args_list],
+                         [100, 100, 50])
+        self.assertEqual(self.subject.get_corpus_version(), 1)
+
+    def test_add_embedded_documents_removes_the_document_when_an_upsert_fails(self):
+        documents = [Document(id="abc#0", page_content="chunk 0"), Document(id="abc#1", page_content="chunk 1")]
+        self.mock_index.upsert.return_value.get.side_effect = RuntimeError("Pinecone is down")
+
+        with self.assertRaises(RuntimeError):
+            self.subject.add_embedded_documents(documents, [[0.1, 0.2], [0.3, 0.4]])
+
+        self.mock_index.delete.assert_called_once_with(ids=["abc#0", "abc#1"])
+        self.assertEqual(self.subject.get_corpus_version(), 0)
+
+    def test_add_embedded_documents_removes_a_large_document_in_batches(self):
+        documents = [Document(id=f"abc#{i}", page_content=f"chunk {i}") for i in range(250)]
+        self.mock_index.upsert.return_value.get.side_effect = RuntimeError("Pinecone is down")
+
+        with self.assertRaises(RuntimeError):
+            self.subject.add_embedded_documents(documents, [[0.1, 0.2]] * 250)
+
+        deleted = [call.kwargs['ids'] for call in self.mock_index.delete.call_args_list]
+        self.assertEqual([len(ids) for ids in deleted], [100, 100, 50])
+        self.assertEqual(sum(deleted, []), [doc.id for doc in documents])
+
+    def test_add_embedded_documents_times_out_with_the_upload_deadline(self):
+        documents = [Document(id="abc#0", page_content="chunk 0")]
+
+        with deadline_scope(Deadline.after(2)):
+            self.subject.add_embedded_documents(documents, [[0.1, 0.2]])
+
+        self.assertTrue(0 < self.mock_index.upsert.call_args.kwargs["_request_timeout"] <= 2)
+        self.assertTrue(0 < self.mock_index.upsert.return_value.get.call_args.kwargs["timeout"] <= 2)
+
+    def test_add_embedded_documents_removes_the_document_when_the_deadline_passes(self):
+        documents = [Document(id="abc#0", page_content="chunk 0")]
+        self.mock_index.upsert.return_value.get.side_effect = multiprocessing.TimeoutError()
+
+        with deadline_scope(Deadline.after(2)), self.assertRaises(DeadlineExceededError) as raised:
+            self.subject.add_embedded_documents(documents, [[0.1, 0.2]])
+
+        self.assertEqual(raised.exception.stage, "vector_upsert")
+        self.mock_index.delete.assert_called_once_with(ids=["abc#0"])
+        self.assertEqual(self.subject.get_corpus_version(), 0)
+
+    def test_embed_documents_times_out_with_the_upload_deadline(self):
+        self.mock_embeddings.embed_documents.return_value = [[0.1, 0.2]]
+
+        with deadline_scope(Deadline.after(2)):
+            self.subject.embed_documents([Document(page_content="chunk 0")])
+
+        self.assertTrue(0 < self.mock_embeddings.embed_documents.call_args.kwargs["timeout"] <= 2)
+
+    def test_embed_documents_is_admitted_and_retried_like_the_queries(self):
+        self.subject.embedding_admission = MagicMock()
+        self.mock_embeddings.embed_documents.side_effect = [ConnectionError("reset"), [[0.1, 0.2]]]
+
+        with patch("home.infrastructure.hedged_caller.time.sleep"):
+            embeddings = self.subject.embed_documents([Document(page_content="chunk 0")])
+
+        self.assertEqual(embeddings, [[0.1, 0.2]])
+        self.subject.embedding_admission.admit.assert_called_once()
+        self.assertEqual(self.mock_embeddings.embed_documents.call_count, 2)
+
+    def test_embed_documents_fails_fast_while_the_embeddings_circuit_is_open(self):
+        for _ in range(self.subject.embeddings_breaker.failure_threshold):
+            self.subject.embeddings_breaker.record_failure()
+
+        with self.assertRaises(DependencyUnavailableError):
+            self.subject.embed_documents([Document(page_content="chunk 0")])
+
+        self.mock_embeddings.embed_documents.assert_not_called()
+
     def test_similarity_search(
             self,
     ):
@@ -147,3 +245,85 @@ class TestPineconeDocumentRepository(TestCase):
         self.assertEqual(actual, answer)
 
         self.mock_vector_store.similarity_search.assert_called_once_with(question, 5)
+
+    def test_embed_query(self):
+        self.mock_embeddings.embed_query.return_value = [0.1, 0.2]
+
+        self.assertEqual([0.1, 0.2], self.subject.embed_query("What is the meaning of life?"))
+
+        self.mock_embeddings.embed_query.assert_called_once_with("What is the meaning of life?")
+
+    @patch('home.infrastructure.pinecone_document_repository.record_usage')
+    @patch('home.infrastructure.pinecone_document_repository.token_counter')
+    def test_embed_query_records_the_tokens_of_the_query(self, mock_token_counter, mock_record_usage):
+        mock_token_counter.return_value = lambda text: len(text.split())
+        self.mock_embeddings.embed_query.return_value = [0.1, 0.2]
+
+        self.subject.embed_query("What is the meaning of life?")
+
+        mock_token_counter.assert_called_once_with("text-embedding-3-small")
+        mock_record_usage.assert_called_once_with("query_embedding", "text-embedding-3-small", TokenUsage(prompt=6))
+
+    def test_similarity_search_by_vector(self):
+        self.mock_index.query.return_value = {"matches": [
+            {"id": "abc#0", "score": 0.87, "metadata": {"text": "42", "source": "Frankenstein.txt"}},
+            {"id": "abc#1", "score": 0.5, "metadata": {"source": "Frankenstein.txt"}},
+        ]}
+
+        actual = self.subject.similarity_search_by_vector([0.1, 0.2], 5)
+
+        self.assertEqual(actual, [
+            Document(id="abc#0", page_content="42", metadata={"source": "Frankenstein.txt", "score": 0.87})
+        ])
+        self.mock_index.query.assert_called_once_with(vector=[0.1, 0.2], top_k=5, include_metadata=True)
+
+    def test_similarity_search_by_vector_times_out_with_the_request_deadline(self):
+        self.mock_index.query.return_value = {"matches": []}
+
+        with deadline_scope(Deadline.after(2)):
+            self.subject.similarity_search_by_vector([0.1, 0.2], 5)
+
+        timeout = self.mock_index.query.call_args.kwargs["_request_timeout"]
+        self.assertTrue(0 < timeout <= 2)
+
+    def test_similarity_search_by_vector_raises_deadline_exceeded_when_the_query_times_out(self):
+        self.mock_index.query.side_effect = MaxRetryError(None, "/query", ReadTimeoutError(None, "/query", "timed out"))
+
+        with deadline_scope(Deadline.after(2)):
+            with self.assertRaises(DeadlineExceededError) as raised:
+                self.subject.similarity_search_by_vector([0.1, 0.2], 5)
+
+        self.assertEqual(raised.exception.stage, "vector_search")
+        # Pinecone used up the time it was given, which counts against it
+        self.assertEqual(self.subject.vector_store_breaker.failures, 1)
+
+    def test_similarity_search_by_vector_is_not_sent_past_the_deadline(self):
+        with deadline_scope(Deadline.after(-1)):
+            with self.assertRaises(DeadlineExceededError):
+                self.subject.similarity_search_by_vector([0.1, 0.2], 5)
+
+        self.mock_index.query.assert_not_called()
+
+    def test_asimilarity_search_by_vector_can_search_again(self):
+        self.mock_index.query.side_effect = lambda **kwargs: {"matches": [
+            {"id": "abc#0", "score": 0.9, "metadata": {"text": "Existing content", "source": "Frankenstein.txt"}},
+        ]}
+
+        async def search_twice():
+            first = await self.subject.asimilarity_search_by_vector([0.1, 0.2], 5)
+            second = await self.subject.asimilarity_search_by_vector([0.3, 0.4], 5)
+            return first, second
+
+        first, second = asyncio.run(search_twice())
+
+        self.assertEqual(["Existing content"], [doc.page_content for doc in first])
+        self.assertEqual(["Existing content"], [doc.page_content for doc in second])
+        self.assertEqual(2, self.mock_index.query.call_count)
+        self.mock_vector_store.asimilarity_search_by_vector_with_score.assert_not_called()
+
+    def test_asimilarity_search_by_vector_raises_when_the_deadline_passes(self):
+        with deadline_scope(Deadline(expires_at=0.0)):
+            with self.assertRaises(DeadlineExceededError):
+                asyncio.run(self.subject.asimilarity_search_by_vector([0.1, 0.2], 5))
+
+        self.mock_index.query.assert_not_called()
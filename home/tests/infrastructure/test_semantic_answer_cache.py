@@ -0,0 +1,49 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+from home.domain.quoted_answer import QuotedAnswer
+from home.infrastructure.semantic_answer_cache import SemanticAnswerCache
+
+
+class TestSemanticAnswerCache(TestCase):
+    def setUp(self):
+        self.subject = SemanticAnswerCache(threshold=0.9, max_size=2, ttl_seconds=60, audit_rate=0)
+        self.answer = QuotedAnswer(answer="Answer", citations=[])
+
+    def test_get_returns_answer_of_similar_question(self):
+        self.subject.set("sources", [1.0, 0.0], "Who wrote it?", self.answer, 1200.0)
+
+        hit = self.subject.get("sources", [0.95, 0.1])
+
+        self.assertEqual(self.answer, hit.answer)
+        self.assertEqual("Who wrote it?", hit.question)
+        self.assertEqual(1200.0, hit.generation_ms)
+        self.assertGreater(hit.similarity, 0.9)
+
+    def test_get_returns_none_below_threshold(self):
+        self.subject.set("sources", [1.0, 0.0], "Who wrote it?", self.answer, 1200.0)
+
+        self.assertIsNone(self.subject.get("sources", [0.5, 0.5]))
+
+    def test_get_returns_none_for_other_sources(self):
+        self.subject.set("sources", [1.0, 0.0], "Who wrote it?", self.answer, 1200.0)
+
+        self.assertIsNone(self.subject.get("other sources", [1.0, 0.0]))
+
+    def test_evicts_least_recently_used_sources(self):
+        self.subject.set("a", [1.0, 0.0], "A?", self.answer, 1.0)
+        self.subject.set("b", [1.0, 0.0], "B?", self.answer, 1.0)
+        self.subject.get("a", [1.0, 0.0])
+        self.subject.set("c", [1.0, 0.0], "C?", self.answer, 1.0)
+
+        self.assertIsNotNone(self.subject.get("a", [1.0, 0.0]))
+        self.assertIsNone(self.subject.get("b", [1.0, 0.0]))
+
+    @patch('home.infrastructure.semantic_answer_cache.time.time')
+    def test_expires_after_ttl(self, mock_time):
+        mock_time.return_value = 1000
+        self.subject.set("sources", [1.0, 0.0], "Who wrote it?", self.answer, 1200.0)
+
+        mock_time.return_value = 1061
+
+        self.assertIsNone(self.subject.get("sources", [1.0, 0.0]))
@@ -0,0 +1,142 @@
+import asyncio
+import threading
+import time
+from unittest import TestCase
+
+from home.infrastructure.single_flight import SingleFlight, AsyncSingleFlight
+
+
+class TestSingleFlight(TestCase):
+    def setUp(self):
+        self.subject = SingleFlight()
+        self.release = threading.Event()
+        self.calls = 0
+
+    def _slow_call(self):
+        self.calls += 1
+        self.release.wait(timeout=5)
+        return "result"
+
+    def _run_concurrently(self, count: int, fn) -> list:
+        outcomes = []
+
+        def call():
+            try:
+                outcomes.append(self.subject.do("key", fn))
+            except Exception as e:
+                outcomes.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        # Let every caller reach the in-flight call before it completes
+        time.sleep(0.2)
+        self.release.set()
+        for thread in threads:
+            thread.join(timeout=5)
+        return outcomes
+
+    def test_concurrent_calls_share_one_run(self):
+        outcomes = self._run_concurrently(3, self._slow_call)
+
+        self.assertEqual(1, self.calls)
+        self.assertEqual(["result"] * 3, [result for result, _ in outcomes])
+        self.assertEqual([False, True, True], sorted(shared for _, shared in outcomes))
+
+    def test_callers_run_their_own_call_when_the_shared_one_fails(self):
+        def failing_call():
+            self._slow_call()
+            raise ValueError("boom")
+
+        def own_call():
+            return "own result"
+
+        outcomes = []
+
+        def call(fn):
+            try:
+                outcomes.append(self.subject.do("key", fn))
+            except Exception as e:
+                outcomes.append(e)
+
+        leader = threading.Thread(target=call, args=(failing_call,))
+        leader.start()
+        time.sleep(0.1)
+        follower = threading.Thread(target=call, args=(own_call,))
+        follower.start()
+        time.sleep(0.1)
+        self.release.set()
+        leader.join(timeout=5)
+        follower.join(timeout=5)
+
+        self.assertEqual(1, self.calls)
+        self.assertIsInstance(outcomes[0], ValueError)
+        self.assertEqual(("own result", False), outcomes[1])
+
+    def test_sequential_calls_run_again(self):
+        self.release.set()
+
+        self.subject.do("key", self._slow_call)
+        result, shared = self.subject.do("key", self._slow_call)
+
+        self.assertEqual(2, self.calls)
+        self.assertEqual("result", result)
+        self.assertFalse(shared)
+
+
+class TestAsyncSingleFlight(TestCase):
+    def setUp(self):
+        self.subject = AsyncSingleFlight()
+        self.calls = 0
+
+    async def _slow_call(self):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        return "result"
+
+    def test_concurrent_calls_share_one_run(self):
+        async def run():
+            return await asyncio.gather(*[self.subject.do("key", self._slow_call) for _ in range(3)])
+
+        outcomes = asyncio.run(run())
+
+        self.assertEqual(1, self.calls)
+        self.assertEqual([("result", False), ("result", True), ("result", True)], outcomes)
+
+    def test_callers_run_their_own_call_when_the_shared_one_fails(self):
+        async def failing_call():
+            await self._slow_call()
+            raise ValueError("boom")
+
+        async def own_call():
+            return "own result"
+
+        async def run():
+            return await asyncio.gather(self.subject.do("key", failing_call), self.subject.do("key", own_call),
+                                        return_exceptions=True)
+
+        outcomes = asyncio.run(run())
+
+        self.assertEqual(1, self.calls)
+        self.assertIsInstance(outcomes[0], ValueError)
+        self.assertEqual(("own result", False), outcomes[1])
+
+    def test_callers_run_their_own_call_when_the_shared_one_is_cancelled(self):
+        async def run():
+            leader = asyncio.create_task(self.subject.do("key", self._slow_call))
+            await asyncio.sleep(0)
+            follower = asyncio.create_task(self.subject.do("key", self._slow_call))
+            await asyncio.sleep(0)
+            leader.cancel()
+            return await follower
+
+        self.assertEqual(("result", False), asyncio.run(run()))
+        self.assertEqual(2, self.calls)
+
+    def test_sequential_calls_run_again(self):
+        async def run():
+            await self.subject.do("key", self._slow_call)
+            return await self.subject.do("key", self._slow_call)
+
+        self.assertEqual(("result", False), asyncio.run(run()))
+        self.assertEqual(2, self.calls)
@@ -0,0 +1,55 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from home.domain.stored_file import StoredFile
+from home.infrastructure.text_sample import read_text_sample, sample_text, stored_text_sample, decode_head, \
+    decode_tail, MIDDLE_OMITTED
+from home.tests.test_factory import UPLOAD_FILE_PATH
+
+
+class TestTextSample(TestCase):
+
+    def _write_file(self, content: bytes) -> str:
+        file = tempfile.NamedTemporaryFile(delete=False)
+        file.write(content)
+        file.close()
+        self.addCleanup(os.unlink, file.name)
+        return file.name
+
+    def test_read_text_sample_matches_full_read(self):
+        with open(UPLOAD_FILE_PATH, 'r', encoding='utf-8', errors='ignore') as f:
+            expected = sample_text(f.read(), 12000)
+
+        self.assertEqual(expected, read_text_sample(UPLOAD_FILE_PATH, 12000))
+
+    def test_read_text_sample_returns_small_file_whole(self):
+        file_path = self._write_file("Small content é".encode())
+
+        self.assertEqual("Small content é", read_text_sample(file_path, 100))
+
+    def test_read_text_sample_cuts_on_utf8_boundaries(self):
+        file_path = self._write_file(("é" * 100).encode())
+
+        actual = read_text_sample(file_path, 10)
+
+        self.assertEqual("é" * 6 + MIDDLE_OMITTED + "é" * 4, actual)
+
+    def test_decode_drops_partial_characters(self):
+        data = "aéb€".encode()
+
+        self.assertEqual("a", decode_head(data[:2]))
+        self.assertEqual("b€", decode_tail(data[2:]))
+        self.assertEqual("€", decode_tail(data[-3:]))
+        self.assertEqual("", decode_tail(data[-2:]))
+
+    def test_stored_text_sample_uses_head_and_tail(self):
+        stored_file = StoredFile(
+            file_path="unused",
+            content_hash="abc",
+            file_size=1000,
+            head="Beginning of the text".encode(),
+            tail="end of the text".encode(),
+        )
+
+        self.assertEqual("Beginn" + MIDDLE_OMITTED + "text", stored_text_sample(stored_file, 10))
@@ -0,0 +1,83 @@
+from unittest import TestCase
+from unittest.mock import patch
+
+from home.domain.quota_exceeded_error import QuotaExceededError
+from home.infrastructure.usage_budget import UsageBudget
+
+
+class TestUsageBudget(TestCase):
+    def setUp(self):
+        self.subject = UsageBudget(session_tokens=1000, session_requests=2, window_seconds=60)
+
+    def test_acquire_requests_rejects_requests_over_the_session_budget(self):
+        self.subject.acquire_requests("session")
+        self.subject.acquire_requests("session")
+
+        with self.assertRaises(QuotaExceededError) as context:
+            self.subject.acquire_requests("session")
+
+        self.assertEqual((context.exception.scope, context.exception.resource), ("session", "requests"))
+        self.assertTrue(1 <= context.exception.retry_after_seconds <= 60)
+        self.subject.acquire_requests("other session")
+
+    def test_acquire_requests_counts_a_batch_as_its_questions(self):
+        with self.assertRaises(QuotaExceededError):
+            self.subject.acquire_requests("session", 3)
+
+        self.subject.acquire_requests("session", 2)
+
+    def test_max_requests_is_the_smallest_request_budget(self):
+        self.assertEqual(self.subject.max_requests(), 2)
+        self.assertEqual(UsageBudget(session_requests=5, global_requests=3).max_requests(), 3)
+
+    def test_session_out_of_tokens_is_turned_away(self):
+        self.subject.charge_tokens("session", 1000)
+
+        with self.assertRaises(QuotaExceededError) as context:
+            self.subject.acquire_requests("session")
+        with self.assertRaises(QuotaExceededError):
+            self.subject.check_tokens("session", "generate")
+
+        self.assertEqual(context.exception.resource, "tokens")
+
+    def test_check_tokens_rejects_a_call_larger_than_what_is_left(self):
+        self.subject.charge_tokens("session", 600)
+
+        self.subject.check_tokens("session", "document_embedding", 400)
+        with self.assertRaises(QuotaExceededError):
+            self.subject.check_tokens("session", "document_embedding", 401)
+
+    def test_global_budget_is_shared_by_every_session(self):
+        subject = UsageBudget(session_tokens=1000, global_tokens=1500, window_seconds=60)
+        subject.charge_tokens("session", 800)
+        subject.charge_tokens("other session", 800)
+
+        with self.assertRaises(QuotaExceededError) as context:
+            subject.check_tokens("new session", "generate")
+
+        self.assertEqual(context.exception.scope, "global")
+
+    @patch('home.infrastructure.usage_budget.time.monotonic')
+    def test_usage_expires_after_the_window(self, mock_monotonic):
+        mock_monotonic.return_value = 1000.0
+        self.subject.charge_tokens("session", 1000)
+        mock_monotonic.return_value = 1030.0
+
+        with self.assertRaises(QuotaExceededError) as context:
+            self.subject.check_tokens("session", "generate")
+        self.assertEqual(context.exception.retry_after_seconds, 30)
+
+        mock_monotonic.return_value = 1060.0
+        self.subject.check_tokens("session", "generate")
+
+    def test_quota_shows_what_is_used_and_left(self):
+        self.subject.acquire_requests("session")
+        self.subject.charge_tokens("session", 250)
+
+        quota = self.subject.quota("session")
+
+        self.assertEqual(quota["session"], {
+            "tokens": {"limit": 1000, "used": 250, "remaining": 750},
+            "requests": {"limit": 2, "used": 1, "remaining": 1},
+        })
+        self.assertEqual(quota["global"]["tokens"], {"limit": None, "used": 250, "remaining": None})